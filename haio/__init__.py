@@ -1,6 +1,7 @@
 from .common import *
 from .haio_client import *
 
+from .cache_io import *
 from .worker_io import *
 
 from .types import *
@@ -0,0 +1,7 @@
+from .blob_store import *
+from .common import *
+from .json_cache_io import *
+from .jsonl_cache_io import *
+from .memory_cache_io import *
+from .sqlite_cache_io import *
+from .types import *
@@ -0,0 +1,106 @@
+from contextlib import contextmanager
+from typing import Iterable, Iterator
+import hashlib
+import os
+
+from haio.types import DataList
+from haio.cache_io.common import atomic_write, file_lock
+from haio.cache_io.types import Cache_IO
+
+
+blob_ref_prefix = "haio-blob:"
+
+
+# data_listの大きな要素(画像のdata URLなど)を内容のハッシュをファイル名として一度だけ保存し、
+# キャッシュには "haio-blob:<digest>" の参照だけを残す
+class Blob_Store:
+    def __init__(self, blob_dir: str, min_size: int = 4096) -> None:
+        self.blob_dir = blob_dir
+        # これより短い要素はそのままキャッシュに保存する
+        self.min_size = min_size
+
+    def _get_blob_path(self, digest: str) -> str:
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    # blobの保存からキャッシュへの書き込みまでをshared、未参照のblobの削除をexclusiveで囲み、
+    # 他のプロセスが書き込み中の参照先を消さないようにする
+    @contextmanager
+    def lock(self, shared: bool = False) -> Iterator[None]:
+        os.makedirs(self.blob_dir, exist_ok=True)
+        with file_lock(os.path.join(self.blob_dir, ".lock"), shared=shared):
+            yield
+
+    # data_listが参照する(保存すれば参照する)blobのdigestを返す
+    def get_digests(self, data_list: DataList) -> set[str]:
+        digests: set[str] = set()
+        for item in data_list:
+            if not isinstance(item, str):
+                continue
+            if item.startswith(blob_ref_prefix):
+                digests.add(item[len(blob_ref_prefix) :])
+            elif len(item) >= self.min_size:
+                digests.add(hashlib.sha256(item.encode()).hexdigest())
+        return digests
+
+    def get_size(self, digest: str) -> int:
+        try:
+            return os.path.getsize(self._get_blob_path(digest))
+        except FileNotFoundError:
+            return 0
+
+    def put(self, item: str) -> str:
+        if not isinstance(item, str) or len(item) < self.min_size:
+            return item
+        digest = hashlib.sha256(item.encode()).hexdigest()
+        blob_path = self._get_blob_path(digest)
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            atomic_write(blob_path, item)
+        return blob_ref_prefix + digest
+
+    def get(self, item: str) -> str:
+        if not isinstance(item, str) or not item.startswith(blob_ref_prefix):
+            return item
+        with open(self._get_blob_path(item[len(blob_ref_prefix) :]), "r") as f:
+            return f.read()
+
+    def put_data_list(self, data_list: DataList) -> DataList:
+        return [self.put(item) for item in data_list]
+
+    def get_data_list(self, data_list: DataList) -> DataList:
+        return [self.get(item) for item in data_list]
+
+    # キャッシュから参照されていないblobを削除する
+    # digestsを指定すればその中だけを、keepに含まれるもの(書き込み前の回答が参照するものなど)を除いて削除する
+    def remove_unreferenced(
+        self,
+        cache_io: Cache_IO,
+        digests: set[str] | None = None,
+        keep: Iterable[str] = (),
+    ) -> int:
+        removed_count = 0
+        if not os.path.isdir(self.blob_dir):
+            return removed_count
+        with self.lock():
+            referenced_digests = set(keep)
+            for question_template_hash in cache_io.question_template_hashes():
+                for data_list in cache_io.iter_data_lists(question_template_hash):
+                    for item in data_list:
+                        if isinstance(item, str) and item.startswith(blob_ref_prefix):
+                            referenced_digests.add(item[len(blob_ref_prefix) :])
+
+            if digests is None:
+                digests = {
+                    digest
+                    for shard in os.listdir(self.blob_dir)
+                    if os.path.isdir(os.path.join(self.blob_dir, shard))
+                    for digest in os.listdir(os.path.join(self.blob_dir, shard))
+                    if "." not in digest
+                }
+            for digest in digests - referenced_digests:
+                try:
+                    os.remove(self._get_blob_path(digest))
+                except FileNotFoundError:
+                    continue
+                removed_count += 1
+        return removed_count
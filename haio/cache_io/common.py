@@ -0,0 +1,81 @@
+from contextlib import contextmanager
+from typing import Iterator
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windowsではプロセス間ロックを行わない
+    fcntl = None  # type: ignore
+
+from haio.types import HAIOCache
+from haio.cache_io.types import Cache_IO, CacheRecord
+
+
+# 同一ホストの複数プロセスから同じキャッシュを扱うためのアドバイザリロック
+@contextmanager
+def file_lock(lock_path: str, shared: bool = False) -> Iterator[None]:
+    if fcntl is None:
+        yield
+        return
+    with open(lock_path, "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+# 一時ファイルに書いてから置き換えることで、読み込み側が書きかけのファイルを見ないようにする
+def atomic_write(path: str, data: str) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+# sourceのキャッシュを全てdestinationへ移す (例: JSON_Cache_IO -> SQLite_Cache_IO)
+def migrate_cache(source: Cache_IO, destination: Cache_IO) -> int:
+    answer_count = 0
+    for question_template_hash in source.question_template_hashes():
+        cache = source.load(question_template_hash)
+        if cache is None:
+            continue
+        records: list[CacheRecord] = [
+            {
+                "data_list_hash": data_list_hash,
+                "data_list": data_list_cache["data_list"],
+                "cache_id": cache_id,
+                "answer_cache": answer_cache,
+            }
+            for data_list_hash, data_list_cache in cache["data_lists"].items()
+            for cache_id, answer_cache in data_list_cache["answer_list"].items()
+        ]
+        destination.add_answers(
+            question_template_hash=question_template_hash,
+            question_template=cache["question_template"],
+            records=records,
+        )
+        answer_count += len(records)
+    return answer_count
+
+
+# HAIOCacheから(data_list_hash, cache_id)の回答を削除し、空になったdata_listも削除する
+def remove_entries(cache: HAIOCache, entries: list[tuple[str, str]]) -> None:
+    for data_list_hash, cache_id in entries:
+        data_list_cache = cache["data_lists"].get(data_list_hash, None)
+        if data_list_cache is None:
+            continue
+        data_list_cache["answer_list"].pop(cache_id, None)
+        if not data_list_cache["answer_list"]:
+            cache["data_lists"].pop(data_list_hash)
+
+
+# sourceの回答をcacheに加える (同じcache_idの回答はcacheのものを残す)
+def merge_cache(cache: HAIOCache, source: HAIOCache) -> None:
+    for data_list_hash, source_data_list_cache in source["data_lists"].items():
+        data_list_cache = cache["data_lists"].setdefault(
+            data_list_hash,
+            {"data_list": source_data_list_cache["data_list"], "answer_list": {}},
+        )
+        for cache_id, answer_cache in source_data_list_cache["answer_list"].items():
+            data_list_cache["answer_list"].setdefault(cache_id, answer_cache)
@@ -0,0 +1,121 @@
+from typing import Iterator
+import json
+import os
+
+from haio.types import QuestionTemplate, DataList, DataListCache, HAIOCache
+from haio.cache_io.common import atomic_write, file_lock, remove_entries
+from haio.cache_io.types import Cache_IO, CacheRecord
+
+
+# haio_cache/<question_template_hash> に HAIOCache をそのままJSONで保存する従来形式
+class JSON_Cache_IO(Cache_IO):
+    def __init__(self, cache_dir: str) -> None:
+        self.cache_dir = cache_dir
+
+    def _get_cache_file_path(self, question_template_hash: str) -> str:
+        return os.path.join(self.cache_dir, question_template_hash)
+
+    def _get_lock_file_path(self, question_template_hash: str) -> str:
+        return os.path.join(self.cache_dir, question_template_hash + ".lock")
+
+    def _read(self, question_template_hash: str) -> HAIOCache | None:
+        try:
+            with open(self._get_cache_file_path(question_template_hash), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def load(self, question_template_hash: str) -> HAIOCache | None:
+        # 書き込みはatomic_writeで置き換えるため、読み込みにロックは不要
+        cache = self._read(question_template_hash)
+        if cache is not None:
+            # 更新時刻を最終利用時刻として使う
+            # 読み込んだ後に他プロセスが容量制限で削除していることがある
+            try:
+                os.utime(self._get_cache_file_path(question_template_hash))
+            except FileNotFoundError:
+                pass
+        return cache
+
+    def iter_data_lists(self, question_template_hash: str) -> Iterator[DataList]:
+        cache = self._read(question_template_hash)
+        if cache is not None:
+            for data_list_cache in cache["data_lists"].values():
+                yield data_list_cache["data_list"]
+
+    def exists(self, question_template_hash: str) -> bool:
+        return os.path.isfile(self._get_cache_file_path(question_template_hash))
+
+    def get_data_list_cache(
+        self, question_template_hash: str, data_list_hash: str
+    ) -> DataListCache | None:
+        cache = self.load(question_template_hash)
+        if cache is None:
+            return None
+        return cache["data_lists"].get(data_list_hash, None)
+
+    def add_answers(
+        self,
+        question_template_hash: str,
+        question_template: QuestionTemplate,
+        records: list[CacheRecord],
+    ) -> None:
+        if not records:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # 他プロセスの書き込みを失わないよう、ロック中に読み直してから追記する
+        with file_lock(self._get_lock_file_path(question_template_hash)):
+            cache = self._read(question_template_hash)
+            if cache is None:
+                cache = {"question_template": question_template, "data_lists": {}}
+            for record in records:
+                data_list_cache = cache["data_lists"].setdefault(
+                    record["data_list_hash"],
+                    {"data_list": record["data_list"], "answer_list": {}},
+                )
+                data_list_cache["answer_list"][record["cache_id"]] = record[
+                    "answer_cache"
+                ]
+            atomic_write(
+                self._get_cache_file_path(question_template_hash), json.dumps(cache)
+            )
+
+    def remove_answers(
+        self, question_template_hash: str, entries: list[tuple[str, str]]
+    ) -> None:
+        if not entries:
+            return
+        with file_lock(self._get_lock_file_path(question_template_hash)):
+            cache = self._read(question_template_hash)
+            if cache is None:
+                return
+            remove_entries(cache, entries)
+            atomic_write(
+                self._get_cache_file_path(question_template_hash), json.dumps(cache)
+            )
+
+    def remove(self, question_template_hash: str) -> None:
+        with file_lock(self._get_lock_file_path(question_template_hash)):
+            cache_file_path = self._get_cache_file_path(question_template_hash)
+            if os.path.exists(cache_file_path):
+                os.remove(cache_file_path)
+
+    def get_sizes(self) -> dict[str, tuple[int, float]]:
+        sizes: dict[str, tuple[int, float]] = {}
+        for question_template_hash in self.question_template_hashes():
+            try:
+                stat = os.stat(self._get_cache_file_path(question_template_hash))
+            except FileNotFoundError:
+                continue  # 一覧を取得した後に他プロセスが削除した
+            sizes[question_template_hash] = (stat.st_size, stat.st_mtime)
+        return sizes
+
+    def question_template_hashes(self) -> list[str]:
+        if not os.path.isdir(self.cache_dir):
+            return []
+        # 他形式のキャッシュ(例: haio_cache.sqlite3)は拡張子付きなので除外
+        return sorted(
+            name
+            for name in os.listdir(self.cache_dir)
+            if "." not in name and os.path.isfile(os.path.join(self.cache_dir, name))
+        )
@@ -0,0 +1,307 @@
+from typing import Iterator
+import json
+import os
+import threading
+
+from haio.types import QuestionTemplate, DataList, DataListCache, HAIOCache
+from haio.cache_io.common import (
+    atomic_write,
+    file_lock,
+    merge_cache,
+    remove_entries,
+)
+from haio.cache_io.types import Cache_IO, CacheRecord
+
+
+# question_templateごとに スナップショット(<hash>.json) と ジャーナル(<hash>.jsonl) を持つ形式
+# 回答の追加はジャーナルへの1行追記のみで、読み込み時にスナップショットへジャーナルを適用する
+# 書き込み途中で落ちた最終行は読み込み時に捨てる
+# compactでジャーナルをスナップショットへ畳み込む
+# プロセス間では<hash>.lockのロックで、スレッド間ではself.lockで排他する
+class JSONL_Cache_IO(Cache_IO):
+    def __init__(self, cache_dir: str, compaction_threshold: int = 10000) -> None:
+        self.cache_dir = cache_dir
+        # ジャーナルの行数がこれを超えたらバックグラウンドでcompactする
+        self.compaction_threshold = compaction_threshold
+        self.lock = threading.Lock()
+        # question_template_hash -> ジャーナルかスナップショットに記録済みのdata_list_hash
+        self.known_data_list_hashes: dict[str, set[str]] = {}
+        self.journal_line_counts: dict[str, int] = {}
+        self.compaction_threads: dict[str, threading.Thread] = {}
+
+    def _get_snapshot_path(self, question_template_hash: str) -> str:
+        return os.path.join(self.cache_dir, question_template_hash + ".json")
+
+    def _get_journal_path(self, question_template_hash: str) -> str:
+        return os.path.join(self.cache_dir, question_template_hash + ".jsonl")
+
+    def _get_lock_path(self, question_template_hash: str) -> str:
+        return os.path.join(self.cache_dir, question_template_hash + ".lock")
+
+    def _get_legacy_path(self, question_template_hash: str) -> str:
+        # JSON_Cache_IOのファイル、スナップショットとして読める
+        return os.path.join(self.cache_dir, question_template_hash)
+
+    def _read(self, question_template_hash: str) -> HAIOCache | None:
+        cache: HAIOCache | None = None
+        # スナップショットと旧形式のファイルが両方あれば、両方の回答を合わせる
+        for snapshot_path in (
+            self._get_snapshot_path(question_template_hash),
+            self._get_legacy_path(question_template_hash),
+        ):
+            if os.path.isfile(snapshot_path):
+                with open(snapshot_path, "r") as f:
+                    snapshot: HAIOCache = json.load(f)
+                if cache is None:
+                    cache = snapshot
+                else:
+                    merge_cache(cache, snapshot)
+
+        line_count = 0
+        journal_path = self._get_journal_path(question_template_hash)
+        if os.path.isfile(journal_path):
+            with open(journal_path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # 書き込み途中の行
+                    line_count += 1
+                    if "question_template" in entry:
+                        if cache is None:
+                            cache = {
+                                "question_template": entry["question_template"],
+                                "data_lists": {},
+                            }
+                        continue
+                    if cache is None:
+                        continue
+                    data_list_cache = cache["data_lists"].setdefault(
+                        entry["data_list_hash"],
+                        {"data_list": entry.get("data_list", []), "answer_list": {}},
+                    )
+                    if "data_list" in entry:
+                        data_list_cache["data_list"] = entry["data_list"]
+                    if "cache_id" in entry:
+                        data_list_cache["answer_list"][entry["cache_id"]] = entry[
+                            "answer_cache"
+                        ]
+
+        self.journal_line_counts[question_template_hash] = line_count
+        if cache is not None:
+            self.known_data_list_hashes[question_template_hash] = set(
+                cache["data_lists"].keys()
+            )
+        return cache
+
+    def load(self, question_template_hash: str) -> HAIOCache | None:
+        if not os.path.isdir(self.cache_dir):
+            return None
+        with self.lock, file_lock(
+            self._get_lock_path(question_template_hash), shared=True
+        ):
+            cache = self._read(question_template_hash)
+        if cache is not None:
+            # 更新時刻を最終利用時刻として使う
+            # 読み込んだ後に他プロセスが容量制限で削除していることがある
+            for path in self._get_paths(question_template_hash):
+                try:
+                    os.utime(path)
+                except FileNotFoundError:
+                    pass
+        return cache
+
+    def iter_data_lists(self, question_template_hash: str) -> Iterator[DataList]:
+        if not os.path.isdir(self.cache_dir):
+            return
+        with self.lock, file_lock(
+            self._get_lock_path(question_template_hash), shared=True
+        ):
+            cache = self._read(question_template_hash)
+        if cache is not None:
+            for data_list_cache in cache["data_lists"].values():
+                yield data_list_cache["data_list"]
+
+    def exists(self, question_template_hash: str) -> bool:
+        return any(
+            os.path.isfile(path) for path in self._get_paths(question_template_hash)
+        )
+
+    def get_data_list_cache(
+        self, question_template_hash: str, data_list_hash: str
+    ) -> DataListCache | None:
+        cache = self.load(question_template_hash)
+        if cache is None:
+            return None
+        return cache["data_lists"].get(data_list_hash, None)
+
+    def add_answers(
+        self,
+        question_template_hash: str,
+        question_template: QuestionTemplate,
+        records: list[CacheRecord],
+    ) -> None:
+        if not records:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self.lock, file_lock(self._get_lock_path(question_template_hash)):
+            if question_template_hash not in self.known_data_list_hashes:
+                self._read(question_template_hash)
+            known_data_list_hashes = self.known_data_list_hashes.setdefault(
+                question_template_hash, set()
+            )
+
+            lines: list[str] = []
+            journal_path = self._get_journal_path(question_template_hash)
+            if not os.path.isfile(journal_path) or os.path.getsize(journal_path) == 0:
+                lines.append(json.dumps({"question_template": question_template}))
+            for record in records:
+                if record["data_list_hash"] not in known_data_list_hashes:
+                    lines.append(
+                        json.dumps(
+                            {
+                                "data_list_hash": record["data_list_hash"],
+                                "data_list": record["data_list"],
+                            }
+                        )
+                    )
+                    known_data_list_hashes.add(record["data_list_hash"])
+                lines.append(
+                    json.dumps(
+                        {
+                            "data_list_hash": record["data_list_hash"],
+                            "cache_id": record["cache_id"],
+                            "answer_cache": record["answer_cache"],
+                        }
+                    )
+                )
+
+            with open(journal_path, "a+b") as f:
+                # 最終行が途中で切れていれば改行して切り離す
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+                f.write(("\n".join(lines) + "\n").encode())
+
+            self.journal_line_counts[question_template_hash] = (
+                self.journal_line_counts.get(question_template_hash, 0) + len(lines)
+            )
+            line_count = self.journal_line_counts[question_template_hash]
+
+        if line_count >= self.compaction_threshold:
+            self.compact_in_background(question_template_hash)
+
+    # ジャーナルをスナップショットに畳み込み、ジャーナルを空にする
+    def compact(
+        self,
+        question_template_hash: str | None = None,
+        removed_entries: list[tuple[str, str]] | None = None,
+    ) -> None:
+        if question_template_hash is None:
+            for question_template_hash in self.question_template_hashes():
+                self.compact(question_template_hash)
+            return
+
+        with self.lock, file_lock(self._get_lock_path(question_template_hash)):
+            cache = self._read(question_template_hash)
+            if cache is None:
+                return
+            if removed_entries:
+                remove_entries(cache, removed_entries)
+                self.known_data_list_hashes[question_template_hash] = set(
+                    cache["data_lists"].keys()
+                )
+            atomic_write(
+                self._get_snapshot_path(question_template_hash), json.dumps(cache)
+            )
+            # スナップショットに含まれるので、ジャーナルと旧形式のファイルは不要
+            for path in (
+                self._get_journal_path(question_template_hash),
+                self._get_legacy_path(question_template_hash),
+            ):
+                if os.path.isfile(path):
+                    os.remove(path)
+            self.journal_line_counts[question_template_hash] = 0
+
+    # 削除は頻繁ではないので、compactで削除済みのスナップショットを書き直す
+    def remove_answers(
+        self, question_template_hash: str, entries: list[tuple[str, str]]
+    ) -> None:
+        if entries:
+            self.compact(question_template_hash, removed_entries=entries)
+
+    def remove(self, question_template_hash: str) -> None:
+        with self.lock, file_lock(self._get_lock_path(question_template_hash)):
+            for path in self._get_paths(question_template_hash):
+                if os.path.isfile(path):
+                    os.remove(path)
+            self.known_data_list_hashes.pop(question_template_hash, None)
+            self.journal_line_counts.pop(question_template_hash, None)
+
+    def get_sizes(self) -> dict[str, tuple[int, float]]:
+        sizes: dict[str, tuple[int, float]] = {}
+        for question_template_hash in self.question_template_hashes():
+            size, last_used_time = 0, 0.0
+            for path in self._get_paths(question_template_hash):
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                size += stat.st_size
+                last_used_time = max(last_used_time, stat.st_mtime)
+            sizes[question_template_hash] = (size, last_used_time)
+        return sizes
+
+    def _get_paths(self, question_template_hash: str) -> list[str]:
+        return [
+            self._get_snapshot_path(question_template_hash),
+            self._get_journal_path(question_template_hash),
+            self._get_legacy_path(question_template_hash),
+        ]
+
+    def compact_in_background(self, question_template_hash: str) -> threading.Thread:
+        thread = self.compaction_threads.get(question_template_hash, None)
+        if thread is not None and thread.is_alive():
+            return thread
+        thread = threading.Thread(
+            target=self.compact, args=(question_template_hash,), daemon=True
+        )
+        self.compaction_threads[question_template_hash] = thread
+        thread.start()
+        return thread
+
+    # 旧形式(JSON_Cache_IO)のファイルをその場でスナップショットに変換する
+    # スナップショットやジャーナルが既にあれば、compactで回答を合わせてから旧形式のファイルを消す
+    def convert_legacy(self) -> int:
+        converted_count = 0
+        for name in self._list_legacy():
+            self.compact(name)
+            converted_count += 1
+        return converted_count
+
+    def _list_legacy(self) -> list[str]:
+        if not os.path.isdir(self.cache_dir):
+            return []
+        return [
+            name
+            for name in os.listdir(self.cache_dir)
+            if "." not in name and os.path.isfile(os.path.join(self.cache_dir, name))
+        ]
+
+    def question_template_hashes(self) -> list[str]:
+        if not os.path.isdir(self.cache_dir):
+            return []
+        question_template_hashes: set[str] = set(self._list_legacy())
+        for name in os.listdir(self.cache_dir):
+            for extension in (".json", ".jsonl"):
+                if name.endswith(extension):
+                    question_template_hashes.add(name[: -len(extension)])
+        return sorted(question_template_hashes)
+
+    def flush(self) -> None:
+        for thread in list(self.compaction_threads.values()):
+            thread.join()
+
+    def close(self) -> None:
+        self.flush()
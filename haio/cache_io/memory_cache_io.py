@@ -0,0 +1,429 @@
+from collections import Counter, OrderedDict
+from contextlib import nullcontext
+from typing import Callable, ContextManager, Iterator, Literal
+import time
+
+from haio.types import QuestionTemplate, DataList, DataListCache, HAIOCache
+from haio.cache_io.blob_store import Blob_Store
+from haio.cache_io.types import Cache_IO, CacheRecord
+
+
+# backendの前段に置くwrite-behindキャッシュ
+# question_templateごとのキャッシュを初回参照時に一度だけ読み込み、以降はメモリから返す
+# 追加された回答はバッファに溜め、件数か経過時間が閾値を超えたらまとめてbackendへ書き込む
+# max_bytes, max_entries_per_template, ttlを指定すると、読み込み時と書き込み時に古い回答を削除する
+# 削除の順序は eviction_policy="lru" なら最終利用時刻順、"ttl" なら作成時刻順
+# is_reservedがTrueを返す回答(実行中に使用済みの回答)は削除しない
+# blob_storeを指定した場合、max_bytesにはblobのバイト数も含め、削除した回答だけが参照していたblobも削除する
+class Memory_Cache_IO(Cache_IO):
+    def __init__(
+        self,
+        backend: Cache_IO,
+        max_templates: int = 8,
+        flush_size: int = 100,
+        flush_interval: float = 10.0,
+        max_bytes: int | None = None,
+        max_entries_per_template: int | None = None,
+        ttl: float | None = None,
+        eviction_policy: Literal["lru", "ttl"] = "lru",
+        eviction_interval: float = 60.0,
+        blob_store: Blob_Store | None = None,
+    ) -> None:
+        if max_templates < 1:
+            raise ValueError("max_templates must be positive.")
+        if eviction_policy not in ("lru", "ttl"):
+            raise ValueError("Invalid eviction_policy.")
+        self.backend = backend
+        # 指定されていれば、data_listの大きな要素はblobとしてbackendの外に保存する
+        self.blob_store = blob_store
+        self.max_templates = max_templates
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.max_entries_per_template = max_entries_per_template
+        self.ttl = ttl
+        self.eviction_policy = eviction_policy
+        self.eviction_interval = eviction_interval
+        self.last_eviction_time = time.monotonic()
+        # backendがdata_listごとに索引で引ける場合、question_template全体は読み込まず、
+        # 参照したdata_listだけをメモリに置く (ttl, max_entries_per_templateは全体の回答を数えるので除く)
+        self.lookup_by_data_list = (
+            backend.indexed_lookup and ttl is None and max_entries_per_template is None
+        )
+        # (question_template_hash, data_list_hash | None, cache_id | None) -> 使用中か
+        self.is_reserved: Callable[[str, str | None, str | None], bool] = (
+            lambda question_template_hash, data_list_hash, cache_id: False
+        )
+        # cache_id -> このプロセスで最後に使われた時刻
+        self.used_times: dict[str, float] = {}
+        # question_template_hash -> 回答数
+        self.entry_counts: dict[str, int] = {}
+        # question_template_hash -> data_list_hash -> DataListCache (LRU順)
+        self.resident: OrderedDict[str, dict[str, DataListCache]] = OrderedDict()
+        # question_template_hash -> (question_template, 未書き込みの回答)
+        self.pending: dict[str, tuple[QuestionTemplate, list[CacheRecord]]] = {}
+        self.pending_count = 0
+        self.last_flush_time = time.monotonic()
+        # question_template_hash -> (backendでのバイト数, 参照するblobのdigest)
+        # バイト数が変わるまでは、参照するblobを読み直さない
+        self.blob_digests: dict[str, tuple[int, set[str]]] = {}
+        # store_data_listで保存したblob (このプロセスの質問が参照するので削除しない)
+        self.stored_digests: set[str] = set()
+        # 削除した回答が参照していたblob (次の削除時にまとめて、未参照なら削除する)
+        self.unreferenced_digests: set[str] = set()
+
+    def _get_resident(self, question_template_hash: str) -> dict[str, DataListCache]:
+        if question_template_hash in self.resident:
+            self.resident.move_to_end(question_template_hash)
+            return self.resident[question_template_hash]
+
+        if self.lookup_by_data_list:
+            data_lists: dict[str, DataListCache] = {}
+            self.resident[question_template_hash] = data_lists
+            self.backend.touch_template(question_template_hash)
+        else:
+            cache = self.backend.load(question_template_hash)
+            data_lists = cache["data_lists"] if cache is not None else {}
+            self.resident[question_template_hash] = data_lists
+            self.entry_counts[question_template_hash] = sum(
+                len(data_list_cache["answer_list"])
+                for data_list_cache in data_lists.values()
+            )
+        if self.ttl is not None or (
+            self.max_entries_per_template is not None
+            and self.entry_counts[question_template_hash]
+            > self.max_entries_per_template
+        ):
+            self._evict_entries(question_template_hash)
+
+        # LRUで溢れたquestion_templateを追い出す (未書き込み分は先に書き込む)
+        while len(self.resident) > self.max_templates:
+            evicted_hash, _ = self.resident.popitem(last=False)
+            self._flush_template(evicted_hash)
+            self.entry_counts.pop(evicted_hash, None)
+
+        return data_lists
+
+    def load(self, question_template_hash: str) -> HAIOCache | None:
+        self._flush_template(question_template_hash)
+        return self.backend.load(question_template_hash)
+
+    def load_question_template(
+        self, question_template_hash: str
+    ) -> QuestionTemplate | None:
+        self._flush_template(question_template_hash)
+        return self.backend.load_question_template(question_template_hash)
+
+    def iter_data_list_caches(
+        self, question_template_hash: str
+    ) -> Iterator[tuple[str, DataListCache]]:
+        self._flush_template(question_template_hash)
+        return self.backend.iter_data_list_caches(question_template_hash)
+
+    def iter_data_lists(self, question_template_hash: str) -> Iterator[DataList]:
+        self._flush_template(question_template_hash)
+        return self.backend.iter_data_lists(question_template_hash)
+
+    def exists(self, question_template_hash: str) -> bool:
+        if question_template_hash in self.pending or self.resident.get(
+            question_template_hash, None
+        ):
+            return True
+        return self.backend.exists(question_template_hash)
+
+    # question_templateのキャッシュをメモリに読み込んでおく
+    def prewarm(self, question_template_hash: str) -> None:
+        self._get_resident(question_template_hash)
+
+    def get_data_list_cache(
+        self, question_template_hash: str, data_list_hash: str
+    ) -> DataListCache | None:
+        data_lists = self._get_resident(question_template_hash)
+        if self.lookup_by_data_list and data_list_hash not in data_lists:
+            data_list_cache = self.backend.get_data_list_cache(
+                question_template_hash, data_list_hash
+            )
+            if data_list_cache is None:
+                return None
+            data_lists[data_list_hash] = data_list_cache
+        return data_lists.get(data_list_hash, None)
+
+    def add_answers(
+        self,
+        question_template_hash: str,
+        question_template: QuestionTemplate,
+        records: list[CacheRecord],
+    ) -> None:
+        if not records:
+            return
+        data_lists = self._get_resident(question_template_hash)
+        for record in records:
+            if self.lookup_by_data_list:
+                # backendにある回答を先に読み込んでから追加する
+                self.get_data_list_cache(
+                    question_template_hash, record["data_list_hash"]
+                )
+            data_list_cache = data_lists.setdefault(
+                record["data_list_hash"],
+                {"data_list": record["data_list"], "answer_list": {}},
+            )
+            if (
+                record["cache_id"] not in data_list_cache["answer_list"]
+                and question_template_hash in self.entry_counts
+            ):
+                self.entry_counts[question_template_hash] += 1
+            data_list_cache["answer_list"][record["cache_id"]] = record["answer_cache"]
+
+        self.pending.setdefault(question_template_hash, (question_template, []))[
+            1
+        ].extend(records)
+        self.pending_count += len(records)
+
+        if (
+            self.pending_count >= self.flush_size
+            or time.monotonic() - self.last_flush_time >= self.flush_interval
+        ):
+            self.flush()
+
+    def _flush_template(self, question_template_hash: str) -> None:
+        if question_template_hash not in self.pending:
+            return
+        question_template, records = self.pending.pop(question_template_hash)
+        self.pending_count -= len(records)
+        with self._lock_blobs(shared=True):
+            if self.blob_store is not None:
+                records = [
+                    {
+                        **record,
+                        "data_list": self.blob_store.put_data_list(record["data_list"]),
+                    }
+                    for record in records
+                ]
+            self.backend.add_answers(
+                question_template_hash=question_template_hash,
+                question_template=question_template,
+                records=records,
+            )
+
+    def _lock_blobs(self, shared: bool = False) -> ContextManager[None]:
+        if self.blob_store is None:
+            return nullcontext()
+        return self.blob_store.lock(shared=shared)
+
+    def flush(self) -> None:
+        for question_template_hash in list(self.pending.keys()):
+            self._flush_template(question_template_hash)
+        self.backend.flush()
+        self.last_flush_time = time.monotonic()
+        self._evict()
+
+    # blobの参照を元のデータに戻す (backendから読み込んだdata_listは参照のままなので)
+    def load_data_list(self, data_list: DataList) -> DataList:
+        if self.blob_store is None:
+            return data_list
+        return self.blob_store.get_data_list(data_list)
+
+    # data_listの大きな要素をblobとして保存し、参照に置き換える
+    def store_data_list(self, data_list: DataList) -> DataList:
+        if self.blob_store is None:
+            return data_list
+        self.stored_digests |= self.blob_store.get_digests(data_list)
+        return self.blob_store.put_data_list(data_list)
+
+    # 回答が使われたことを記録する (LRUの順序に使う)
+    def touch(self, cache_id: str) -> None:
+        if self.eviction_policy == "lru":
+            self.used_times[cache_id] = time.time()
+
+    def _evict(self) -> None:
+        for question_template_hash, entry_count in list(self.entry_counts.items()):
+            if question_template_hash in self.resident and (
+                self.max_entries_per_template is not None
+                and entry_count > self.max_entries_per_template
+            ):
+                self._evict_entries(question_template_hash)
+
+        if time.monotonic() - self.last_eviction_time < self.eviction_interval:
+            return
+        self.last_eviction_time = time.monotonic()
+        if self.ttl is not None:
+            for question_template_hash in list(self.resident.keys()):
+                self._evict_entries(question_template_hash)
+        if self.max_bytes is not None:
+            self._evict_templates()
+        self._remove_blobs()
+
+    # question_template内の期限切れ・上限超過の回答を削除する
+    def _evict_entries(self, question_template_hash: str) -> None:
+        data_lists = self.resident[question_template_hash]
+        pending_cache_ids = {
+            record["cache_id"]
+            for record in self.pending.get(question_template_hash, (None, []))[1]
+        }
+        now = time.time()
+        expired_entries: list[tuple[str, str]] = []
+        candidates: list[tuple[float, str, str]] = []
+        for data_list_hash, data_list_cache in data_lists.items():
+            for cache_id, answer_cache in data_list_cache["answer_list"].items():
+                if cache_id in pending_cache_ids or self.is_reserved(
+                    question_template_hash, data_list_hash, cache_id
+                ):
+                    continue
+                # created_atの無い古い回答は、最も古いものとして扱いTTLでは削除しない
+                created_at = answer_cache.get("created_at", 0.0)
+                if (
+                    self.ttl is not None
+                    and "created_at" in answer_cache
+                    and now - created_at > self.ttl
+                ):
+                    expired_entries.append((data_list_hash, cache_id))
+                    continue
+                order = (
+                    self.used_times.get(cache_id, created_at)
+                    if self.eviction_policy == "lru"
+                    else created_at
+                )
+                candidates.append((order, data_list_hash, cache_id))
+
+        evicted_entries = expired_entries
+        if self.max_entries_per_template is not None:
+            over_count = (
+                self.entry_counts[question_template_hash]
+                - len(expired_entries)
+                - self.max_entries_per_template
+            )
+            if over_count > 0:
+                candidates.sort()
+                evicted_entries += [
+                    (data_list_hash, cache_id)
+                    for _, data_list_hash, cache_id in candidates[:over_count]
+                ]
+        if not evicted_entries:
+            return
+
+        for data_list_hash, cache_id in evicted_entries:
+            data_list_cache = data_lists[data_list_hash]
+            data_list_cache["answer_list"].pop(cache_id)
+            if not data_list_cache["answer_list"]:
+                data_lists.pop(data_list_hash)
+                if self.blob_store is not None:
+                    self.unreferenced_digests |= self.blob_store.get_digests(
+                        data_list_cache["data_list"]
+                    )
+            self.used_times.pop(cache_id, None)
+        self.entry_counts[question_template_hash] -= len(evicted_entries)
+        self.backend.remove_answers(question_template_hash, evicted_entries)
+
+    # 合計サイズがmax_bytesを超えていれば、最終利用の古いquestion_templateから削除する
+    # メモリ上にあるものや、実行中に使用したものは削除しない
+    # 合計サイズには参照されているblobを1回ずつ数え、他から参照されなくなったblobの分だけ減らす
+    def _evict_templates(self) -> None:
+        if self.max_bytes is None:
+            return
+        sizes = self.backend.get_sizes()
+        blob_digests = self._get_blob_digests(sizes)
+        digest_counts = Counter(
+            digest for digests in blob_digests.values() for digest in digests
+        )
+        total_size = sum(size for size, _ in sizes.values()) + sum(
+            self._get_blob_size(digest) for digest in digest_counts
+        )
+        for question_template_hash, (size, _) in sorted(
+            sizes.items(), key=lambda item: item[1][1]
+        ):
+            if total_size <= self.max_bytes:
+                break
+            if question_template_hash in self.resident or self.is_reserved(
+                question_template_hash, None, None
+            ):
+                continue
+            self.backend.remove(question_template_hash)
+            self.entry_counts.pop(question_template_hash, None)
+            self.blob_digests.pop(question_template_hash, None)
+            total_size -= size
+            for digest in blob_digests.get(question_template_hash, set()):
+                digest_counts[digest] -= 1
+                if digest_counts[digest] == 0:
+                    total_size -= self._get_blob_size(digest)
+                    self.unreferenced_digests.add(digest)
+
+    # question_templateごとに、参照するblobのdigestを返す
+    def _get_blob_digests(
+        self, sizes: dict[str, tuple[int, float]]
+    ) -> dict[str, set[str]]:
+        if self.blob_store is None:
+            return {}
+        for question_template_hash in list(self.blob_digests.keys()):
+            if question_template_hash not in sizes:
+                self.blob_digests.pop(question_template_hash)
+        for question_template_hash, (size, _) in sizes.items():
+            if self.blob_digests.get(question_template_hash, (None, None))[0] == size:
+                continue
+            digests: set[str] = set()
+            for data_list in self.backend.iter_data_lists(question_template_hash):
+                digests |= self.blob_store.get_digests(data_list)
+            self.blob_digests[question_template_hash] = (size, digests)
+        return {
+            question_template_hash: digests
+            for question_template_hash, (_, digests) in self.blob_digests.items()
+        }
+
+    def _get_blob_size(self, digest: str) -> int:
+        if self.blob_store is None:
+            return 0
+        return self.blob_store.get_size(digest)
+
+    # 削除した回答が参照していたblobのうち、どの回答からも参照されなくなったものを削除する
+    # 書き込み前の回答や、このプロセスの質問が参照するblobは削除しない
+    def _remove_blobs(self) -> None:
+        if self.blob_store is None or not self.unreferenced_digests:
+            return
+        keep = set(self.stored_digests)
+        for _, records in self.pending.values():
+            for record in records:
+                keep |= self.blob_store.get_digests(record["data_list"])
+        self.blob_store.remove_unreferenced(
+            self.backend, digests=self.unreferenced_digests, keep=keep
+        )
+        self.unreferenced_digests = set()
+
+    def remove_answers(
+        self, question_template_hash: str, entries: list[tuple[str, str]]
+    ) -> None:
+        self._flush_template(question_template_hash)
+        self.resident.pop(question_template_hash, None)
+        self.entry_counts.pop(question_template_hash, None)
+        self.backend.remove_answers(question_template_hash, entries)
+
+    def remove(self, question_template_hash: str) -> None:
+        self._flush_template(question_template_hash)
+        self.resident.pop(question_template_hash, None)
+        self.entry_counts.pop(question_template_hash, None)
+        self.backend.remove(question_template_hash)
+
+    # blob_storeを指定した場合、各question_templateのバイト数には参照するblobのバイト数を含める
+    # (複数のquestion_templateから参照されるblobは、それぞれに含める)
+    def get_sizes(self) -> dict[str, tuple[int, float]]:
+        self.flush()
+        sizes = self.backend.get_sizes()
+        blob_digests = self._get_blob_digests(sizes)
+        return {
+            question_template_hash: (
+                size
+                + sum(
+                    self._get_blob_size(digest)
+                    for digest in blob_digests.get(question_template_hash, set())
+                ),
+                last_used_time,
+            )
+            for question_template_hash, (size, last_used_time) in sizes.items()
+        }
+
+    def question_template_hashes(self) -> list[str]:
+        self.flush()
+        return self.backend.question_template_hashes()
+
+    def close(self) -> None:
+        self.flush()
+        self._remove_blobs()
+        self.backend.close()
@@ -0,0 +1,291 @@
+from typing import Iterator
+import json
+import os
+import sqlite3
+import time
+
+from haio.types import (
+    QuestionTemplate,
+    ClientType,
+    DataList,
+    AnswerCache,
+    DataListCache,
+    HAIOCache,
+)
+from haio.cache_io.types import Cache_IO, CacheRecord
+
+
+sqlite_cache_file_name = "haio_cache.sqlite3"
+
+# answersのrowidで回答の追加順を保持する(JSON形式のanswer_listの順序と同じ)
+sqlite_cache_schema = """
+CREATE TABLE IF NOT EXISTS question_templates (
+    question_template_hash TEXT PRIMARY KEY,
+    question_template TEXT NOT NULL,
+    last_used_at REAL
+);
+CREATE TABLE IF NOT EXISTS data_lists (
+    question_template_hash TEXT NOT NULL,
+    data_list_hash TEXT NOT NULL,
+    data_list TEXT NOT NULL,
+    PRIMARY KEY (question_template_hash, data_list_hash)
+);
+CREATE TABLE IF NOT EXISTS answers (
+    question_template_hash TEXT NOT NULL,
+    data_list_hash TEXT NOT NULL,
+    client TEXT NOT NULL,
+    cache_id TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    created_at REAL,
+    UNIQUE (question_template_hash, data_list_hash, cache_id)
+);
+CREATE INDEX IF NOT EXISTS answers_client_index
+    ON answers (question_template_hash, data_list_hash, client);
+"""
+
+
+class SQLite_Cache_IO(Cache_IO):
+    indexed_lookup = True
+
+    def __init__(
+        self,
+        cache_dir: str,
+        file_name: str = sqlite_cache_file_name,
+        timeout: float = 60.0,
+    ) -> None:
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db_path = os.path.join(cache_dir, file_name)
+        # 他プロセスが書き込み中の場合はtimeout秒まで待つ
+        self.connection = sqlite3.connect(self.db_path, timeout=timeout)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(sqlite_cache_schema)
+        self._migrate_schema()
+        self.connection.commit()
+
+    # 列が追加される前に作られたデータベースに列を追加する
+    def _migrate_schema(self) -> None:
+        for table, column in (
+            ("question_templates", "last_used_at REAL"),
+            ("answers", "created_at REAL"),
+        ):
+            columns = [
+                row[1] for row in self.connection.execute(f"PRAGMA table_info({table})")
+            ]
+            if column.split()[0] not in columns:
+                self.connection.execute(f"ALTER TABLE {table} ADD COLUMN {column}")
+
+    def touch_template(self, question_template_hash: str) -> None:
+        with self.connection:
+            self.connection.execute(
+                "UPDATE question_templates SET last_used_at = ?"
+                " WHERE question_template_hash = ?",
+                (time.time(), question_template_hash),
+            )
+
+    def load(self, question_template_hash: str) -> HAIOCache | None:
+        row = self.connection.execute(
+            "SELECT question_template FROM question_templates"
+            " WHERE question_template_hash = ?",
+            (question_template_hash,),
+        ).fetchone()
+        if row is None:
+            return None
+        self.touch_template(question_template_hash)
+        cache: HAIOCache = {"question_template": json.loads(row[0]), "data_lists": {}}
+        for data_list_hash, data_list in self.connection.execute(
+            "SELECT data_list_hash, data_list FROM data_lists"
+            " WHERE question_template_hash = ?",
+            (question_template_hash,),
+        ):
+            cache["data_lists"][data_list_hash] = {
+                "data_list": json.loads(data_list),
+                "answer_list": {},
+            }
+        for (
+            data_list_hash,
+            client,
+            cache_id,
+            answer,
+            created_at,
+        ) in self.connection.execute(
+            "SELECT data_list_hash, client, cache_id, answer, created_at FROM answers"
+            " WHERE question_template_hash = ? ORDER BY rowid",
+            (question_template_hash,),
+        ):
+            cache["data_lists"][data_list_hash]["answer_list"][cache_id] = (
+                self._to_answer_cache(client, answer, created_at)
+            )
+        return cache
+
+    def _to_answer_cache(
+        self, client: ClientType, answer: str, created_at: float | None
+    ) -> AnswerCache:
+        answer_cache: AnswerCache = {"client": client, "answer": json.loads(answer)}
+        if created_at is not None:
+            answer_cache["created_at"] = created_at
+        return answer_cache
+
+    def get_data_list_cache(
+        self, question_template_hash: str, data_list_hash: str
+    ) -> DataListCache | None:
+        row = self.connection.execute(
+            "SELECT data_list FROM data_lists"
+            " WHERE question_template_hash = ? AND data_list_hash = ?",
+            (question_template_hash, data_list_hash),
+        ).fetchone()
+        if row is None:
+            return None
+        data_list_cache: DataListCache = {
+            "data_list": json.loads(row[0]),
+            "answer_list": {},
+        }
+        for client, cache_id, answer, created_at in self.connection.execute(
+            "SELECT client, cache_id, answer, created_at FROM answers"
+            " WHERE question_template_hash = ? AND data_list_hash = ? ORDER BY rowid",
+            (question_template_hash, data_list_hash),
+        ):
+            data_list_cache["answer_list"][cache_id] = self._to_answer_cache(
+                client, answer, created_at
+            )
+        return data_list_cache
+
+    def load_question_template(
+        self, question_template_hash: str
+    ) -> QuestionTemplate | None:
+        row = self.connection.execute(
+            "SELECT question_template FROM question_templates"
+            " WHERE question_template_hash = ?",
+            (question_template_hash,),
+        ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def iter_data_list_caches(
+        self, question_template_hash: str
+    ) -> Iterator[tuple[str, DataListCache]]:
+        data_list_hashes = [
+            row[0]
+            for row in self.connection.execute(
+                "SELECT data_list_hash FROM data_lists"
+                " WHERE question_template_hash = ?",
+                (question_template_hash,),
+            )
+        ]
+        for data_list_hash in data_list_hashes:
+            data_list_cache = self.get_data_list_cache(
+                question_template_hash, data_list_hash
+            )
+            if data_list_cache is not None:
+                yield data_list_hash, data_list_cache
+
+    def iter_data_lists(self, question_template_hash: str) -> Iterator[DataList]:
+        for (data_list,) in self.connection.execute(
+            "SELECT data_list FROM data_lists WHERE question_template_hash = ?",
+            (question_template_hash,),
+        ).fetchall():
+            yield json.loads(data_list)
+
+    def add_answers(
+        self,
+        question_template_hash: str,
+        question_template: QuestionTemplate,
+        records: list[CacheRecord],
+    ) -> None:
+        if not records:
+            return
+        # 1トランザクションでまとめて書き込む
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO question_templates"
+                " (question_template_hash, question_template, last_used_at)"
+                " VALUES (?, ?, ?)",
+                (question_template_hash, json.dumps(question_template), time.time()),
+            )
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO data_lists VALUES (?, ?, ?)",
+                [
+                    (
+                        question_template_hash,
+                        record["data_list_hash"],
+                        json.dumps(record["data_list"]),
+                    )
+                    for record in records
+                ],
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO answers"
+                " (question_template_hash, data_list_hash, client, cache_id, answer,"
+                " created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        question_template_hash,
+                        record["data_list_hash"],
+                        record["answer_cache"]["client"],
+                        record["cache_id"],
+                        json.dumps(record["answer_cache"]["answer"]),
+                        record["answer_cache"].get("created_at", None),
+                    )
+                    for record in records
+                ],
+            )
+
+    def remove_answers(
+        self, question_template_hash: str, entries: list[tuple[str, str]]
+    ) -> None:
+        if not entries:
+            return
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM answers WHERE question_template_hash = ?"
+                " AND data_list_hash = ? AND cache_id = ?",
+                [
+                    (question_template_hash, data_list_hash, cache_id)
+                    for data_list_hash, cache_id in entries
+                ],
+            )
+            # 回答が無くなったdata_listを削除
+            self.connection.execute(
+                "DELETE FROM data_lists WHERE question_template_hash = ?"
+                " AND data_list_hash NOT IN (SELECT data_list_hash FROM answers"
+                " WHERE question_template_hash = ?)",
+                (question_template_hash, question_template_hash),
+            )
+
+    def remove(self, question_template_hash: str) -> None:
+        with self.connection:
+            for table in ("answers", "data_lists", "question_templates"):
+                self.connection.execute(
+                    f"DELETE FROM {table} WHERE question_template_hash = ?",
+                    (question_template_hash,),
+                )
+
+    def get_sizes(self) -> dict[str, tuple[int, float]]:
+        sizes: dict[str, tuple[int, float]] = {}
+        for question_template_hash, size, last_used_at in self.connection.execute(
+            "SELECT question_template_hash, length(question_template), last_used_at"
+            " FROM question_templates"
+        ):
+            sizes[question_template_hash] = (size, last_used_at or 0.0)
+        for table, column in (("data_lists", "data_list"), ("answers", "answer")):
+            for question_template_hash, size in self.connection.execute(
+                f"SELECT question_template_hash, sum(length({column})) FROM {table}"
+                " GROUP BY question_template_hash"
+            ):
+                if question_template_hash in sizes:
+                    sizes[question_template_hash] = (
+                        sizes[question_template_hash][0] + size,
+                        sizes[question_template_hash][1],
+                    )
+        return sizes
+
+    def question_template_hashes(self) -> list[str]:
+        return [
+            row[0]
+            for row in self.connection.execute(
+                "SELECT question_template_hash FROM question_templates"
+                " ORDER BY question_template_hash"
+            )
+        ]
+
+    def close(self) -> None:
+        self.connection.close()
@@ -0,0 +1,91 @@
+from abc import abstractmethod, ABCMeta
+from typing import Iterator, TypedDict
+
+from haio.types import QuestionTemplate, DataList, AnswerCache, DataListCache, HAIOCache
+
+
+class CacheRecord(TypedDict):
+    data_list_hash: str
+    data_list: DataList
+    cache_id: str
+    answer_cache: AnswerCache
+
+
+class Cache_IO(metaclass=ABCMeta):
+    # get_data_list_cacheを索引で引けるbackend (SQLite_Cache_IO) はTrueにする
+    # Memory_Cache_IOはquestion_template全体を読み込まず、参照したdata_listだけを読み込む
+    indexed_lookup: bool = False
+
+    @abstractmethod
+    def load(self, question_template_hash: str) -> HAIOCache | None:
+        pass
+
+    @abstractmethod
+    def get_data_list_cache(
+        self, question_template_hash: str, data_list_hash: str
+    ) -> DataListCache | None:
+        pass
+
+    @abstractmethod
+    def add_answers(
+        self,
+        question_template_hash: str,
+        question_template: QuestionTemplate,
+        records: list[CacheRecord],
+    ) -> None:
+        pass
+
+    @abstractmethod
+    def question_template_hashes(self) -> list[str]:
+        pass
+
+    # 最終利用時刻を更新する (loadで更新するbackendでは不要)
+    def touch_template(self, question_template_hash: str) -> None:
+        pass
+
+    # キャッシュが存在するか (旧形式のキーからの移行の判定用)
+    def exists(self, question_template_hash: str) -> bool:
+        return self.load_question_template(question_template_hash) is not None
+
+    # 以下の2つはエクスポート用、backendが対応していれば1テンプレート全体を読み込まずに済む
+    def load_question_template(
+        self, question_template_hash: str
+    ) -> QuestionTemplate | None:
+        cache = self.load(question_template_hash)
+        return cache["question_template"] if cache is not None else None
+
+    def iter_data_list_caches(
+        self, question_template_hash: str
+    ) -> Iterator[tuple[str, DataListCache]]:
+        cache = self.load(question_template_hash)
+        if cache is not None:
+            yield from cache["data_lists"].items()
+
+    # data_listだけを読む (blobの参照の確認用)
+    # 最終利用時刻を変えないよう、各backendで上書きする
+    def iter_data_lists(self, question_template_hash: str) -> Iterator[DataList]:
+        for _, data_list_cache in self.iter_data_list_caches(question_template_hash):
+            yield data_list_cache["data_list"]
+
+    # 以下はキャッシュの削除(Memory_Cache_IOの容量制限)用
+    @abstractmethod
+    def remove_answers(
+        self, question_template_hash: str, entries: list[tuple[str, str]]
+    ) -> None:
+        # entries: (data_list_hash, cache_id)のリスト
+        pass
+
+    @abstractmethod
+    def remove(self, question_template_hash: str) -> None:
+        pass
+
+    @abstractmethod
+    def get_sizes(self) -> dict[str, tuple[int, float]]:
+        # question_template_hash -> (バイト数, 最終利用時刻)
+        pass
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
@@ -1,10 +1,13 @@
 from icecream import ic
 from typing import Any, Tuple
 import base64
+import copy
 import hashlib
 import json
 import uuid
 
+from haio.types import QuestionConfig, QuestionTemplate, DataList
+
 
 def help() -> None:
     print("HumanAI.io")
@@ -13,10 +16,70 @@ def help() -> None:
 check_frequency = 5
 
 
+# キャッシュキーの形式のバージョン
+# "v2_" + blake2b のキーを使う。接頭辞の無い32桁のキーは旧形式(md5)
+cache_key_version = "v2"
+
+
 def haio_hash(src: Any) -> str:
+    # JSON文字列を組み立てず、値を順に正規化してハッシュに流し込む
+    hasher = hashlib.blake2b(digest_size=16)
+    _update_canonical_hash(hasher, src)
+    return f"{cache_key_version}_{hasher.hexdigest()}"
+
+
+def legacy_haio_hash(src: Any) -> str:
     return hashlib.md5(json.dumps(src, sort_keys=True).encode()).hexdigest()
 
 
+def is_legacy_hash(hash: str) -> bool:
+    return not hash.startswith(f"{cache_key_version}_")
+
+
+# 型ごとのタグと長さを付けて書き込むので、異なる値が同じバイト列になることはない
+# dictのキーはjson.dumps(sort_keys=True)と同様に並べ替える
+def _update_canonical_hash(hasher: hashlib.blake2b, src: Any) -> None:
+    if isinstance(src, str):
+        encoded = src.encode()
+        hasher.update(b"s%d:" % len(encoded))
+        hasher.update(encoded)
+    elif src is None:
+        hasher.update(b"n")
+    elif isinstance(src, bool):
+        hasher.update(b"t" if src else b"f")
+    elif isinstance(src, int):
+        hasher.update(b"i%d;" % src)
+    elif isinstance(src, float):
+        hasher.update(b"d%s;" % repr(src).encode())
+    elif isinstance(src, (list, tuple)):
+        hasher.update(b"l%d:" % len(src))
+        for item in src:
+            _update_canonical_hash(hasher, item)
+    elif isinstance(src, dict):
+        hasher.update(b"m%d:" % len(src))
+        for key in sorted(src):
+            _update_canonical_hash(hasher, str(key))
+            _update_canonical_hash(hasher, src[key])
+    else:
+        raise TypeError(f"Object of type {type(src).__name__} cannot be hashed.")
+
+
+def insert_data(
+    question_template: QuestionTemplate, data_list: DataList
+) -> QuestionConfig:
+    question_config = copy.deepcopy(question_template)
+    for i in range(len(question_config["question"])):
+        if type(question_config["question"][i].get("value", None)) == int:
+            question_config["question"][i]["value"] = data_list[
+                question_config["question"][i]["value"]
+            ]
+        if type(question_config["question"][i].get("src", None)) == int:
+            question_config["question"][i]["src"] = data_list[
+                question_config["question"][i]["src"]
+            ]
+    return question_config
+
+
 def haio_uid() -> str:
     return str(uuid.uuid4())
 
@@ -1,60 +1,258 @@
+from collections import Counter, deque
 from icecream import ic
-from scipy.stats import binomtest, beta
+from scipy.stats import beta, binom
 from sortedcontainers import SortedDict
-from typing import overload, TypedDict, Literal, Tuple, Final
+from statistics import NormalDist
+from typing import (
+    overload,
+    TypedDict,
+    Literal,
+    Tuple,
+    Final,
+    Iterable,
+    Iterator,
+    AsyncIterator,
+    Callable,
+)
 import asyncio
 import copy
 import json
+import math
 import os
 import random
 import sys
+import time
+import numpy as np
 
 from haio.worker_io.types import Worker_IO
 from haio.worker_io.bedrock_io import Bedrock_IO
 from haio.worker_io.gemini_io import Gemini_IO
+from haio.worker_io.image_fetcher import get_image_fetcher
 from haio.worker_io.openai_io import OpenAI_IO
-from .common import check_frequency, haio_hash, haio_uid
-from .types import QuestionConfig, QuestionTemplate, DataList, Answer
+from haio.cache_io.types import Cache_IO, CacheRecord
+from haio.cache_io.blob_store import Blob_Store
+from haio.cache_io.json_cache_io import JSON_Cache_IO
+from haio.cache_io.jsonl_cache_io import JSONL_Cache_IO
+from haio.cache_io.memory_cache_io import Memory_Cache_IO
+from .common import (
+    check_frequency,
+    haio_hash,
+    haio_uid,
+    insert_data,
+    is_legacy_hash,
+    legacy_haio_hash,
+)
+from .types import (
+    QuestionConfig,
+    QuestionTemplate,
+    DataList,
+    Answer,
+    client_types,
+    ClientType,
+    AnswerCache,
+    DataListCache,
+    HAIOCache,
+)
 
 
 class AskedQuestion(TypedDict):
     question_template: QuestionTemplate
     data_list: DataList
+    question_template_hash: str
+    data_list_hash: str
+
+
+# CTAの承認に使う閾値表
+# (quality_requirement, significance_level) -> n回中に必要な最小の正解数 (n番目の要素)
+# binomtest(k, n, p=quality_requirement, alternative="greater") のp値はkについて単調減少なので、
+# 承認されるかどうかはkが閾値以上かどうかだけで決まる
+_binomial_thresholds: dict[tuple[float, float], list[int]] = {}
+
+
+def get_binomial_threshold(
+    n: int, quality_requirement: float, significance_level: float
+) -> int:
+    thresholds = _binomial_thresholds.setdefault(
+        (quality_requirement, significance_level), []
+    )
+    # 必要な分だけ表を伸ばす。閾値はnが1増えると同じか1大きくなるので、前の閾値から探す
+    # どのkでも承認されないnの閾値はn+1
+    while len(thresholds) <= n:
+        m = len(thresholds)
+        k = thresholds[-1] if thresholds else 0
+        while k <= m and binom.sf(k - 1, m, quality_requirement) >= significance_level:
+            k += 1
+        thresholds.append(k)
+    return thresholds[n]
+
+
+# k=correct_count, n=correct_count+incorrect_count としたbinomtestのp値がsignificance_level未満かどうかと同じ
+def is_cta_approved(
+    correct_count: int,
+    incorrect_count: int,
+    quality_requirement: float,
+    significance_level: float,
+) -> bool:
+    return correct_count >= get_binomial_threshold(
+        correct_count + incorrect_count, quality_requirement, significance_level
+    )
+
+
+# iteration回中failure_count回失敗したモンテカルロ法のp値の、信頼係数confidenceの信頼区間 (Wilson)
+# チャンクごとに呼ぶので、scipyを使わず閉じた式で求める
+def gta_p_value_interval(
+    failure_count: int, iteration: int, confidence: float
+) -> tuple[float, float]:
+    z = NormalDist().inv_cdf(1 - (1 - confidence) / 2)
+    p = failure_count / iteration
+    denominator = 1 + z**2 / iteration
+    center = (p + z**2 / (2 * iteration)) / denominator
+    half_width = (
+        z * math.sqrt(p * (1 - p) / iteration + z**2 / (4 * iteration**2)) / denominator
+    )
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+
+# p値の信頼区間がsignificance_levelの片側に収まり、承認するかどうかが決まったか
+def is_gta_decided(
+    failure_count: int, iteration: int, significance_level: float, confidence: float
+) -> bool:
+    lower, upper = gta_p_value_interval(failure_count, iteration, confidence)
+    return upper < significance_level or significance_level <= lower
+
+
+# 1回の実行の間、GTAの統計的検定をタスククラスタのサンプルを使い回しながら行う
+# 各タスククラスタの正解率の事後分布のサンプルは (correct_count, incorrect_count) と共に保持し、回数が変わったものだけ引き直す
+# 承認済みタスククラスタのサンプルを大きさで重み付けした和も保持し、変わったクラスタの分だけ差し替える
+# 検定1回あたりの計算は、承認済みタスククラスタの数によらずO(iteration)になる
+# chunk_sizeを指定すると、サンプルをchunk_size回ずつ増やし、承認するかどうかが決まった時点で打ち切る
+# (iterationはサンプル数の上限になる)
+class GTA_Sample_Cache:
+    def __init__(
+        self,
+        iteration: int,
+        chunk_size: int | None = None,
+        confidence: float = 0.99,
+    ) -> None:
+        self.iteration = iteration
+        self.chunk_size = chunk_size if chunk_size is not None else iteration
+        self.confidence = confidence
+        # id(task_cluster) -> (task_cluster, (correct_count, incorrect_count), サンプル)
+        # サンプルは必要になった分だけ後ろに追加する
+        self.samples: dict[
+            int, tuple["HAIOClient.TaskCluster", tuple[int, int], np.ndarray]
+        ] = {}
+        # 和に含めている承認済みタスククラスタ
+        # id(task_cluster) -> (task_cluster, (correct_count, incorrect_count), 大きさ, サンプル)
+        self.approved: dict[
+            int, tuple["HAIOClient.TaskCluster", tuple[int, int], int, np.ndarray]
+        ] = {}
+        # 和は先頭のsample_length回分だけ持つ
+        self.sample_length = 0
+        self.approved_sum = np.zeros(0)
+        self.approved_size = 0
+
+    def _get_samples(
+        self, task_cluster: "HAIOClient.TaskCluster", length: int
+    ) -> np.ndarray:
+        counts = (task_cluster["correct_count"], task_cluster["incorrect_count"])
+        cached = self.samples.get(id(task_cluster), None)
+        samples = (
+            cached[2]
+            if cached is not None and cached[0] is task_cluster and cached[1] == counts
+            else np.zeros(0)
+        )
+        if len(samples) < length:
+            samples = np.concatenate(
+                [
+                    samples,
+                    beta.rvs(
+                        a=counts[0] + 1, b=counts[1] + 1, size=length - len(samples)
+                    ),
+                ]
+            )
+            self.samples[id(task_cluster)] = (task_cluster, counts, samples)
+        return samples
 
+    def _remove_approved(self, task_cluster_id: int) -> None:
+        _, _, size, samples = self.approved.pop(task_cluster_id)
+        self.approved_sum -= size * samples[: self.sample_length]
+        self.approved_size -= size
 
-def insert_data(
-    question_template: QuestionTemplate, data_list: DataList
-) -> QuestionConfig:
-    question_config = copy.deepcopy(question_template)
-    for i in range(len(question_config["question"])):
-        if type(question_config["question"][i].get("value", None)) == int:
-            question_config["question"][i]["value"] = data_list[
-                question_config["question"][i]["value"]
-            ]
-        if type(question_config["question"][i].get("src", None)) == int:
-            question_config["question"][i]["src"] = data_list[
-                question_config["question"][i]["src"]
-            ]
-    return question_config
-
-
-client_types = ["human", "openai", "gemini", "llama", "claude", "nova"]
-ClientType = Literal["human", "openai", "gemini", "llama", "claude", "nova"]
-
-
-class AnswerCache(TypedDict):
-    client: ClientType
-    answer: Answer
-
-
-class DataListCache(TypedDict):
-    data_list: DataList
-    answer_list: dict[str, AnswerCache]
-
-
-class HAIOCache(TypedDict):
-    question_template: QuestionTemplate
-    data_lists: dict[str, DataListCache]
+    def _update_approved(
+        self, approved_task_clusters: list["HAIOClient.TaskCluster"]
+    ) -> None:
+        approved_ids = {id(task_cluster) for task_cluster in approved_task_clusters}
+        for task_cluster_id in [
+            task_cluster_id
+            for task_cluster_id in self.approved
+            if task_cluster_id not in approved_ids
+        ]:
+            self._remove_approved(task_cluster_id)
+        for task_cluster in approved_task_clusters:
+            counts = (task_cluster["correct_count"], task_cluster["incorrect_count"])
+            size = len(task_cluster["task_indexes"])
+            approved = self.approved.get(id(task_cluster), None)
+            if approved is not None:
+                if (
+                    approved[0] is task_cluster
+                    and approved[1] == counts
+                    and approved[2] == size
+                ):
+                    continue
+                self._remove_approved(id(task_cluster))
+            samples = self._get_samples(task_cluster, self.sample_length)
+            self.approved[id(task_cluster)] = (task_cluster, counts, size, samples)
+            self.approved_sum += size * samples[: self.sample_length]
+            self.approved_size += size
+
+    # 承認済みタスククラスタの和を、先頭のlength回分まで伸ばす
+    def _extend_approved(self, length: int) -> None:
+        if length <= self.sample_length:
+            return
+        extension = np.zeros(length - self.sample_length)
+        for task_cluster_id, (task_cluster, counts, size, _) in list(
+            self.approved.items()
+        ):
+            samples = self._get_samples(task_cluster, length)
+            self.approved[task_cluster_id] = (task_cluster, counts, size, samples)
+            extension += size * samples[self.sample_length : length]
+        self.approved_sum = np.concatenate([self.approved_sum, extension])
+        self.sample_length = length
+
+    # _gta_statistical_test(approved_task_clusters + [task_cluster]) と同じ検定
+    def test(
+        self,
+        approved_task_clusters: list["HAIOClient.TaskCluster"],
+        task_cluster: "HAIOClient.TaskCluster",
+        quality_requirement: float,
+        significance_level: float | None = None,
+    ) -> float:
+        self._update_approved(approved_task_clusters)
+        size = len(task_cluster["task_indexes"])
+        failure_count = 0
+        length = 0
+        while length < self.iteration:
+            start = length
+            length = min(length + self.chunk_size, self.iteration)
+            self._extend_approved(length)
+            qualities = (
+                self.approved_sum[start:length]
+                + size * self._get_samples(task_cluster, length)[start:length]
+            ) / (self.approved_size + size)
+            failure_count += (length - start) - int(
+                np.count_nonzero(qualities >= quality_requirement)
+            )
+            # 上限に達した場合は、信頼区間によらず終える
+            if (
+                significance_level is not None
+                and length < self.iteration
+                and is_gta_decided(
+                    failure_count, length, significance_level, self.confidence
+                )
+            ):
+                break
+        return failure_count / length
 
 
 class HAIOClient:
@@ -77,8 +275,7 @@ class HAIOClient:
 
     class MethodState(MethodStateRequired, total=False):
         task_phases: SortedDict[int, set[int]]
-        question_template: QuestionTemplate
-        data_lists: list[DataList | None]
+        asked_questions: list[AskedQuestion | None]
 
     def __init__(
         self,
@@ -89,6 +286,7 @@ class HAIOClient:
         claude_io: Bedrock_IO | None = None,
         nova_io: Bedrock_IO | None = None,
         filepath: str | None = None,
+        cache_io: Cache_IO | None = None,
     ) -> None:
         self.human_client = human_io
 
@@ -106,8 +304,30 @@ class HAIOClient:
         # if len(self.ai_clients) == 0:
         #     warnings.warn("No AI client is set.")
         self.filepath = filepath
+        # 既定では従来通り haio_cache/<question_template_hash> のJSONファイルを使う
+        if cache_io is None:
+            cache_io = JSON_Cache_IO(self._get_cache_dir_path())
+        # question_templateごとにメモリへ読み込み、回答はまとめて書き込む
+        # 画像のdata URLなど大きなdata_listの要素は haio_cache/blobs に一度だけ保存する
+        self.cache_io: Memory_Cache_IO = (
+            cache_io
+            if isinstance(cache_io, Memory_Cache_IO)
+            else Memory_Cache_IO(
+                cache_io,
+                blob_store=Blob_Store(
+                    os.path.join(self._get_cache_dir_path(), "blobs")
+                ),
+            )
+        )
+        # 実行中に使用したキャッシュは容量制限で削除させない
+        self.cache_io.is_reserved = self._is_cache_reserved
 
         self.used_cache: dict[str, dict[str, set[str]]] = {}
+        self.unused_cache_ids: dict[tuple[str, str, ClientType], deque[str]] = {}
+        # id(question_template) -> (question_template, question_template_hash)
+        self.question_template_hashes: dict[int, tuple[QuestionTemplate, str]] = {}
+        # 回答を待たずに判定から外した人間への質問 (回答が届けばキャッシュに追加される)
+        self.background_tasks: set[asyncio.Task[Answer]] = set()
 
         # _sequential_cta_method state
         self._sequential_cta_1_method_state: Final[
@@ -131,6 +351,7 @@ class HAIOClient:
 
     def del_cache_use_hist(self):
         self.used_cache = {}
+        self.unused_cache_ids = {}
 
     def reset_state(self):
         self._sequential_cta_1_method_state = {}
@@ -140,6 +361,144 @@ class HAIOClient:
         self._sequential_gta_2_method_state = {}
         self._sequential_gta_3_method_state = {}
 
+    # バッファ中の回答をキャッシュへ書き込む
+    def flush(self) -> None:
+        self.cache_io.flush()
+
+    # 判定から外した人間への質問の回答を待ってから、キャッシュへ書き込む
+    async def aflush(self) -> None:
+        while self.background_tasks:
+            await asyncio.wait(list(self.background_tasks))
+        self.flush()
+
+    async def aclose(self) -> None:
+        await self.aflush()
+        self.cache_io.close()
+        for ai_client in self.ai_clients.values():
+            if isinstance(ai_client, (OpenAI_IO, Gemini_IO, Bedrock_IO)):
+                await ai_client.aclose()
+        # 画像の取得に使うコネクションプール (既定では全Worker_IOで共有)
+        image_fetchers = {id(get_image_fetcher()): get_image_fetcher()}
+        for ai_client in self.ai_clients.values():
+            if isinstance(ai_client, (Gemini_IO, Bedrock_IO)):
+                image_fetchers[id(ai_client.image_fetcher)] = ai_client.image_fetcher
+        for image_fetcher in image_fetchers.values():
+            await image_fetcher.aclose()
+
+    # backendがJSONL_Cache_IOの場合に、旧形式(JSON_Cache_IO)のキャッシュファイルをその場で変換する
+    def convert_legacy_cache(self) -> int:
+        if not isinstance(self.cache_io.backend, JSONL_Cache_IO):
+            raise Exception("The cache backend is not JSONL_Cache_IO.")
+        self.flush()
+        return self.cache_io.backend.convert_legacy()
+
+    # cache import/export
+
+    # キャッシュを1行1JSONの形式で逐次書き出す
+    # テンプレートごとにquestion_templateの行、続いてdata_listごとにその回答をまとめた行を出力する
+    def export_cache(
+        self, question_template: QuestionTemplate | None = None
+    ) -> Iterator[str]:
+        question_template_hashes = (
+            [self._get_question_template_hash(question_template)]
+            if question_template is not None
+            else self.cache_io.question_template_hashes()
+        )
+        for question_template_hash in question_template_hashes:
+            cached_question_template = self.cache_io.load_question_template(
+                question_template_hash
+            )
+            if cached_question_template is None:
+                continue
+            yield json.dumps(
+                {
+                    "question_template_hash": question_template_hash,
+                    "question_template": cached_question_template,
+                }
+            ) + "\n"
+            for data_list_hash, data_list_cache in self.cache_io.iter_data_list_caches(
+                question_template_hash
+            ):
+                yield json.dumps(
+                    {
+                        "question_template_hash": question_template_hash,
+                        "data_list_hash": data_list_hash,
+                        "data_list": self.cache_io.load_data_list(
+                            data_list_cache["data_list"]
+                        ),
+                        "answer_list": data_list_cache["answer_list"],
+                    }
+                ) + "\n"
+
+    # export_cacheの出力を逐次読み込み、キャッシュに追加する
+    def import_cache(self, lines: Iterable[str]) -> int:
+        answer_count = 0
+        question_templates: dict[str, QuestionTemplate] = {}
+        for line in lines:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            question_template_hash = entry["question_template_hash"]
+            if "question_template" in entry:
+                question_templates[question_template_hash] = entry["question_template"]
+                continue
+            if question_template_hash not in question_templates:
+                raise Exception("The question template line is missing.")
+            data_list_hash = entry["data_list_hash"]
+            # 旧形式(md5)のキーでエクスポートされたものは新しいキーで取り込む
+            if is_legacy_hash(question_template_hash):
+                question_template_hash = haio_hash(
+                    question_templates[entry["question_template_hash"]]
+                )
+            if is_legacy_hash(data_list_hash):
+                data_list_hash = haio_hash(entry["data_list"])
+            records: list[CacheRecord] = [
+                {
+                    "data_list_hash": data_list_hash,
+                    "data_list": entry["data_list"],
+                    "cache_id": cache_id,
+                    "answer_cache": answer_cache,
+                }
+                for cache_id, answer_cache in entry["answer_list"].items()
+            ]
+            self.cache_io.add_answers(
+                question_template_hash=question_template_hash,
+                question_template=question_templates[entry["question_template_hash"]],
+                records=records,
+            )
+            answer_count += len(records)
+            # 追加された回答を未使用として扱えるよう、索引を作り直す
+            for client in {record["answer_cache"]["client"] for record in records}:
+                self.unused_cache_ids.pop(
+                    (question_template_hash, data_list_hash, client), None
+                )
+        self.flush()
+        return answer_count
+
+    # waitの前に、必要なキャッシュを一度にメモリへ読み込み、索引を作っておく
+    def prewarm(self, asked_questions: list[AskedQuestion]) -> int:
+        asked_questions = [
+            self._complete_asked_question(asked_question)
+            for asked_question in asked_questions
+        ]
+        for question_template_hash in {
+            asked_question["question_template_hash"]
+            for asked_question in asked_questions
+        }:
+            self.cache_io.prewarm(question_template_hash)
+        cached_answer_count = 0
+        clients: list[ClientType] = ["human", *self.ai_clients.keys()]
+        for asked_question in asked_questions:
+            for client in clients:
+                cached_answer_count += len(
+                    self._get_unused_cache_ids(
+                        question_template_hash=asked_question["question_template_hash"],
+                        data_list_hash=asked_question["data_list_hash"],
+                        client=client,
+                    )
+                )
+        return cached_answer_count
+
     @overload
     def _get_cache_dir_path(self, ensure_exist: Literal[True] = True) -> str: ...
     @overload
@@ -162,148 +521,228 @@ class HAIOClient:
 
         return cache_dir
 
-    @overload
-    def _get_cache_file_path(
-        self, question_template: QuestionTemplate, ensure_exist: Literal[True] = True
-    ) -> str: ...
-    @overload
-    def _get_cache_file_path(
-        self, question_template: QuestionTemplate, ensure_exist: Literal[False]
-    ) -> str | None: ...
-    def _get_cache_file_path(self, question_template, ensure_exist=True):
-        # haio_cacheディレクトリのパスを取得
-        cache_dir_path = self._get_cache_dir_path()
-
-        # question_templateをハッシュ化
+    # question_templateのハッシュを取得
+    # 同じquestion_templateオブジェクトは1度だけハッシュ化する
+    def _get_question_template_hash(self, question_template: QuestionTemplate) -> str:
+        memo = self.question_template_hashes.get(id(question_template), None)
+        if memo is not None and memo[0] is question_template:
+            return memo[1]
         question_template_hash = haio_hash(question_template)
+        self.question_template_hashes[id(question_template)] = (
+            question_template,
+            question_template_hash,
+        )
+        self._migrate_legacy_cache(question_template, question_template_hash)
+        return question_template_hash
 
-        # question_templateに対するキャッシュファイルが存在するか確認
-        cache_file_path = os.path.join(cache_dir_path, question_template_hash)
-        if not os.path.exists(cache_file_path):
-            if ensure_exist:  # ensure_existがTrueならキャッシュファイルを作成
-                with open(cache_file_path, "w") as f:
-                    json.dump(
-                        {"question_template": question_template, "data_lists": {}}, f
-                    )
-            else:  # ensure_existがFalseならNoneを返す
-                return None
-
-        return cache_file_path
+    # 旧形式(md5)のキーで保存されたキャッシュがあれば、新しいキーに書き写す
+    # 旧形式のキャッシュは旧バージョンからも読めるよう、そのまま残す
+    def _migrate_legacy_cache(
+        self, question_template: QuestionTemplate, question_template_hash: str
+    ) -> None:
+        if self.cache_io.exists(question_template_hash):
+            return
+        legacy_question_template_hash = legacy_haio_hash(question_template)
+        if not self.cache_io.exists(legacy_question_template_hash):
+            return
+        records: list[CacheRecord] = []
+        for _, data_list_cache in self.cache_io.iter_data_list_caches(
+            legacy_question_template_hash
+        ):
+            data_list_hash = haio_hash(
+                self.cache_io.load_data_list(data_list_cache["data_list"])
+            )
+            records.extend(
+                {
+                    "data_list_hash": data_list_hash,
+                    "data_list": data_list_cache["data_list"],
+                    "cache_id": cache_id,
+                    "answer_cache": answer_cache,
+                }
+                for cache_id, answer_cache in data_list_cache["answer_list"].items()
+            )
+        self.cache_io.add_answers(
+            question_template_hash=question_template_hash,
+            question_template=question_template,
+            records=records,
+        )
 
-    @overload
     def _get_data_cache_list(
         self,
-        question_template: QuestionTemplate,
-        data_list: DataList,
-        ensure_exist: Literal[True],
-    ) -> DataListCache: ...
-    @overload
-    def _get_data_cache_list(
+        question_template_hash: str,
+        data_list_hash: str,
+    ) -> DataListCache | None:
+        return self.cache_io.get_data_list_cache(
+            question_template_hash=question_template_hash,
+            data_list_hash=data_list_hash,
+        )
+
+    # (question_template, data_list, client)ごとの未使用cache_idのキューを取得
+    # 初回のみanswer_listを走査して作成し、以降は先頭から取り出すだけで済む
+    def _get_unused_cache_ids(
         self,
-        question_template: QuestionTemplate,
-        data_list: DataList,
-        ensure_exist: Literal[False] = False,
-    ) -> DataListCache | None: ...
-    def _get_data_cache_list(
+        question_template_hash: str,
+        data_list_hash: str,
+        client: ClientType,
+    ) -> deque[str]:
+        key = (question_template_hash, data_list_hash, client)
+        if key not in self.unused_cache_ids:
+            data_list_cache = self._get_data_cache_list(
+                question_template_hash=question_template_hash,
+                data_list_hash=data_list_hash,
+            )
+            used_cache_ids = self.used_cache.get(question_template_hash, {}).get(
+                data_list_hash, set()
+            )
+            self.unused_cache_ids[key] = deque(
+                (
+                    cache_id
+                    for cache_id, item in data_list_cache["answer_list"].items()
+                    if (cache_id not in used_cache_ids and item["client"] == client)
+                )
+                if data_list_cache is not None
+                else ()
+            )
+        return self.unused_cache_ids[key]
+
+    def _is_cache_reserved(
         self,
-        question_template,
-        data_list,
-        ensure_exist=False,
-    ):
-        cache_file_path = self._get_cache_file_path(
-            question_template=question_template, ensure_exist=ensure_exist
+        question_template_hash: str,
+        data_list_hash: str | None = None,
+        cache_id: str | None = None,
+    ) -> bool:
+        if data_list_hash is None:
+            return question_template_hash in self.used_cache
+        return cache_id in self.used_cache.get(question_template_hash, {}).get(
+            data_list_hash, set()
         )
-        if cache_file_path is None:
-            return None
-        with open(cache_file_path, "r") as f:
-            cache: HAIOCache = json.load(f)
-        data_list_hash = haio_hash(data_list)
-        data_list_cache = cache["data_lists"].get(data_list_hash, None)
-        if data_list_cache is None:
-            if ensure_exist:
-                cache["data_lists"][data_list_hash] = {
-                    "data_list": data_list,
-                    "answer_list": {},
-                }
-                with open(cache_file_path, "w") as f:
-                    json.dump(cache, f)
-                data_list_cache = cache["data_lists"][data_list_hash]
-            else:
-                return None
-
-        return data_list_cache
 
     def _check_cache(
         self,
-        question_template: QuestionTemplate,
-        data_list: DataList,
+        question_template_hash: str,
+        data_list_hash: str,
         client: ClientType,
     ) -> Tuple[str | None, AnswerCache | None]:
 
-        # データに対する回答格納場所が存在するか確認、なければ作成
+        # 想定するクライアントの未使用の回答が存在するか確認、あればそれを返し、なければ何もしない
+        unused_cache_ids = self._get_unused_cache_ids(
+            question_template_hash=question_template_hash,
+            data_list_hash=data_list_hash,
+            client=client,
+        )
         data_list_cache = self._get_data_cache_list(
-            question_template=question_template, data_list=data_list, ensure_exist=True
+            question_template_hash=question_template_hash,
+            data_list_hash=data_list_hash,
         )
-        # 想定するクライアントの回答が存在するか確認、あればそれを返し、なければ何もしない
-        used_cache_ids = self.used_cache.get(haio_hash(question_template), {}).get(
-            haio_hash(data_list), set()
+        # 容量制限で削除された回答は読み飛ばす
+        while unused_cache_ids and (
+            data_list_cache is None
+            or unused_cache_ids[0] not in data_list_cache["answer_list"]
+        ):
+            unused_cache_ids.popleft()
+        if not unused_cache_ids or data_list_cache is None:
+            return None, None
+        answer_cache_id = unused_cache_ids[0]
+
+        return answer_cache_id, data_list_cache["answer_list"][answer_cache_id]
+
+    # 未使用のキャッシュを最大n件確保し、used_cacheに記録する
+    def _reserve_cache(
+        self,
+        question_template_hash: str,
+        data_list_hash: str,
+        client: ClientType,
+        n: int = 1,
+    ) -> list[str]:
+        unused_cache_ids = self._get_unused_cache_ids(
+            question_template_hash=question_template_hash,
+            data_list_hash=data_list_hash,
+            client=client,
         )
-        answer_cache_id, answer_data = next(
-            (
-                (key, item)
-                for key, item in data_list_cache["answer_list"].items()
-                if (key not in used_cache_ids and item["client"] == client)
-            ),
-            (None, None),
+        cache_ids: list[str] = []
+        while len(cache_ids) < n:
+            cache_id, _ = self._check_cache(
+                question_template_hash=question_template_hash,
+                data_list_hash=data_list_hash,
+                client=client,
+            )
+            if cache_id is None:
+                break
+            unused_cache_ids.popleft()
+            cache_ids.append(cache_id)
+            self.cache_io.touch(cache_id)
+        self.used_cache.setdefault(question_template_hash, {}).setdefault(
+            data_list_hash, set()
+        ).update(cache_ids)
+        return cache_ids
+
+    # _reserve_cacheで確保した(または新たに聞いて追加した)回答を、使わなかったものとして未使用に戻す
+    def _release_cache(
+        self,
+        question_template_hash: str,
+        data_list_hash: str,
+        client: ClientType,
+        cache_id: str,
+    ) -> None:
+        self.used_cache.get(question_template_hash, {}).get(
+            data_list_hash, set()
+        ).discard(cache_id)
+        # 索引は次に参照されたときに作り直す
+        self.unused_cache_ids.pop(
+            (question_template_hash, data_list_hash, client), None
         )
 
-        return answer_cache_id, answer_data
-
     def _add_cache(
         self,
-        cache_file_path: str,
-        data_list: DataList,
+        asked_question: AskedQuestion,
         client: ClientType,
         answer: Answer,
         cache_id: str | None = None,
     ):
         if cache_id is None:
             cache_id = haio_uid()
-        with open(cache_file_path, "r") as f:
-            cache = json.load(f)
-        cache["data_lists"][haio_hash(data_list)]["answer_list"][cache_id] = {
-            "client": client,
-            "answer": answer,
-        }
-        with open(cache_file_path, "w") as f:
-            json.dump(cache, f)
+        self.cache_io.add_answers(
+            question_template_hash=asked_question["question_template_hash"],
+            question_template=asked_question["question_template"],
+            records=[
+                {
+                    "data_list_hash": asked_question["data_list_hash"],
+                    "data_list": asked_question["data_list"],
+                    "cache_id": cache_id,
+                    "answer_cache": {
+                        "client": client,
+                        "answer": answer,
+                        "created_at": time.time(),
+                    },
+                }
+            ],
+        )
 
     class RequestedQuestion(TypedDict):
-        question_template: QuestionTemplate
-        data_list: DataList
+        asked_question: AskedQuestion
         cache_id: str
         requested_id: str | None
         client: ClientType
 
     def _ask(
         self,
-        question_template: QuestionTemplate,
-        data_list: DataList,
+        asked_question: AskedQuestion,
         client: ClientType,
+        cache_id: str | None = None,
     ) -> RequestedQuestion:
         # キャッシュがあれば取得し、なければタスクを投げる
         # タスクを投げる = client.ask()
+        # cache_idが与えられた場合は、_reserve_cacheで確保済みのキャッシュを使う
 
-        # キャッシュの有無を確認
-        cache_id, _ = self._check_cache(
-            question_template=question_template, data_list=data_list, client=client
-        )
-
-        # used_cacheに格納場所を確保
-        self.used_cache.setdefault(haio_hash(question_template), {})
-        self.used_cache[haio_hash(question_template)].setdefault(
-            haio_hash(data_list), set()
-        )
+        # キャッシュの有無を確認し、あれば確保
+        if cache_id is None:
+            reserved_cache_ids = self._reserve_cache(
+                question_template_hash=asked_question["question_template_hash"],
+                data_list_hash=asked_question["data_list_hash"],
+                client=client,
+            )
+            if reserved_cache_ids:
+                cache_id = reserved_cache_ids[0]
 
         requested_id = None
         if cache_id is None:
@@ -318,17 +757,17 @@ class HAIOClient:
 
             requested_id = client_entity.ask(
                 question_config=insert_data(
-                    question_template=question_template, data_list=data_list
+                    question_template=asked_question["question_template"],
+                    data_list=asked_question["data_list"],
                 )
             )
 
-        self.used_cache[haio_hash(question_template)][haio_hash(data_list)].add(
-            cache_id
-        )
+            self.used_cache.setdefault(
+                asked_question["question_template_hash"], {}
+            ).setdefault(asked_question["data_list_hash"], set()).add(cache_id)
 
         return {
-            "question_template": question_template,
-            "data_list": data_list,
+            "asked_question": asked_question,
             "cache_id": cache_id,
             "requested_id": requested_id,
             "client": client,
@@ -338,11 +777,17 @@ class HAIOClient:
         # 回答を取得し、キャッシュ未追加なら追加する
 
         if requested_question["requested_id"] is None:
-            return self._get_data_cache_list(
-                question_template=requested_question["question_template"],
-                data_list=requested_question["data_list"],
-                ensure_exist=True,
-            )["answer_list"][requested_question["cache_id"]]["answer"]
+            data_list_cache = self._get_data_cache_list(
+                question_template_hash=requested_question["asked_question"][
+                    "question_template_hash"
+                ],
+                data_list_hash=requested_question["asked_question"]["data_list_hash"],
+            )
+            if data_list_cache is None:
+                raise Exception("The cache was not found.")
+            return data_list_cache["answer_list"][requested_question["cache_id"]][
+                "answer"
+            ]
 
         client_entity: Worker_IO
         if requested_question["client"] == "human":
@@ -352,15 +797,17 @@ class HAIOClient:
         else:
             raise Exception("Invalid client.")
 
-        while not client_entity.is_finished(requested_question["requested_id"]):
+        # is_finishedとget_answerはAPIを呼ぶ同期処理なので、イベントループを止めないよう別スレッドで呼ぶ
+        while not await asyncio.to_thread(
+            client_entity.is_finished, requested_question["requested_id"]
+        ):
             await asyncio.sleep(check_frequency)
-        answer = client_entity.get_answer(requested_question["requested_id"])
+        answer = await asyncio.to_thread(
+            client_entity.get_answer, requested_question["requested_id"]
+        )
 
         self._add_cache(
-            cache_file_path=self._get_cache_file_path(
-                question_template=requested_question["question_template"]
-            ),
-            data_list=requested_question["data_list"],
+            asked_question=requested_question["asked_question"],
             client=requested_question["client"],
             cache_id=requested_question["cache_id"],
             answer=answer,
@@ -368,57 +815,193 @@ class HAIOClient:
 
         return answer
 
+    async def _ask_get_answer(
+        self,
+        asked_question: AskedQuestion,
+        client: ClientType,
+        cache_id: str | None = None,
+    ) -> Answer:
+        if client not in self.ai_clients:
+            requested_question = self._ask(
+                asked_question=asked_question, client=client, cache_id=cache_id
+            )
+            await asyncio.to_thread(self.human_client.flush)
+            answer = await self._get_answer(requested_question)
+            return answer
+
+        # AIへの質問はWorker_IOのask_get_answerで待つ
+        # 非同期のWorker_IOならイベントループを止めないので、複数の質問を同時に待てる
+        if cache_id is None:
+            reserved_cache_ids = self._reserve_cache(
+                question_template_hash=asked_question["question_template_hash"],
+                data_list_hash=asked_question["data_list_hash"],
+                client=client,
+            )
+            if reserved_cache_ids:
+                cache_id = reserved_cache_ids[0]
+        if cache_id is not None:
+            return await self._get_answer(
+                {
+                    "asked_question": asked_question,
+                    "cache_id": cache_id,
+                    "requested_id": None,
+                    "client": client,
+                }
+            )
+
+        cache_id = haio_uid()
+        self.used_cache.setdefault(
+            asked_question["question_template_hash"], {}
+        ).setdefault(asked_question["data_list_hash"], set()).add(cache_id)
+        # question_templateのハッシュも渡し、Worker_IO側でプロンプトの骨組みを使い回せるようにする
+        answer = await self.ai_clients[client].ask_get_answer_from_template(
+            question_template=asked_question["question_template"],
+            data_list=asked_question["data_list"],
+            question_template_hash=asked_question["question_template_hash"],
+        )
+        self._add_cache(
+            asked_question=asked_question,
+            client=client,
+            cache_id=cache_id,
+            answer=answer,
+        )
+        return answer
+
     async def ask_get_answer(
         self,
         question_template: QuestionTemplate,
         data_list: DataList,
         client: ClientType,
     ) -> Answer:
-
-        requested_question = self._ask(
-            question_template=question_template, data_list=data_list, client=client
+        return await self._ask_get_answer(
+            asked_question=self.ask(
+                question_template=question_template, data_list=data_list
+            ),
+            client=client,
         )
-        answer = await self._get_answer(requested_question)
-        return answer
 
     # ask
 
+    # question_templateとdata_listのハッシュはここで一度だけ計算し、以降はAskedQuestionのものを使う
     def ask(
         self, question_template: QuestionTemplate, data_list: DataList
     ) -> AskedQuestion:
-        return {"question_template": question_template, "data_list": data_list}
+        return {
+            "question_template": question_template,
+            "data_list": data_list,
+            "question_template_hash": self._get_question_template_hash(
+                question_template
+            ),
+            "data_list_hash": haio_hash(data_list),
+        }
+
+    def _complete_asked_question(self, asked_question: AskedQuestion) -> AskedQuestion:
+        if (
+            "question_template_hash" in asked_question
+            and "data_list_hash" in asked_question
+        ):
+            return asked_question
+        return self.ask(
+            question_template=asked_question["question_template"],
+            data_list=asked_question["data_list"],
+        )
+
+    # blobとして退避したdata_listを元に戻す
+    def _load_asked_question(self, asked_question: AskedQuestion) -> AskedQuestion:
+        return {
+            **asked_question,
+            "data_list": self.cache_io.load_data_list(asked_question["data_list"]),
+        }
 
     # asked_questionsが全て同じquestion_templateであるか確認するmethod
     def _check_same_question_template(
         self, asked_questions: list[AskedQuestion]
     ) -> bool:
-        question_template = asked_questions[0]["question_template"]
+        question_template_hash = asked_questions[0]["question_template_hash"]
         for asked_question in asked_questions:
-            if asked_question["question_template"] != question_template:
+            if asked_question["question_template_hash"] != question_template_hash:
                 return False
         return True
 
     # execution methods
 
-    class MethodReturn(TypedDict):
+    class MethodReturnRequired(TypedDict):
         answer_list: list[Answer]
         client_list: list[ClientType]
         add_human_assign: int
 
+    class MethodReturn(MethodReturnRequired, total=False):
+        # cta/gtaのみ。人間への質問の同時実行数と、人間のコストと待ち時間の関係
+        human_parallelism: int
+        # 出したが、回答が届く前に他のタスククラスタで埋まり判定に使わなかった質問の数
+        # これらの回答はバックグラウンドで受け取り、キャッシュに追加する (aflush/acloseで待てる)
+        unused_human_assign: int
+        elapsed_time: float  # 秒
+
     async def _simple_method(
         self, asked_questions: list[AskedQuestion], execution_config: dict
     ) -> MethodReturn:
         answer_list: list[Answer | None] = []
         requested_questions: list[HAIOClient.RequestedQuestion] = []
 
+        # 同じdata_listの質問の分は、まとめてキャッシュを確保
+        data_list_counts: Counter[str] = Counter(
+            asked_question["data_list_hash"] for asked_question in asked_questions
+        )
+        reserved_cache_ids: dict[str, deque[str]] = {}
         for asked_question in asked_questions:
+            data_list_hash = asked_question["data_list_hash"]
+            if data_list_hash not in reserved_cache_ids:
+                reserved_cache_ids[data_list_hash] = deque(
+                    self._reserve_cache(
+                        question_template_hash=asked_question["question_template_hash"],
+                        data_list_hash=data_list_hash,
+                        client=execution_config["client"],
+                        n=data_list_counts[data_list_hash],
+                    )
+                )
+
+        # AIの場合は全ての質問を同時に聞く (同時実行数はWorker_IO側で制限する)
+        if execution_config["client"] in self.ai_clients:
+            cache_ids: list[str | None] = []
+            for asked_question in asked_questions:
+                data_list_hash = asked_question["data_list_hash"]
+                cache_ids.append(
+                    reserved_cache_ids[data_list_hash].popleft()
+                    if reserved_cache_ids[data_list_hash]
+                    else None
+                )
+            answers = await asyncio.gather(
+                *[
+                    self._ask_get_answer(
+                        asked_question=asked_question,
+                        client=execution_config["client"],
+                        cache_id=cache_id,
+                    )
+                    for asked_question, cache_id in zip(asked_questions, cache_ids)
+                ]
+            )
+            return {
+                "answer_list": list(answers),
+                "client_list": [execution_config["client"]] * len(asked_questions),
+                "add_human_assign": 0,
+            }
+
+        for asked_question in asked_questions:
+            data_list_hash = asked_question["data_list_hash"]
             requested_question = self._ask(
-                question_template=asked_question["question_template"],
-                data_list=asked_question["data_list"],
+                asked_question=asked_question,
                 client=execution_config["client"],
+                cache_id=(
+                    reserved_cache_ids[data_list_hash].popleft()
+                    if reserved_cache_ids[data_list_hash]
+                    else None
+                ),
             )
             requested_questions.append(requested_question)
             answer_list.append(None)
+        # 溜めている質問 (MTurk_IOのpack_sizeなど) は全て聞いてから発行する
+        await asyncio.to_thread(self.human_client.flush)
 
         for i, requested_question in enumerate(requested_questions):
             answer = await self._get_answer(requested_question)
@@ -434,6 +1017,144 @@ class HAIOClient:
 
     _default_significance_level: float = 0.05
     _default_gta_iteration: int = 1000
+    # iteration_chunk_sizeを指定した場合に、p値の信頼区間に使う信頼係数
+    _gta_early_stopping_confidence: float = 0.99
+    _default_ai_concurrency: int = 64
+    _default_human_parallelism: int = 1
+
+    # 全ての質問を全てのAIに同時に聞き、質問ごとに {client: answer} を返す
+    # 結果は質問、AIの順に並べるので、タスククラスタは逐次に聞いた場合と同じ順で作られる
+    # 同時に聞く数はAIごとにai_concurrencyまでとする (遅いAIが他のAIの枠を使わないように)
+    # バッチモードのOpenAI_IOは自分でまとめて送るので、同時に聞く数を制限しない
+    async def _ask_ai_clients(
+        self, asked_questions: list[AskedQuestion], ai_concurrency: int
+    ) -> list[dict[ClientType, Answer]]:
+        semaphores: dict[ClientType, asyncio.Semaphore | None] = {
+            client: (
+                None
+                if isinstance(ai_client, OpenAI_IO) and ai_client.batch
+                else asyncio.Semaphore(ai_concurrency)
+            )
+            for client, ai_client in self.ai_clients.items()
+        }
+
+        async def ask_ai_client(
+            asked_question: AskedQuestion, client: ClientType
+        ) -> Answer:
+            semaphore = semaphores[client]
+            if semaphore is None:
+                return await self._ask_get_answer(
+                    asked_question=asked_question, client=client
+                )
+            async with semaphore:
+                return await self._ask_get_answer(
+                    asked_question=asked_question, client=client
+                )
+
+        clients = list(self.ai_clients.keys())
+        answers = await asyncio.gather(
+            *[
+                ask_ai_client(asked_question, client)
+                for asked_question in asked_questions
+                for client in clients
+            ]
+        )
+        return [
+            dict(zip(clients, answers[i * len(clients) : (i + 1) * len(clients)]))
+            for i in range(len(asked_questions))
+        ]
+
+    # 人間への質問をhuman_parallelism件まで同時に出し、回答が届いたものから (task_index, answer) を返す
+    # 届いた回答を反映した結果is_answeredになった質問は、回答を待たずに判定から外す
+    # 外した質問も取り消さずにバックグラウンドで回答を受け取り、キャッシュに追加する
+    # (取り消すとMTurkのHITは残って支払いが発生するのに、回答がキャッシュされず次回また聞くことになる)
+    async def _ask_humans(
+        self,
+        indexed_asked_questions: list[tuple[int, AskedQuestion]],
+        human_parallelism: int,
+        is_answered: Callable[[int], bool],
+        unused_task_indexes: list[int],
+    ) -> AsyncIterator[tuple[int, Answer]]:
+        pending = deque(indexed_asked_questions)
+        in_flight: dict[
+            asyncio.Task[Answer], tuple[int, HAIOClient.RequestedQuestion]
+        ] = {}
+        try:
+            while pending or in_flight:
+                requested_questions: list[tuple[int, HAIOClient.RequestedQuestion]] = []
+                while (
+                    pending
+                    and len(in_flight) + len(requested_questions) < human_parallelism
+                ):
+                    task_index, asked_question = pending.popleft()
+                    if is_answered(task_index):
+                        continue
+                    requested_questions.append(
+                        (
+                            task_index,
+                            self._ask(asked_question=asked_question, client="human"),
+                        )
+                    )
+                # 同時に出す質問は全て聞いてから発行し、MTurk_IOのpack_sizeなどでまとめられるようにする
+                if requested_questions:
+                    await asyncio.to_thread(self.human_client.flush)
+                for task_index, requested_question in requested_questions:
+                    in_flight[
+                        asyncio.create_task(self._get_answer(requested_question))
+                    ] = (task_index, requested_question)
+                if not in_flight:
+                    break
+                done, _ = await asyncio.wait(
+                    in_flight, return_when=asyncio.FIRST_COMPLETED
+                )
+                # 同時に届いた回答は、質問を出した順に反映する
+                for task in [task for task in in_flight if task in done]:
+                    task_index, _ = in_flight.pop(task)
+                    yield task_index, task.result()
+                    for other_task, (
+                        other_task_index,
+                        other_requested_question,
+                    ) in list(in_flight.items()):
+                        if not other_task.done() and is_answered(other_task_index):
+                            self._detach_task(other_task, other_requested_question)
+                            in_flight.pop(other_task)
+                            unused_task_indexes.append(other_task_index)
+        finally:
+            for task, (_, requested_question) in in_flight.items():
+                self._detach_task(task, requested_question)
+
+    # 回答を待たなくなった質問のタスクを、終わるまでbackground_tasksで保持する
+    # 回答がキャッシュに入ったら、その回答を使用済みから外し、後の質問で使えるようにする
+    def _detach_task(
+        self,
+        task: asyncio.Task[Answer],
+        requested_question: "HAIOClient.RequestedQuestion",
+    ) -> None:
+        self.background_tasks.add(task)
+        task.add_done_callback(
+            lambda task: self._on_background_task_done(task, requested_question)
+        )
+
+    def _on_background_task_done(
+        self,
+        task: asyncio.Task[Answer],
+        requested_question: "HAIOClient.RequestedQuestion",
+    ) -> None:
+        self.background_tasks.discard(task)
+        if task.cancelled():
+            return
+        # 誰も結果を受け取らないので、例外はここで取り出して表示する
+        if task.exception() is not None:
+            print("A background question failed:", repr(task.exception()))
+            return
+        self._release_cache(
+            question_template_hash=requested_question["asked_question"][
+                "question_template_hash"
+            ],
+            data_list_hash=requested_question["asked_question"]["data_list_hash"],
+            client=requested_question["client"],
+            cache_id=requested_question["cache_id"],
+        )
 
     def _gta_statistical_test(
         self,
@@ -441,26 +1162,24 @@ class HAIOClient:
         iteration: int,
         quality_requirement: float,
     ) -> float:
-        beta_distributions_list: list[list[float]] = []
-        for task_cluster in task_clusters:
-            beta_distributions_list.append(
-                beta.rvs(
-                    a=task_cluster["correct_count"] + 1,
-                    b=task_cluster["incorrect_count"] + 1,
-                    size=iteration,
-                )
-            )
-        success_count: int = 0
-        for j in range(iteration):
-            numerator: float = 0
-            denominator: int = 0
-            for i, task_cluster in enumerate(task_clusters):
-                numerator += beta_distributions_list[i][j] * len(
-                    task_cluster["task_indexes"]
-                )
-                denominator += len(task_cluster["task_indexes"])
-            if numerator / denominator >= quality_requirement:
-                success_count += 1
+        # 各タスククラスタの正解率の事後分布から、(クラスタ数, iteration) のサンプルをまとめて取り、
+        # クラスタの大きさで重み付けした平均を1回の行列演算で求める
+        correct_counts = np.array(
+            [task_cluster["correct_count"] for task_cluster in task_clusters]
+        )
+        incorrect_counts = np.array(
+            [task_cluster["incorrect_count"] for task_cluster in task_clusters]
+        )
+        task_cluster_sizes = np.array(
+            [len(task_cluster["task_indexes"]) for task_cluster in task_clusters]
+        )
+        beta_samples = beta.rvs(
+            a=correct_counts[:, np.newaxis] + 1,
+            b=incorrect_counts[:, np.newaxis] + 1,
+            size=(len(task_clusters), iteration),
+        )
+        qualities = task_cluster_sizes @ beta_samples / task_cluster_sizes.sum()
+        success_count = int(np.count_nonzero(qualities >= quality_requirement))
         return 1 - success_count / iteration
 
     async def _cta_method(
@@ -468,7 +1187,10 @@ class HAIOClient:
         asked_questions: list[AskedQuestion],
         quality_requirement: float,
         significance_level: float = _default_significance_level,
+        ai_concurrency: int = _default_ai_concurrency,
+        human_parallelism: int = _default_human_parallelism,
     ) -> MethodReturn:
+        start_time = time.time()
         # prepare
         answer_list: Final[list[Answer | None]] = [None] * len(asked_questions)
         client_list: Final[list[ClientType | None]] = [None] * len(asked_questions)
@@ -482,13 +1204,10 @@ class HAIOClient:
 
         # get answers from AIs and make task clusters
         task_clusters_dict: dict[str | int | float, HAIOClient.TaskCluster] = {}
-        for i, asked_question in enumerate(asked_questions):
+        ai_answers = await self._ask_ai_clients(asked_questions, ai_concurrency)
+        for i, ai_answer_dict in enumerate(ai_answers):
             for client in self.ai_clients.keys():
-                ai_answer = await self.ask_get_answer(
-                    question_template=asked_question["question_template"],
-                    data_list=asked_question["data_list"],
-                    client=client,
-                )
+                ai_answer = ai_answer_dict[client]
 
                 answer_candidate_lists[client][i] = ai_answer
 
@@ -511,16 +1230,14 @@ class HAIOClient:
         random.shuffle(indexed_asked_questions)
 
         # sampling and approval
-        for task_index, asked_question in indexed_asked_questions:
-            if answer_list[task_index] != None:
-                continue
-
-            # get ground truth (from human here)
-            human_answer = await self.ask_get_answer(
-                question_template=asked_question["question_template"],
-                data_list=asked_question["data_list"],
-                client="human",
-            )
+        # get ground truth (from human here), up to human_parallelism at a time
+        unused_task_indexes: list[int] = []
+        async for task_index, human_answer in self._ask_humans(
+            indexed_asked_questions=indexed_asked_questions,
+            human_parallelism=human_parallelism,
+            is_answered=lambda task_index: answer_list[task_index] != None,
+            unused_task_indexes=unused_task_indexes,
+        ):
             answer_list[task_index] = human_answer
             client_list[task_index] = "human"
             add_human_assign += 1
@@ -539,14 +1256,12 @@ class HAIOClient:
                         task_cluster["incorrect_count"] += 1
 
                     # check task clusters
-                    binomtest_result = binomtest(
-                        k=task_cluster["correct_count"],
-                        n=task_cluster["correct_count"]
-                        + task_cluster["incorrect_count"],
-                        p=quality_requirement,
-                        alternative="greater",
-                    )
-                    if binomtest_result.pvalue < significance_level:
+                    if is_cta_approved(
+                        correct_count=task_cluster["correct_count"],
+                        incorrect_count=task_cluster["incorrect_count"],
+                        quality_requirement=quality_requirement,
+                        significance_level=significance_level,
+                    ):
                         for inner_task_index in task_cluster["task_indexes"]:
                             if answer_list[inner_task_index] == None:
                                 answer_list[inner_task_index] = answer_candidate_lists[
@@ -557,6 +1272,9 @@ class HAIOClient:
             "answer_list": answer_list,
             "client_list": client_list,
             "add_human_assign": add_human_assign,
+            "human_parallelism": human_parallelism,
+            "unused_human_assign": len(unused_task_indexes),
+            "elapsed_time": time.time() - start_time,
         }
 
     async def _gta_method(
@@ -565,7 +1283,11 @@ class HAIOClient:
         quality_requirement: float,
         significance_level: float = _default_significance_level,
         iteration: int = _default_gta_iteration,
+        iteration_chunk_size: int | None = None,
+        ai_concurrency: int = _default_ai_concurrency,
+        human_parallelism: int = _default_human_parallelism,
     ) -> MethodReturn:
+        start_time = time.time()
         answer_list: Final[list[Answer | None]] = [None] * len(asked_questions)
         client_list: Final[list[ClientType | None]] = [None] * len(asked_questions)
         add_human_assign: int = 0
@@ -575,13 +1297,10 @@ class HAIOClient:
 
         # make task clusters
         unapproved_task_clusters_dict: dict[Answer, HAIOClient.TaskCluster] = {}
-        for i, asked_question in enumerate(asked_questions):
+        ai_answers = await self._ask_ai_clients(asked_questions, ai_concurrency)
+        for i, ai_answer_dict in enumerate(ai_answers):
             for ai_client_name in self.ai_clients.keys():
-                ai_answer = await self.ask_get_answer(
-                    question_template=asked_question["question_template"],
-                    data_list=asked_question["data_list"],
-                    client=ai_client_name,
-                )
+                ai_answer = ai_answer_dict[ai_client_name]
                 if ai_answer not in unapproved_task_clusters_dict:
                     unapproved_task_clusters_dict[ai_answer] = {
                         "task_indexes": set(),
@@ -593,21 +1312,26 @@ class HAIOClient:
                 unapproved_task_clusters_dict[ai_answer]["task_indexes"].add(i)
         unapproved_task_clusters = list(unapproved_task_clusters_dict.values())
 
+        # 検定に使うサンプルは、この実行の間使い回す
+        gta_sample_cache = GTA_Sample_Cache(
+            iteration,
+            chunk_size=iteration_chunk_size,
+            confidence=self._gta_early_stopping_confidence,
+        )
+
         # randomize the order of the tasks, for random sampling
         indexed_asked_questions = list(enumerate(asked_questions))
         random.shuffle(indexed_asked_questions)
 
         # sampling and approval
-        for i, asked_question in indexed_asked_questions:
-            if answer_list[i] != None:
-                continue
-
-            # get ground truth (from human here)
-            human_answer = await self.ask_get_answer(
-                question_template=asked_question["question_template"],
-                data_list=asked_question["data_list"],
-                client="human",
-            )
+        # get ground truth (from human here), up to human_parallelism at a time
+        unused_task_indexes: list[int] = []
+        async for i, human_answer in self._ask_humans(
+            indexed_asked_questions=indexed_asked_questions,
+            human_parallelism=human_parallelism,
+            is_answered=lambda task_index: answer_list[task_index] != None,
+            unused_task_indexes=unused_task_indexes,
+        ):
             ground_truth_list[i] = human_answer
             answer_list[i] = human_answer
             client_list[i] = "human"
@@ -622,10 +1346,11 @@ class HAIOClient:
             # check task clusters
             for index, unapproved_task_cluster in enumerate(unapproved_task_clusters):
                 # statistical test
-                p_value = self._gta_statistical_test(
-                    task_clusters=approved_task_clusters + [unapproved_task_cluster],
-                    iteration=iteration,
+                p_value = gta_sample_cache.test(
+                    approved_task_clusters=approved_task_clusters,
+                    task_cluster=unapproved_task_cluster,
                     quality_requirement=quality_requirement,
+                    significance_level=significance_level,
                 )
 
                 # task cluster approval
@@ -641,6 +1366,9 @@ class HAIOClient:
             "answer_list": answer_list,
             "client_list": client_list,
             "add_human_assign": add_human_assign,
+            "human_parallelism": human_parallelism,
+            "unused_human_assign": len(unused_task_indexes),
+            "elapsed_time": time.time() - start_time,
         }
 
     async def _sequential_cta_1_method(
@@ -651,7 +1379,7 @@ class HAIOClient:
     ) -> MethodReturn:
         # prepare
         state_id = (
-            haio_hash(asked_questions[0]["question_template"])
+            asked_questions[0]["question_template_hash"]
             + ","
             + str(quality_requirement)
             + ","
@@ -685,9 +1413,8 @@ class HAIOClient:
 
             # get answer from each AI and make task clusters
             for client in self.ai_clients.keys():
-                ai_answer = await self.ask_get_answer(
-                    question_template=asked_question["question_template"],
-                    data_list=asked_question["data_list"],
+                ai_answer = await self._ask_get_answer(
+                    asked_question=asked_question,
                     client=client,
                 )
                 state["answer_candidate_lists"][client][
@@ -718,9 +1445,8 @@ class HAIOClient:
 
             # ask human and approve the task clusters
             if answer_list[task_index] == None:
-                human_answer = await self.ask_get_answer(
-                    question_template=asked_question["question_template"],
-                    data_list=asked_question["data_list"],
+                human_answer = await self._ask_get_answer(
+                    asked_question=asked_question,
                     client="human",
                 )
                 answer_list[task_index] = human_answer
@@ -745,14 +1471,12 @@ class HAIOClient:
                             task_cluster["incorrect_count"] += 1
 
                         # check task clusters
-                        binomtest_result = binomtest(
-                            k=task_cluster["correct_count"],
-                            n=task_cluster["correct_count"]
-                            + task_cluster["incorrect_count"],
-                            p=quality_requirement,
-                            alternative="greater",
-                        )
-                        if binomtest_result.pvalue < significance_level:
+                        if is_cta_approved(
+                            correct_count=task_cluster["correct_count"],
+                            incorrect_count=task_cluster["incorrect_count"],
+                            quality_requirement=quality_requirement,
+                            significance_level=significance_level,
+                        ):
                             task_cluster["approved"] = True
 
         state["task_number"] += len(asked_questions)
@@ -769,10 +1493,11 @@ class HAIOClient:
         quality_requirement: float,
         significance_level: float = _default_significance_level,
         iteration: int = _default_gta_iteration,
+        iteration_chunk_size: int | None = None,
     ) -> MethodReturn:
         # prepare
         state_id = (
-            haio_hash(asked_questions[0]["question_template"])
+            asked_questions[0]["question_template_hash"]
             + ","
             + str(quality_requirement)
             + ","
@@ -797,6 +1522,13 @@ class HAIOClient:
         client_list: Final[list[ClientType | None]] = [None] * len(asked_questions)
         add_human_assign: int = 0
 
+        # 検定に使うサンプルは、この実行の間使い回す
+        gta_sample_cache = GTA_Sample_Cache(
+            iteration,
+            chunk_size=iteration_chunk_size,
+            confidence=self._gta_early_stopping_confidence,
+        )
+
         # randomize the order of the tasks
         indexed_asked_questions = list(enumerate(asked_questions))
         random.shuffle(indexed_asked_questions)
@@ -806,9 +1538,8 @@ class HAIOClient:
 
             # get answer from each AI and make task clusters
             for client in self.ai_clients.keys():
-                ai_answer = await self.ask_get_answer(
-                    question_template=asked_question["question_template"],
-                    data_list=asked_question["data_list"],
+                ai_answer = await self._ask_get_answer(
+                    asked_question=asked_question,
                     client=client,
                 )
                 state["answer_candidate_lists"][client][
@@ -839,9 +1570,8 @@ class HAIOClient:
 
             # ask human and approve the task clusters
             if answer_list[task_index] == None:
-                human_answer = await self.ask_get_answer(
-                    question_template=asked_question["question_template"],
-                    data_list=asked_question["data_list"],
+                human_answer = await self._ask_get_answer(
+                    asked_question=asked_question,
                     client="human",
                 )
                 answer_list[task_index] = human_answer
@@ -867,15 +1597,15 @@ class HAIOClient:
 
                         # check task clusters
                         # statistical test
-                        p_value = self._gta_statistical_test(
-                            task_clusters=[
+                        p_value = gta_sample_cache.test(
+                            approved_task_clusters=[
                                 tc
                                 for tc in state["task_clusters_dict"].values()
                                 if tc["approved"]
-                            ]
-                            + [task_cluster],
-                            iteration=iteration,
+                            ],
+                            task_cluster=task_cluster,
                             quality_requirement=quality_requirement,
+                            significance_level=significance_level,
                         )
 
                         # task cluster approval
@@ -899,7 +1629,7 @@ class HAIOClient:
     ) -> MethodReturn:
         # prepare
         state_id = (
-            haio_hash(asked_questions[0]["question_template"])
+            asked_questions[0]["question_template_hash"]
             + ","
             + str(quality_requirement)
             + ","
@@ -935,9 +1665,8 @@ class HAIOClient:
 
             # get answer from each AI and make task clusters
             for client in self.ai_clients.keys():
-                ai_answer = await self.ask_get_answer(
-                    question_template=asked_question["question_template"],
-                    data_list=asked_question["data_list"],
+                ai_answer = await self._ask_get_answer(
+                    asked_question=asked_question,
                     client=client,
                 )
                 state["answer_candidate_lists"][client][
@@ -969,9 +1698,8 @@ class HAIOClient:
 
             # ask human
             if answer_list[tesk_index] == None:
-                human_answer = await self.ask_get_answer(
-                    question_template=asked_question["question_template"],
-                    data_list=asked_question["data_list"],
+                human_answer = await self._ask_get_answer(
+                    asked_question=asked_question,
                     client="human",
                 )
                 answer_list[tesk_index] = human_answer
@@ -1000,14 +1728,12 @@ class HAIOClient:
                             + task_cluster["incorrect_count"]
                             >= sample_size
                         ):
-                            binomtest_result = binomtest(
-                                k=task_cluster["correct_count"],
-                                n=task_cluster["correct_count"]
-                                + task_cluster["incorrect_count"],
-                                p=quality_requirement,
-                                alternative="greater",
-                            )
-                            if binomtest_result.pvalue < significance_level:
+                            if is_cta_approved(
+                                correct_count=task_cluster["correct_count"],
+                                incorrect_count=task_cluster["incorrect_count"],
+                                quality_requirement=quality_requirement,
+                                significance_level=significance_level,
+                            ):
                                 task_cluster["approved"] = True
                             task_cluster["checked"] = True
 
@@ -1026,10 +1752,11 @@ class HAIOClient:
         sample_size: int,
         significance_level: float = _default_significance_level,
         iteration: int = _default_gta_iteration,
+        iteration_chunk_size: int | None = None,
     ) -> MethodReturn:
         # prepare
         state_id = (
-            haio_hash(asked_questions[0]["question_template"])
+            asked_questions[0]["question_template_hash"]
             + ","
             + str(quality_requirement)
             + ","
@@ -1056,6 +1783,13 @@ class HAIOClient:
         client_list: Final[list[ClientType | None]] = [None] * len(asked_questions)
         add_human_assign: int = 0
 
+        # 検定に使うサンプルは、この実行の間使い回す
+        gta_sample_cache = GTA_Sample_Cache(
+            iteration,
+            chunk_size=iteration_chunk_size,
+            confidence=self._gta_early_stopping_confidence,
+        )
+
         # randomize the order of the tasks
         indexed_asked_questions = list(enumerate(asked_questions))
         random.shuffle(indexed_asked_questions)
@@ -1065,9 +1799,8 @@ class HAIOClient:
 
             # get answer from each AI and make task clusters
             for client in self.ai_clients.keys():
-                ai_answer = await self.ask_get_answer(
-                    question_template=asked_question["question_template"],
-                    data_list=asked_question["data_list"],
+                ai_answer = await self._ask_get_answer(
+                    asked_question=asked_question,
                     client=client,
                 )
                 state["answer_candidate_lists"][client][
@@ -1099,9 +1832,8 @@ class HAIOClient:
 
             # ask human
             if answer_list[tesk_index] == None:
-                human_answer = await self.ask_get_answer(
-                    question_template=asked_question["question_template"],
-                    data_list=asked_question["data_list"],
+                human_answer = await self._ask_get_answer(
+                    asked_question=asked_question,
                     client="human",
                 )
                 answer_list[tesk_index] = human_answer
@@ -1131,15 +1863,15 @@ class HAIOClient:
                             >= sample_size
                         ):
                             # statistical test
-                            p_value = self._gta_statistical_test(
-                                task_clusters=[
+                            p_value = gta_sample_cache.test(
+                                approved_task_clusters=[
                                     tc
                                     for tc in state["task_clusters_dict"].values()
                                     if tc["approved"]
-                                ]
-                                + [task_cluster],
-                                iteration=iteration,
+                                ],
+                                task_cluster=task_cluster,
                                 quality_requirement=quality_requirement,
+                                significance_level=significance_level,
                             )
 
                             if p_value < significance_level:
@@ -1159,10 +1891,11 @@ class HAIOClient:
         asked_questions: list[AskedQuestion],
         quality_requirement: float,
         significance_level: float = _default_significance_level,
+        ai_concurrency: int = _default_ai_concurrency,
     ) -> MethodReturn:
         # prepare state
         state_id: Final = (
-            haio_hash(asked_questions[0]["question_template"])
+            asked_questions[0]["question_template_hash"]
             + ","
             + str(quality_requirement)
             + ","
@@ -1174,8 +1907,7 @@ class HAIOClient:
                 "task_clusters_dict": {},
                 "answer_candidate_lists": {},
                 "task_phases": SortedDict(),
-                "question_template": asked_questions[0]["question_template"],
-                "data_lists": [],
+                "asked_questions": [],
             }
             for client in self.ai_clients.keys():
                 self._sequential_cta_3_method_state[state_id]["answer_candidate_lists"][
@@ -1188,13 +1920,10 @@ class HAIOClient:
 
         # Update state with additional questions
         # make task clusters and record answers
-        for i, asked_question in enumerate(asked_questions):
+        ai_answers = await self._ask_ai_clients(asked_questions, ai_concurrency)
+        for i, ai_answer_dict in enumerate(ai_answers):
             for client in self.ai_clients.keys():
-                ai_answer = await self.ask_get_answer(
-                    question_template=asked_question["question_template"],
-                    data_list=asked_question["data_list"],
-                    client=client,
-                )
+                ai_answer = ai_answer_dict[client]
                 state["answer_candidate_lists"][client].append(ai_answer)
 
                 task_cluster_id = client + ai_answer
@@ -1213,8 +1942,17 @@ class HAIOClient:
         # update task_number
         state["task_number"] += len(asked_questions)
         # update asked_questions
-        state["data_lists"].extend(
-            [asked_question["data_list"] for asked_question in asked_questions]
+        # 人間に聞くまで使わないので、data_listの大きな要素はblobとして退避しておく
+        state["asked_questions"].extend(
+            [
+                {
+                    **asked_question,
+                    "data_list": self.cache_io.store_data_list(
+                        asked_question["data_list"]
+                    ),
+                }
+                for asked_question in asked_questions
+            ]
         )
         # make task phase
         state["task_phases"][
@@ -1253,14 +1991,15 @@ class HAIOClient:
             else:
                 # sample new
                 task_index = candidate_task_index
-                human_answer = await self.ask_get_answer(
-                    question_template=state["question_template"],
-                    data_list=state["data_lists"][task_index],
+                human_answer = await self._ask_get_answer(
+                    asked_question=self._load_asked_question(
+                        state["asked_questions"][task_index]
+                    ),
                     client="human",
                 )
                 add_human_assign += 1
                 state["answer_candidate_lists"]["human"][task_index] = human_answer
-                state["data_lists"][task_index] = None
+                state["asked_questions"][task_index] = None
                 state["task_phases"][task_phase_index].add(task_index)
 
             incomplete_task_indexes.remove(task_index)
@@ -1284,14 +2023,12 @@ class HAIOClient:
                         task_cluster["incorrect_count"] += 1
 
                     # check task clusters
-                    binomtest_result = binomtest(
-                        k=task_cluster["correct_count"],
-                        n=task_cluster["correct_count"]
-                        + task_cluster["incorrect_count"],
-                        p=quality_requirement,
-                        alternative="greater",
-                    )
-                    if binomtest_result.pvalue < significance_level:
+                    if is_cta_approved(
+                        correct_count=task_cluster["correct_count"],
+                        incorrect_count=task_cluster["incorrect_count"],
+                        quality_requirement=quality_requirement,
+                        significance_level=significance_level,
+                    ):
                         task_cluster["approved"] = True
                         for inner_task_index in task_cluster["task_indexes"]:
                             if answer_list[inner_task_index] == None:
@@ -1320,10 +2057,12 @@ class HAIOClient:
         quality_requirement: float,
         significance_level: float = _default_significance_level,
         iteration: int = _default_gta_iteration,
+        iteration_chunk_size: int | None = None,
+        ai_concurrency: int = _default_ai_concurrency,
     ) -> MethodReturn:
         # prepare state
         state_id: Final = (
-            haio_hash(asked_questions[0]["question_template"])
+            asked_questions[0]["question_template_hash"]
             + ","
             + str(quality_requirement)
             + ","
@@ -1335,8 +2074,7 @@ class HAIOClient:
                 "task_clusters_dict": {},
                 "answer_candidate_lists": {},
                 "task_phases": SortedDict(),
-                "question_template": asked_questions[0]["question_template"],
-                "data_lists": [],
+                "asked_questions": [],
             }
             for client in self.ai_clients.keys():
                 self._sequential_gta_3_method_state[state_id]["answer_candidate_lists"][
@@ -1349,13 +2087,10 @@ class HAIOClient:
 
         # Update state with additional questions
         # make task clusters and record answers
-        for i, asked_question in enumerate(asked_questions):
+        ai_answers = await self._ask_ai_clients(asked_questions, ai_concurrency)
+        for i, ai_answer_dict in enumerate(ai_answers):
             for client in self.ai_clients.keys():
-                ai_answer = await self.ask_get_answer(
-                    question_template=asked_question["question_template"],
-                    data_list=asked_question["data_list"],
-                    client=client,
-                )
+                ai_answer = ai_answer_dict[client]
                 state["answer_candidate_lists"][client].append(ai_answer)
 
                 task_cluster_id = client + ai_answer
@@ -1374,8 +2109,17 @@ class HAIOClient:
         # update task_number
         state["task_number"] += len(asked_questions)
         # update asked_questions
-        state["data_lists"].extend(
-            [asked_question["data_list"] for asked_question in asked_questions]
+        # 人間に聞くまで使わないので、data_listの大きな要素はblobとして退避しておく
+        state["asked_questions"].extend(
+            [
+                {
+                    **asked_question,
+                    "data_list": self.cache_io.store_data_list(
+                        asked_question["data_list"]
+                    ),
+                }
+                for asked_question in asked_questions
+            ]
         )
         # make task phase
         state["task_phases"][
@@ -1394,6 +2138,13 @@ class HAIOClient:
         task_phases: Final = copy.deepcopy(state["task_phases"])
         incomplete_task_indexes: Final[list[int]] = list(range(state["task_number"]))
 
+        # 検定に使うサンプルは、この実行の間使い回す
+        gta_sample_cache = GTA_Sample_Cache(
+            iteration,
+            chunk_size=iteration_chunk_size,
+            confidence=self._gta_early_stopping_confidence,
+        )
+
         # start cta
         while incomplete_task_indexes:
             candidate_task_index = random.choice(incomplete_task_indexes)
@@ -1414,14 +2165,15 @@ class HAIOClient:
             else:
                 # sample new
                 task_index = candidate_task_index
-                human_answer = await self.ask_get_answer(
-                    question_template=state["question_template"],
-                    data_list=state["data_lists"][task_index],
+                human_answer = await self._ask_get_answer(
+                    asked_question=self._load_asked_question(
+                        state["asked_questions"][task_index]
+                    ),
                     client="human",
                 )
                 add_human_assign += 1
                 state["answer_candidate_lists"]["human"][task_index] = human_answer
-                state["data_lists"][task_index] = None
+                state["asked_questions"][task_index] = None
                 state["task_phases"][task_phase_index].add(task_index)
 
             incomplete_task_indexes.remove(task_index)
@@ -1446,13 +2198,13 @@ class HAIOClient:
 
                     # check task clusters
                     # statistical test
-                    p_value = self._gta_statistical_test(
-                        task_clusters=[
+                    p_value = gta_sample_cache.test(
+                        approved_task_clusters=[
                             tc for tc in task_clusters_dict.values() if tc["approved"]
-                        ]
-                        + [task_cluster],
-                        iteration=iteration,
+                        ],
+                        task_cluster=task_cluster,
                         quality_requirement=quality_requirement,
+                        significance_level=significance_level,
                     )
 
                     # task cluster approval
@@ -1486,12 +2238,29 @@ class HAIOClient:
         asked_questions: AskedQuestion | list[AskedQuestion],
         execution_config: dict,
     ) -> Answer | MethodReturn:
+        try:
+            return await self._wait(asked_questions, execution_config)
+        finally:
+            self.flush()
+
+    async def _wait(
+        self,
+        asked_questions: AskedQuestion | list[AskedQuestion],
+        execution_config: dict,
+    ) -> Answer | MethodReturn:
+        # ハッシュを持たないAskedQuestionはここで補完する
+        if isinstance(asked_questions, dict):
+            asked_questions = self._complete_asked_question(asked_questions)
+        elif isinstance(asked_questions, list):
+            asked_questions = [
+                self._complete_asked_question(asked_question)
+                for asked_question in asked_questions
+            ]
+
         if isinstance(asked_questions, dict):
             # 単一問題に対して回答を取得
-            return await self.ask_get_answer(
-                question_template=asked_questions["question_template"],
-                data_list=asked_questions["data_list"],
-                client=execution_config["client"],
+            return await self._ask_get_answer(
+                asked_question=asked_questions, client=execution_config["client"]
             )
 
         elif isinstance(asked_questions, list):
@@ -1531,6 +2300,16 @@ class HAIOClient:
                 )
                 if not 0 <= significance_level <= 1:
                     raise Exception("Invalid significance level.")
+                ai_concurrency = execution_config.get(
+                    "ai_concurrency", self._default_ai_concurrency
+                )
+                if not 0 < ai_concurrency:
+                    raise Exception("Invalid ai concurrency.")
+                human_parallelism = execution_config.get(
+                    "human_parallelism", self._default_human_parallelism
+                )
+                if not 0 < human_parallelism:
+                    raise Exception("Invalid human parallelism.")
                 question_template = asked_questions[0]["question_template"]
                 if question_template["answer"]["type"] != "select":
                     raise Exception("The answer type must be select.")
@@ -1539,6 +2318,8 @@ class HAIOClient:
                     asked_questions=asked_questions,
                     quality_requirement=quality_requirement,
                     significance_level=significance_level,
+                    ai_concurrency=ai_concurrency,
+                    human_parallelism=human_parallelism,
                 )
 
             elif execution_config["method"] == "sequential_cta_1":
@@ -1616,6 +2397,11 @@ class HAIOClient:
                 )
                 if not 0 <= significance_level <= 1:
                     raise Exception("Invalid significance level.")
+                ai_concurrency = execution_config.get(
+                    "ai_concurrency", self._default_ai_concurrency
+                )
+                if not 0 < ai_concurrency:
+                    raise Exception("Invalid ai concurrency.")
                 question_template = asked_questions[0]["question_template"]
                 if question_template["answer"]["type"] != "select":
                     raise Exception("The answer type must be select.")
@@ -1624,6 +2410,7 @@ class HAIOClient:
                     asked_questions=asked_questions,
                     quality_requirement=quality_requirement,
                     significance_level=significance_level,
+                    ai_concurrency=ai_concurrency,
                 )
 
             elif execution_config["method"] == "gta":
@@ -1648,6 +2435,21 @@ class HAIOClient:
                 )
                 if not 0 < iteration:
                     raise Exception("Invalid iteration.")
+                iteration_chunk_size = execution_config.get(
+                    "iteration_chunk_size", None
+                )
+                if iteration_chunk_size is not None and not 0 < iteration_chunk_size:
+                    raise Exception("Invalid iteration chunk size.")
+                ai_concurrency = execution_config.get(
+                    "ai_concurrency", self._default_ai_concurrency
+                )
+                if not 0 < ai_concurrency:
+                    raise Exception("Invalid ai concurrency.")
+                human_parallelism = execution_config.get(
+                    "human_parallelism", self._default_human_parallelism
+                )
+                if not 0 < human_parallelism:
+                    raise Exception("Invalid human parallelism.")
 
                 question_template = asked_questions[0]["question_template"]
                 if question_template["answer"]["type"] != "select":
@@ -1658,6 +2460,9 @@ class HAIOClient:
                     quality_requirement=quality_requirement,
                     significance_level=significance_level,
                     iteration=iteration,
+                    ai_concurrency=ai_concurrency,
+                    human_parallelism=human_parallelism,
+                    iteration_chunk_size=iteration_chunk_size,
                 )
 
             elif execution_config["method"] == "sequential_gta_1":
@@ -1682,6 +2487,11 @@ class HAIOClient:
                 )
                 if not 0 < iteration:
                     raise Exception("Invalid iteration.")
+                iteration_chunk_size = execution_config.get(
+                    "iteration_chunk_size", None
+                )
+                if iteration_chunk_size is not None and not 0 < iteration_chunk_size:
+                    raise Exception("Invalid iteration chunk size.")
 
                 question_template = asked_questions[0]["question_template"]
                 if question_template["answer"]["type"] != "select":
@@ -1692,6 +2502,7 @@ class HAIOClient:
                     quality_requirement=quality_requirement,
                     significance_level=significance_level,
                     iteration=iteration,
+                    iteration_chunk_size=iteration_chunk_size,
                 )
 
             elif execution_config["method"] == "sequential_gta_2":
@@ -1719,6 +2530,11 @@ class HAIOClient:
                 )
                 if not 0 < iteration:
                     raise Exception("Invalid iteration.")
+                iteration_chunk_size = execution_config.get(
+                    "iteration_chunk_size", None
+                )
+                if iteration_chunk_size is not None and not 0 < iteration_chunk_size:
+                    raise Exception("Invalid iteration chunk size.")
 
                 question_template = asked_questions[0]["question_template"]
                 if question_template["answer"]["type"] != "select":
@@ -1730,6 +2546,7 @@ class HAIOClient:
                     significance_level=significance_level,
                     sample_size=sample_size,
                     iteration=iteration,
+                    iteration_chunk_size=iteration_chunk_size,
                 )
 
             elif execution_config["method"] == "sequential_gta_3":
@@ -1754,6 +2571,16 @@ class HAIOClient:
                 )
                 if not 0 < iteration:
                     raise Exception("Invalid iteration.")
+                iteration_chunk_size = execution_config.get(
+                    "iteration_chunk_size", None
+                )
+                if iteration_chunk_size is not None and not 0 < iteration_chunk_size:
+                    raise Exception("Invalid iteration chunk size.")
+                ai_concurrency = execution_config.get(
+                    "ai_concurrency", self._default_ai_concurrency
+                )
+                if not 0 < ai_concurrency:
+                    raise Exception("Invalid ai concurrency.")
 
                 question_template = asked_questions[0]["question_template"]
                 if question_template["answer"]["type"] != "select":
@@ -1764,6 +2591,8 @@ class HAIOClient:
                     quality_requirement=quality_requirement,
                     significance_level=significance_level,
                     iteration=iteration,
+                    ai_concurrency=ai_concurrency,
+                    iteration_chunk_size=iteration_chunk_size,
                 )
             else:
                 raise Exception("Invalid method.")
@@ -27,3 +27,26 @@ class QuestionTemplate(TypedDict):
 DataList = list[str]
 
 Answer = str
+
+
+client_types = ["human", "openai", "gemini", "llama", "claude", "nova"]
+ClientType = Literal["human", "openai", "gemini", "llama", "claude", "nova"]
+
+
+class AnswerCacheRequired(TypedDict):
+    client: ClientType
+    answer: Answer
+
+
+class AnswerCache(AnswerCacheRequired, total=False):
+    created_at: float  # time.time()、古いキャッシュには無い
+
+
+class DataListCache(TypedDict):
+    data_list: DataList
+    answer_list: dict[str, AnswerCache]
+
+
+class HAIOCache(TypedDict):
+    question_template: QuestionTemplate
+    data_lists: dict[str, DataListCache]
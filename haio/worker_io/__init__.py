@@ -1,6 +1,9 @@
 from .bedrock_io import *
 from .common import *
 from .gemini_io import *
+from .image_fetcher import *
 from .mturk_io import *
 from .openai_io import *
+from .prompt_skeleton import *
+from .rate_limiter import *
 from .types import *
@@ -1,15 +1,28 @@
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from icecream import ic
 from time import sleep
-from typing import cast
+from typing import Any, cast
+import asyncio
 import boto3
-import httpx
+import functools
 import os
+import random
 import textwrap
 
 from haio.common import haio_hash, data_url_to_img
-from haio.types import QuestionConfig, MutableAnswer, Answer
+from haio.types import (
+    QuestionConfig,
+    QuestionTemplate,
+    DataList,
+    MutableAnswer,
+    Answer,
+)
 from haio.worker_io.common import resize_image, force_choice
+from haio.worker_io.image_fetcher import Image_Fetcher, get_image_fetcher
+from haio.worker_io.prompt_skeleton import Prompt_Skeleton
+from haio.worker_io.rate_limiter import Rate_Limiter, estimate_prompt_tokens
 from haio.worker_io.types import Worker_IO
 
 
@@ -22,27 +35,69 @@ class Bedrock_IO(Worker_IO):
         "us.amazon.nova-lite-v1:0": {"can_force_tool_use": False},
     }
 
-    def __init__(self, model_id: str) -> None:
+    def __init__(
+        self,
+        model_id: str,
+        max_workers: int = 16,
+        max_retries: int = 10,
+        max_backoff: float = 100.0,
+        rate_limiter: Rate_Limiter | None = None,
+        image_fetcher: Image_Fetcher | None = None,
+    ) -> None:
         if model_id not in self.model_list:
             raise Exception("Invalid or Unsupported model_id.")
+        if max_workers < 1:
+            raise ValueError("max_workers must be positive.")
+        if max_retries < 1:
+            raise ValueError("max_retries must be positive.")
         load_dotenv()
+        # boto3は同期APIなので、ask_get_answerではスレッドプールで実行する
+        # コネクションプールはスレッド数に合わせる
         self.client = boto3.client(
             service_name="bedrock-runtime",
             aws_access_key_id=os.getenv("AWS_ACCESS_KEY"),
             aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
             region_name="us-east-1",
+            config=Config(max_pool_connections=max_workers),
         )
+        self.max_workers = max_workers
+        self.executor = self._create_executor()
         self.model_id = model_id
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        # 指定されていれば、ask_get_answerはRPM/TPMの枠が空くまで待ってから聞く
+        # llama, claude, novaで同じアカウントの枠を使う場合は、同じRate_Limiterを渡す
+        self.rate_limiter = rate_limiter
+        # 画像URLの取得は、既定では全Worker_IOで共有するImage_Fetcherを使う
+        self.image_fetcher = (
+            image_fetcher if image_fetcher is not None else get_image_fetcher()
+        )
         self.asked: dict[str, Answer] = {}
+        # question_template_hash -> (プロンプトの骨組み, システムメッセージ, ツールの設定)
+        self.compiled_templates: dict[
+            str, tuple[Prompt_Skeleton, str, dict[str, dict | list]]
+        ] = {}
 
-    def ask(self, question_config: QuestionConfig) -> str:
-        question_config_hash = haio_hash(question_config)
+    def _create_executor(self) -> ThreadPoolExecutor:
+        return ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="bedrock_io"
+        )
 
-        # 回答を取得せずに同じ質問を複数回聞くことはできない
-        # 既に質問済みならエラーを返す
-        if question_config_hash in self.asked:
-            raise Exception("already asking")
+    async def aclose(self) -> None:
+        # 実行中の呼び出しを待ってスレッドを終了する
+        # 閉じた後にも使えるよう、新しいスレッドプールに置き換えておく (スレッドは使うまで作られない)
+        executor = self.executor
+        self.executor = self._create_executor()
+        await asyncio.to_thread(executor.shutdown)
+
+    # 指数バックオフ (full jitter)
+    def _get_backoff_time(self, retry_count: int) -> float:
+        return random.uniform(0, min(self.max_backoff, 2**retry_count))
 
+    # question_templateごとに変わらない部分(プロンプトの骨組み、システムメッセージ、ツールの設定)を組み立てる
+    def _compile(
+        self, question_template: QuestionTemplate | QuestionConfig
+    ) -> tuple[Prompt_Skeleton, str, dict[str, dict | list]]:
         tool_name = "AnswerDisplay"
 
         # システムメッセージの初期化
@@ -66,19 +121,19 @@ class Bedrock_IO(Worker_IO):
         }
 
         # 回答形式に応じてシステムメッセージとクエリを構築
-        if question_config["answer"]["type"] == "number":
+        if question_template["answer"]["type"] == "number":
             system_message += "number"
             output_json_schema["properties"]["answer"] = {"type": "number"}
-        elif question_config["answer"]["type"] == "text":
+        elif question_template["answer"]["type"] == "text":
             system_message += "string"
             output_json_schema["properties"]["answer"] = {"type": "string"}
-        elif question_config["answer"]["type"] == "select":
+        elif question_template["answer"]["type"] == "select":
             system_message += "select from {}".format(
-                question_config["answer"]["options"]
+                question_template["answer"]["options"]
             )
             output_json_schema["properties"]["answer"] = {
                 "type": "string",
-                "enum": question_config["answer"]["options"],
+                "enum": question_template["answer"]["options"],
             }
         else:
             raise Exception("Invalid answer type.")
@@ -101,39 +156,29 @@ class Bedrock_IO(Worker_IO):
                 },
             }
 
-        # questionのテンプレートを構成
-        user_content: list
-        user_message = ""
-        img_urls: list[str] = []
-        for question in question_config["question"]:
-            match question["tag"]:
-                case "h1":
-                    user_message += f"# {question['value']}\n"
-                case "h2":
-                    user_message += f"## {question['value']}\n"
-                case "h3":
-                    user_message += f"### {question['value']}\n"
-                case "h4":
-                    user_message += f"#### {question['value']}\n"
-                case "h5":
-                    user_message += f"##### {question['value']}\n"
-                case "h6":
-                    user_message += f"###### {question['value']}\n"
-                case "p":
-                    user_message += f"{question['value']}\n"
-                case "img":
-                    img_urls.append(question["src"])
-                case _:
-                    raise Exception("Invalid tag.")
-
-        user_content = []
+        return Prompt_Skeleton(question_template), system_message, tool_config
+
+    def _get_compiled(
+        self,
+        question_template: QuestionTemplate,
+        question_template_hash: str | None = None,
+    ) -> tuple[Prompt_Skeleton, str, dict[str, dict | list]]:
+        if question_template_hash is None:
+            question_template_hash = haio_hash(question_template)
+        compiled = self.compiled_templates.get(question_template_hash, None)
+        if compiled is None:
+            compiled = self._compile(question_template)
+            self.compiled_templates[question_template_hash] = compiled
+        return compiled
+
+    # 画像の読み込みと縮小を行うので、ask_get_answerではスレッドプールで実行する
+    def _build_user_content(self, user_message: str, img_urls: list[str]) -> list:
+        user_content: list = []
         for img_url in img_urls:
             if img_url.startswith("data:"):
                 mime_type, img_data = data_url_to_img(img_url)
             else:
-                image = httpx.get(img_url)
-                mime_type = image.headers.get("Content-Type")
-                img_data = image.content
+                mime_type, img_data = self.image_fetcher.fetch_sync(img_url)
             img_data = resize_image(
                 img_data,
                 mime_type,
@@ -163,33 +208,43 @@ class Bedrock_IO(Worker_IO):
             )
         user_content.append({"text": user_message})
 
-        # タスクの構成と発行
-        for i in range(10):
-            try:
-                response = self.client.converse(
-                    modelId=self.model_id,
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": user_content,
-                        },
-                    ],
-                    system=[
-                        {
-                            "text": system_message,
-                        }
-                    ],
-                    toolConfig=tool_config,
-                )
-                break
-            except Exception as e:
-                if i == 9:
-                    raise
-                sleep_time = min(100, 2**i)
-                sleep(sleep_time)
+        return user_content
 
-        print("Bedrock Question Config Hash:", question_config_hash)
+    def _assemble_request(
+        self,
+        system_message: str,
+        tool_config: dict[str, dict | list],
+        user_content: list,
+    ) -> dict[str, Any]:
+        # タスクの構成
+        return {
+            "modelId": self.model_id,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": user_content,
+                },
+            ],
+            "system": [
+                {
+                    "text": system_message,
+                }
+            ],
+            "toolConfig": tool_config,
+        }
+
+    def _build_request(self, question_config: QuestionConfig) -> dict[str, Any]:
+        prompt_skeleton, system_message, tool_config = self._compile(question_config)
+        user_message, img_urls = prompt_skeleton.render([])
+        return self._assemble_request(
+            system_message,
+            tool_config,
+            self._build_user_content(user_message, img_urls),
+        )
 
+    def _parse_response(
+        self, question_config: QuestionConfig | QuestionTemplate, response: Any
+    ) -> Answer:
         response_content = response["output"]["message"]["content"]
         tool_use_response = next(
             (item for item in response_content if "toolUse" in item), None
@@ -207,14 +262,38 @@ class Bedrock_IO(Worker_IO):
             raise Exception("The model returned empty response.")
 
         if cast(MutableAnswer, question_config["answer"])["type"] == "select":
-            formatted_answer = force_choice(
+            return force_choice(
                 answer, cast(MutableAnswer, question_config["answer"])["options"]
             )
-            self.asked[question_config_hash] = formatted_answer
         elif cast(MutableAnswer, question_config["answer"])["type"] == "number":
-            self.asked[question_config_hash] = str(float(answer))
+            return str(float(answer))
         else:
-            self.asked[question_config_hash] = answer
+            return answer
+
+    def ask(self, question_config: QuestionConfig) -> str:
+        question_config_hash = haio_hash(question_config)
+
+        # 回答を取得せずに同じ質問を複数回聞くことはできない
+        # 既に質問済みならエラーを返す
+        if question_config_hash in self.asked:
+            raise Exception("already asking")
+
+        # タスクの発行
+        request = self._build_request(question_config)
+        for i in range(self.max_retries):
+            try:
+                response = self.client.converse(**request)
+                break
+            except Exception as e:
+                if i == self.max_retries - 1:
+                    raise
+                sleep(self._get_backoff_time(i))
+
+        print("Bedrock Question Config Hash:", question_config_hash)
+
+        self.asked[question_config_hash] = self._parse_response(
+            question_config, response
+        )
 
         return question_config_hash
 
@@ -233,6 +312,71 @@ class Bedrock_IO(Worker_IO):
         self.asked.pop(id)
         return tmp
 
+    # 画像の取得とconverseはスレッドプールで実行し、リトライの待機もasyncio.sleepで行う
+    # イベントループも他の質問も止めずに待てる
+    # askと異なり、同じ質問を同時に複数回聞いてもよい
     async def ask_get_answer(self, question_config: QuestionConfig) -> Answer:
-        id = self.ask(question_config=question_config)
-        return self.get_answer(id)
+        return await self._ask_get_answer_compiled(
+            self._compile(question_config), [], question_config
+        )
+
+    # question_templateごとの骨組みを使い回し、質問ごとにはdata_listを埋めるだけにする
+    async def ask_get_answer_from_template(
+        self,
+        question_template: QuestionTemplate,
+        data_list: DataList,
+        question_template_hash: str | None = None,
+    ) -> Answer:
+        if question_template_hash is None:
+            question_template_hash = haio_hash(question_template)
+        return await self._ask_get_answer_compiled(
+            self._get_compiled(question_template, question_template_hash),
+            data_list,
+            question_template,
+        )
+
+    async def _ask_get_answer_compiled(
+        self,
+        compiled: tuple[Prompt_Skeleton, str, dict[str, dict | list]],
+        data_list: DataList,
+        question_template: QuestionTemplate | QuestionConfig,
+    ) -> Answer:
+        prompt_skeleton, system_message, tool_config = compiled
+        user_message, img_urls = prompt_skeleton.render(data_list)
+        # 画像URLは先に非同期で取得してキャッシュに載せ、スレッドプールでは読み出すだけにする
+        await asyncio.gather(
+            *[
+                self.image_fetcher.fetch(img_url)
+                for img_url in img_urls
+                if not img_url.startswith("data:")
+            ]
+        )
+        loop = asyncio.get_running_loop()
+        user_content = await loop.run_in_executor(
+            self.executor, self._build_user_content, user_message, img_urls
+        )
+        request = self._assemble_request(system_message, tool_config, user_content)
+        estimated_tokens = estimate_prompt_tokens(
+            len(system_message) + len(user_message), len(img_urls)
+        )
+        for i in range(self.max_retries):
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire(estimated_tokens)
+            try:
+                response = await loop.run_in_executor(
+                    self.executor, functools.partial(self.client.converse, **request)
+                )
+                break
+            except Exception as e:
+                # 失敗したリクエストはトークンを消費していないものとして返す
+                if self.rate_limiter is not None:
+                    self.rate_limiter.adjust(-estimated_tokens)
+                if i == self.max_retries - 1:
+                    raise
+                await asyncio.sleep(self._get_backoff_time(i))
+        if self.rate_limiter is not None and "usage" in response:
+            self.rate_limiter.adjust(
+                response["usage"]["totalTokens"] - estimated_tokens
+            )
+
+        return self._parse_response(question_template, response)
@@ -1,31 +1,84 @@
 from icecream import ic
 from dotenv import load_dotenv
+from typing import Any
+import asyncio
 import os
 import textwrap
-import httpx
+import time
 import base64
 import google.generativeai as genai
 
 from haio.common import haio_hash
-from haio.types import QuestionConfig, Answer
+from haio.types import QuestionConfig, QuestionTemplate, DataList, Answer
+from haio.worker_io.image_fetcher import Image_Fetcher, get_image_fetcher
+from haio.worker_io.prompt_skeleton import Prompt_Skeleton
+from haio.worker_io.rate_limiter import Rate_Limiter, estimate_prompt_tokens
 from haio.worker_io.types import Worker_IO
 
 
 class Gemini_IO(Worker_IO):
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        model: str = "gemini-1.5-flash-latest",
+        max_concurrency: int = 16,
+        requests_per_minute: float | None = None,
+        rate_limiter: Rate_Limiter | None = None,
+        image_fetcher: Image_Fetcher | None = None,
+    ) -> None:
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be positive.")
+        if requests_per_minute is not None and rate_limiter is not None:
+            raise ValueError(
+                "requests_per_minute and rate_limiter cannot be specified together."
+            )
         load_dotenv()
         genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-        self.gemini_client = genai.GenerativeModel("gemini-1.5-flash-latest")
+        self.model = model
+        self.max_concurrency = max_concurrency
+        # 指定されていれば、ask_get_answerはRPM/TPMの枠が空くまで待ってから聞く
+        # requests_per_minuteだけを指定した場合は、このインスタンス専用の枠を作る
+        self.rate_limiter = (
+            Rate_Limiter(requests_per_minute=requests_per_minute)
+            if requests_per_minute is not None
+            else rate_limiter
+        )
+        # 画像URLの取得は、既定では全Worker_IOで共有するImage_Fetcherを使う
+        self.image_fetcher = (
+            image_fetcher if image_fetcher is not None else get_image_fetcher()
+        )
+        self.gemini_client = genai.GenerativeModel(model)
+        # ask_get_answer用の生成クライアントと同時実行数の制限
+        # どちらもイベントループに紐づくので、ループが変わったら作り直す
+        self.async_loop: asyncio.AbstractEventLoop | None = None
+        self.async_gemini_client: genai.GenerativeModel | None = None
+        self.semaphore: asyncio.Semaphore | None = None
         self.asked: dict[str, Answer] = {}
+        # question_template_hash -> (プロンプトの骨組み, システムメッセージ, 回答形式)
+        self.compiled_templates: dict[
+            str, tuple[Prompt_Skeleton, str, genai.GenerationConfig]
+        ] = {}
 
-    def ask(self, question_config: QuestionConfig) -> str:
-        question_config_hash = haio_hash(question_config)
+    def _get_async_state(self) -> tuple[genai.GenerativeModel, asyncio.Semaphore]:
+        loop = asyncio.get_running_loop()
+        if (
+            self.async_loop is not loop
+            or self.async_gemini_client is None
+            or self.semaphore is None
+        ):
+            self.async_loop = loop
+            self.async_gemini_client = genai.GenerativeModel(self.model)
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self.async_gemini_client, self.semaphore
 
-        # GEMINI_IOでは、回答を取得せずに同じ質問を複数回聞くことはできない
-        # 既に質問済みならエラーを返す
-        if question_config_hash in self.asked:
-            raise Exception("already asking")
+    async def aclose(self) -> None:
+        self.async_loop = None
+        self.async_gemini_client = None
+        self.semaphore = None
 
+    # question_templateごとに変わらない部分(プロンプトの骨組み、システムメッセージ、回答形式)を組み立てる
+    def _compile(
+        self, question_template: QuestionTemplate | QuestionConfig
+    ) -> tuple[Prompt_Skeleton, str, genai.GenerationConfig]:
         # システムメッセージの初期化
         system_message: str = textwrap.dedent(
             """\
@@ -40,91 +93,113 @@ class Gemini_IO(Worker_IO):
         generation_config: genai.GenerationConfig
 
         # 回答形式に応じてシステムメッセージとクエリを構築
-        if question_config["answer"]["type"] == "number":
+        if question_template["answer"]["type"] == "number":
             system_message += "number"
             generation_config = genai.GenerationConfig(
                 response_mime_type="application/json", response_schema=float
             )
-        elif question_config["answer"]["type"] == "text":
+        elif question_template["answer"]["type"] == "text":
             system_message += "string"
             generation_config = genai.GenerationConfig(
                 response_mime_type="application/json",
                 response_schema=str,
             )
-        elif question_config["answer"]["type"] == "select":
+        elif question_template["answer"]["type"] == "select":
             system_message += "select from {}".format(
-                question_config["answer"]["options"]
+                question_template["answer"]["options"]
             )
             generation_config = genai.GenerationConfig(
                 response_mime_type="text/x.enum",
                 response_schema={
                     "type": "STRING",
-                    "enum": question_config["answer"]["options"],
+                    "enum": question_template["answer"]["options"],
                 },
             )
         else:
             raise Exception("Invalid answer type.")
 
-        # questionのテンプレートを構成
-        user_content: str | list
-        user_message = ""
-        img_urls: list[str] = []
-        for question in question_config["question"]:
-            match question["tag"]:
-                case "h1":
-                    user_message += f"# {question['value']}\n"
-                case "h2":
-                    user_message += f"## {question['value']}\n"
-                case "h3":
-                    user_message += f"### {question['value']}\n"
-                case "h4":
-                    user_message += f"#### {question['value']}\n"
-                case "h5":
-                    user_message += f"##### {question['value']}\n"
-                case "h6":
-                    user_message += f"###### {question['value']}\n"
-                case "p":
-                    user_message += f"{question['value']}\n"
-                case "img":
-                    img_urls.append(question["src"])
-                case _:
-                    raise Exception("Invalid tag.")
-
-        if img_urls:
-            user_content = [system_message]
-            for img_url in img_urls:
-                if img_url.startswith("data:"):
-                    metadata, img_data_base64 = img_url[5:].split(",", 1)
-                    mime_type = metadata.split(";", 1)[0]
-                else:
-                    image_response = httpx.get(img_url)
-                    mime_type = image_response.headers.get("Content-Type")
-                    img_data_base64 = base64.b64encode(image_response.content).decode(
-                        "utf-8"
-                    )
-
-                user_content.append(
-                    {
-                        "mime_type": mime_type,
-                        "data": img_data_base64,
-                    }
-                )
-            user_content.append(user_message)
+        return Prompt_Skeleton(question_template), system_message, generation_config
+
+    def _get_compiled(
+        self,
+        question_template: QuestionTemplate,
+        question_template_hash: str | None = None,
+    ) -> tuple[Prompt_Skeleton, str, genai.GenerationConfig]:
+        if question_template_hash is None:
+            question_template_hash = haio_hash(question_template)
+        compiled = self.compiled_templates.get(question_template_hash, None)
+        if compiled is None:
+            compiled = self._compile(question_template)
+            self.compiled_templates[question_template_hash] = compiled
+        return compiled
+
+    # 骨組みにdata_listを埋めて (システムメッセージ, user_message, 画像URL, 回答形式) を返す
+    def _render_request(
+        self,
+        compiled: tuple[Prompt_Skeleton, str, genai.GenerationConfig],
+        data_list: DataList,
+    ) -> tuple[str, str, list[str], genai.GenerationConfig]:
+        prompt_skeleton, system_message, generation_config = compiled
+        user_message, img_urls = prompt_skeleton.render(data_list)
+        return system_message, user_message, img_urls, generation_config
+
+    def _build_request(
+        self, question_config: QuestionConfig
+    ) -> tuple[str, str, list[str], genai.GenerationConfig]:
+        return self._render_request(self._compile(question_config), [])
+
+    def _build_contents(
+        self,
+        system_message: str,
+        user_message: str,
+        imgs: list[tuple[str, str]],
+    ) -> str | list:
+        if not imgs:
+            return system_message + "\n" + user_message
+        user_content: list[Any] = [system_message]
+        for mime_type, img_data_base64 in imgs:
+            user_content.append(
+                {
+                    "mime_type": mime_type,
+                    "data": img_data_base64,
+                }
+            )
+        user_content.append(user_message)
+        return user_content
+
+    def _parse_response(self, response: Any) -> Answer:
+        if response.text:
+            return response.text
         else:
-            user_content = system_message + "\n" + user_message
+            raise Exception("The model returned empty response.")
+
+    def ask(self, question_config: QuestionConfig) -> str:
+        question_config_hash = haio_hash(question_config)
+
+        # GEMINI_IOでは、回答を取得せずに同じ質問を複数回聞くことはできない
+        # 既に質問済みならエラーを返す
+        if question_config_hash in self.asked:
+            raise Exception("already asking")
+
+        system_message, user_message, img_urls, generation_config = self._build_request(
+            question_config
+        )
+        imgs: list[tuple[str, str]] = []
+        for img_url in img_urls:
+            if img_url.startswith("data:"):
+                imgs.append(_split_data_url(img_url))
+            else:
+                mime_type, img_data = self.image_fetcher.fetch_sync(img_url)
+                imgs.append((mime_type, base64.b64encode(img_data).decode("utf-8")))
 
         # タスクの構成と発行
         response = self.gemini_client.generate_content(
-            contents=user_content,
+            contents=self._build_contents(system_message, user_message, imgs),
             generation_config=generation_config,
         )
         print("Gemini Question Config Hash:", question_config_hash)
 
-        if response.text:
-            answer_objstr = response.text
-            self.asked[question_config_hash] = answer_objstr
-        else:
-            raise Exception("The model returned empty response.")
+        self.asked[question_config_hash] = self._parse_response(response)
 
         return question_config_hash
 
@@ -143,6 +218,64 @@ class Gemini_IO(Worker_IO):
         self.asked.pop(id)
         return tmp
 
+    async def _fetch_img(self, img_url: str) -> tuple[str, str]:
+        if img_url.startswith("data:"):
+            return _split_data_url(img_url)
+        mime_type, img_data = await self.image_fetcher.fetch(img_url)
+        return mime_type, base64.b64encode(img_data).decode("utf-8")
+
+    # 画像の取得も生成も非同期で行うので、イベントループを止めずに複数の質問を同時に待てる
+    # askと異なり、同じ質問を同時に複数回聞いてもよい
     async def ask_get_answer(self, question_config: QuestionConfig) -> Answer:
-        id = self.ask(question_config=question_config)
-        return self.get_answer(id)
+        return await self._ask_get_answer_request(*self._build_request(question_config))
+
+    # question_templateごとの骨組みを使い回し、質問ごとにはdata_listを埋めるだけにする
+    async def ask_get_answer_from_template(
+        self,
+        question_template: QuestionTemplate,
+        data_list: DataList,
+        question_template_hash: str | None = None,
+    ) -> Answer:
+        if question_template_hash is None:
+            question_template_hash = haio_hash(question_template)
+        return await self._ask_get_answer_request(
+            *self._render_request(
+                self._get_compiled(question_template, question_template_hash),
+                data_list,
+            )
+        )
+
+    async def _ask_get_answer_request(
+        self,
+        system_message: str,
+        user_message: str,
+        img_urls: list[str],
+        generation_config: genai.GenerationConfig,
+    ) -> Answer:
+        async_gemini_client, semaphore = self._get_async_state()
+        estimated_tokens = estimate_prompt_tokens(
+            len(system_message) + len(user_message), len(img_urls)
+        )
+        async with semaphore:
+            imgs = list(
+                await asyncio.gather(
+                    *[self._fetch_img(img_url) for img_url in img_urls]
+                )
+            )
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire(estimated_tokens)
+            response = await async_gemini_client.generate_content_async(
+                contents=self._build_contents(system_message, user_message, imgs),
+                generation_config=generation_config,
+            )
+        if self.rate_limiter is not None and response.usage_metadata:
+            self.rate_limiter.adjust(
+                response.usage_metadata.total_token_count - estimated_tokens
+            )
+        return self._parse_response(response)
+
+
+def _split_data_url(img_url: str) -> tuple[str, str]:
+    metadata, img_data_base64 = img_url[5:].split(",", 1)
+    mime_type = metadata.split(";", 1)[0]
+    return mime_type, img_data_base64
@@ -0,0 +1,199 @@
+from collections import OrderedDict
+from typing import TypedDict
+import asyncio
+import threading
+import time
+import httpx
+
+
+class ImageCache(TypedDict):
+    mime_type: str
+    content: bytes
+    etag: str | None
+    last_modified: str | None
+    fetched_at: float
+
+
+# 画像URLの取得を全Worker_IOで共有する
+# コネクションプールを使い回し、取得した画像はURLごとにLRUでメモリに保持する
+# max_ageを過ぎたものは、ETag/Last-Modifiedがあれば条件付きGETで確認し、304なら保持している画像を使う
+# 同じURLを同時に取得しようとした場合は、1回の取得を共有する
+class Image_Fetcher:
+    def __init__(
+        self,
+        max_concurrency: int = 16,
+        max_cache_bytes: int = 256 * 1024 * 1024,
+        max_age: float = 60.0,
+        timeout: float = 30.0,
+    ) -> None:
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be positive.")
+        self.max_concurrency = max_concurrency
+        self.max_cache_bytes = max_cache_bytes
+        self.max_age = max_age
+        self.timeout = timeout
+        # url -> ImageCache (LRU順)
+        self.cache: OrderedDict[str, ImageCache] = OrderedDict()
+        self.cache_bytes = 0
+        # Bedrock_IOはスレッドプールから同期版を呼ぶので、キャッシュの操作はロックで保護する
+        self.cache_lock = threading.Lock()
+        self.limits = httpx.Limits(
+            max_connections=max_concurrency, max_keepalive_connections=max_concurrency
+        )
+        self.client: httpx.Client | None = None
+        # 非同期クライアント、同時実行数の制限、取得中のFutureはイベントループに紐づくので、ループが変わったら作り直す
+        self.async_loop: asyncio.AbstractEventLoop | None = None
+        self.async_client: httpx.AsyncClient | None = None
+        self.semaphore: asyncio.Semaphore | None = None
+        self.fetching: dict[str, asyncio.Future[tuple[str, bytes]]] = {}
+        # 実際にGETした回数 (304を含む)
+        self.request_count = 0
+
+    def _get_cached(self, url: str) -> ImageCache | None:
+        with self.cache_lock:
+            image_cache = self.cache.get(url, None)
+            if image_cache is not None:
+                self.cache.move_to_end(url)
+            return image_cache
+
+    def _is_fresh(self, image_cache: ImageCache) -> bool:
+        return time.monotonic() - image_cache["fetched_at"] < self.max_age
+
+    def _get_conditional_headers(
+        self, image_cache: ImageCache | None
+    ) -> dict[str, str]:
+        headers: dict[str, str] = {}
+        if image_cache is None:
+            return headers
+        if image_cache["etag"] is not None:
+            headers["If-None-Match"] = image_cache["etag"]
+        if image_cache["last_modified"] is not None:
+            headers["If-Modified-Since"] = image_cache["last_modified"]
+        return headers
+
+    def _store(
+        self,
+        url: str,
+        image_cache: ImageCache | None,
+        response: httpx.Response,
+    ) -> tuple[str, bytes]:
+        self.request_count += 1
+        if response.status_code == 304 and image_cache is not None:
+            image_cache["fetched_at"] = time.monotonic()
+            return image_cache["mime_type"], image_cache["content"]
+        response.raise_for_status()
+
+        new_image_cache: ImageCache = {
+            "mime_type": response.headers.get("Content-Type", ""),
+            "content": response.content,
+            "etag": response.headers.get("ETag", None),
+            "last_modified": response.headers.get("Last-Modified", None),
+            "fetched_at": time.monotonic(),
+        }
+        with self.cache_lock:
+            old_image_cache = self.cache.pop(url, None)
+            if old_image_cache is not None:
+                self.cache_bytes -= len(old_image_cache["content"])
+            # 上限より大きい画像は保持しない
+            if len(new_image_cache["content"]) <= self.max_cache_bytes:
+                self.cache[url] = new_image_cache
+                self.cache_bytes += len(new_image_cache["content"])
+                while self.cache_bytes > self.max_cache_bytes:
+                    _, evicted_image_cache = self.cache.popitem(last=False)
+                    self.cache_bytes -= len(evicted_image_cache["content"])
+        return new_image_cache["mime_type"], new_image_cache["content"]
+
+    # (mime_type, 画像のバイト列) を返す
+    def fetch_sync(self, url: str) -> tuple[str, bytes]:
+        image_cache = self._get_cached(url)
+        if image_cache is not None and self._is_fresh(image_cache):
+            return image_cache["mime_type"], image_cache["content"]
+        if self.client is None:
+            self.client = httpx.Client(limits=self.limits, timeout=self.timeout)
+        response = self.client.get(
+            url, headers=self._get_conditional_headers(image_cache)
+        )
+        return self._store(url, image_cache, response)
+
+    def _get_async_state(self) -> tuple[httpx.AsyncClient, asyncio.Semaphore]:
+        loop = asyncio.get_running_loop()
+        if (
+            self.async_loop is not loop
+            or self.async_client is None
+            or self.semaphore is None
+        ):
+            self.async_loop = loop
+            self.async_client = httpx.AsyncClient(
+                limits=self.limits, timeout=self.timeout
+            )
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.fetching = {}
+        return self.async_client, self.semaphore
+
+    async def fetch(self, url: str) -> tuple[str, bytes]:
+        image_cache = self._get_cached(url)
+        if image_cache is not None and self._is_fresh(image_cache):
+            return image_cache["mime_type"], image_cache["content"]
+        async_client, semaphore = self._get_async_state()
+        while url in self.fetching:
+            fetching_future = self.fetching[url]
+            try:
+                return await asyncio.shield(fetching_future)
+            except asyncio.CancelledError:
+                # 取得していた呼び出しが取り消された場合は、自分で取得し直す
+                if not fetching_future.cancelled():
+                    raise
+
+        future: asyncio.Future[tuple[str, bytes]] = (
+            asyncio.get_running_loop().create_future()
+        )
+        self.fetching[url] = future
+        try:
+            async with semaphore:
+                response = await async_client.get(
+                    url, headers=self._get_conditional_headers(image_cache)
+                )
+            result = self._store(url, image_cache, response)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            # 待っている呼び出しが無い場合に警告が出ないよう、例外を取り出しておく
+            future.exception()
+            raise
+        finally:
+            # 取り消された場合(CancelledErrorはExceptionではない)も、待っている呼び出しを起こす
+            if not future.done():
+                future.cancel()
+            if self.fetching.get(url, None) is future:
+                self.fetching.pop(url)
+
+    # fetch_sync用のクライアントを閉じる (次に使われたときに作り直す)
+    def close(self) -> None:
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+    async def aclose(self) -> None:
+        self.close()
+        # 終了済みのループで作ったクライアントは閉じられないので、破棄するだけにする
+        if (
+            self.async_client is not None
+            and self.async_loop is asyncio.get_running_loop()
+        ):
+            await self.async_client.aclose()
+        self.async_loop = None
+        self.async_client = None
+        self.semaphore = None
+        self.fetching = {}
+
+
+_image_fetcher: Image_Fetcher | None = None
+
+
+# 全Worker_IOで共有する既定のImage_Fetcher
+def get_image_fetcher() -> Image_Fetcher:
+    global _image_fetcher
+    if _image_fetcher is None:
+        _image_fetcher = Image_Fetcher()
+    return _image_fetcher
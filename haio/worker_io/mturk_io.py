@@ -1,13 +1,17 @@
 from icecream import ic
 from dotenv import load_dotenv
+from decimal import Decimal
+import json
 import os
 import xml.etree.ElementTree as ET
 import asyncio
 import textwrap
+import threading
+import time
 import boto3
 from bs4 import BeautifulSoup
 
-from haio.common import check_frequency
+from haio.common import check_frequency, haio_uid
 from haio.types import QuestionConfig, Answer
 from haio.worker_io.types import Worker_IO
 
@@ -62,7 +66,14 @@ template2: str = textwrap.dedent(
 
 
 class MTurk_IO(Worker_IO):
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        poll_interval: float = check_frequency,
+        pack_size: int = 1,
+        reward: str = "0.05",
+    ) -> None:
+        if pack_size < 1:
+            raise ValueError("pack_size must be positive.")
         load_dotenv()
         self.mturk_client = boto3.client(
             "mturk",
@@ -71,12 +82,40 @@ class MTurk_IO(Worker_IO):
             region_name="us-east-1",
             endpoint_url="https://mturk-requester-sandbox.us-east-1.amazonaws.com",
         )
-        self.asked: list[str] = []
+        self.asked: set[str] = set()
+        # HIT ID -> HITTypeId
+        self.hit_type_ids: dict[str, str] = {}
+        # HITの状態はget_hitでHITごとに確認せず、ListReviewableHITsでHITTypeIdごとにまとめて確認する
+        # 確認はpoll_intervalごとに1回なので、API呼び出し数は待っているHITの数によらない
+        # 回答を取り出したHITはReviewingに移すので、過去のHITが溜まっても確認の量は増えない
+        self.poll_interval = poll_interval
+        self.last_poll_time = float("-inf")
+        self.reviewable_hit_ids: set[str] = set()
+        # HIT ID -> ask_get_answerで終了を待っているFuture
+        self.waiters: dict[str, list[asyncio.Future]] = {}
+        self.poller_task: asyncio.Task | None = None
+        # 1問あたりの報酬 (pack_size問をまとめたHITの報酬はその合計)
+        self.reward = reward
+        # pack_size > 1 の場合、title, description, answerが同じ質問をpack_size問ずつ1つのHITにまとめる
+        # 回答欄は response_0, response_1, ... とし、回答を受け取ったら質問ごとに分ける
+        self.pack_size = pack_size
+        # 形の同じ質問ごとに、HIT未作成の (質問ID, question_config) を溜める
+        self.pending_packs: dict[str, list[tuple[str, QuestionConfig]]] = {}
+        self.pending_question_ids: dict[str, str] = {}
+        # 質問ID -> (HIT ID, HIT内の番号)
+        self.packed_question_ids: dict[str, tuple[str, int]] = {}
+        # HIT ID -> HIT内の番号 -> 回答 (取り出していないもの)
+        self.packed_answers: dict[str, dict[int, Answer]] = {}
+        # HIT ID -> 回答を取り出していない質問の数
+        self.packed_remaining_counts: dict[str, int] = {}
+        # HAIOClientはis_finishedとget_answerを別スレッドから呼ぶので、状態の操作はロックで保護する
+        self.lock = threading.RLock()
 
     def test(self) -> dict:
         return self.mturk_client.get_account_balance()
 
     # HITを作成し、そのHIT IDを返す
+    # pack_size > 1 の場合は質問を溜め、HIT内の質問を表す質問IDを返す
     def ask(self, question_config: QuestionConfig) -> str:
 
         # MTurk_IOでは、全く同じ質問を複数回聞ける
@@ -84,9 +123,19 @@ class MTurk_IO(Worker_IO):
         # if self.hit_id != "":
         #     raise Exception("already asking")
 
-        # テンプレートの構成
-        soup = BeautifulSoup("", "html.parser")
+        with self.lock:
+            if self.pack_size > 1:
+                return self._enqueue(question_config)
+
+            # テンプレートの構成
+            soup = BeautifulSoup("", "html.parser")
+            self._append_question(soup, question_config, "response")
+
+            return self._create_hit(question_config, soup, self.reward)
 
+    def _append_question(
+        self, soup: BeautifulSoup, question_config: QuestionConfig, response_name: str
+    ) -> None:
         # questionのテンプレートを構成
         for question in question_config["question"]:
             if question["tag"] in ["h1", "h2", "h3", "h4", "h5", "h6", "p"]:
@@ -104,14 +153,14 @@ class MTurk_IO(Worker_IO):
             output_soup = soup.new_tag(
                 name="crowd-input",
                 attrs={
-                    "name": "response",
+                    "name": response_name,
                     "placeholder": "Type your answer here...",
                     "required": "",
                 },
             )
             soup.append(output_soup)
         elif question_config["answer"]["type"] == "select":
-            output_soup = soup.new_tag(name="select", attrs={"name": "response"})
+            output_soup = soup.new_tag(name="select", attrs={"name": response_name})
             for option in question_config["answer"]["options"]:
                 option_soup = soup.new_tag(name="option", attrs={"value": option})
                 option_soup.string = option
@@ -120,12 +169,15 @@ class MTurk_IO(Worker_IO):
         else:
             raise Exception("Invalid answer type.")
 
+    def _create_hit(
+        self, question_config: QuestionConfig, soup: BeautifulSoup, reward: str
+    ) -> str:
         # タスクの構成と発行
         res = self.mturk_client.create_hit(
             Title=question_config["title"],
             Description=question_config["description"],
             Keywords="this,is,my,HIT,hoge",  # コンマ区切りで検索キーワードを指定
-            Reward="0.05",
+            Reward=reward,
             MaxAssignments=1,  # 受け付ける回答数（＝ワーカー数）上限
             LifetimeInSeconds=3600,  # 有効期限
             AssignmentDurationInSeconds=300,  # 制限時間
@@ -135,44 +187,213 @@ class MTurk_IO(Worker_IO):
         )
 
         print("HIT ID:", res["HIT"]["HITId"])
-        self.asked.append(res["HIT"]["HITId"])
+        self.asked.add(res["HIT"]["HITId"])
+        self.hit_type_ids[res["HIT"]["HITId"]] = res["HIT"]["HITTypeId"]
         return res["HIT"]["HITId"]
 
+    def _enqueue(self, question_config: QuestionConfig) -> str:
+        pack_key = json.dumps(
+            [
+                question_config["title"],
+                question_config["description"],
+                question_config["answer"],
+            ],
+            sort_keys=True,
+        )
+        question_id = haio_uid()
+        pack = self.pending_packs.setdefault(pack_key, [])
+        pack.append((question_id, question_config))
+        self.pending_question_ids[question_id] = pack_key
+        if len(pack) >= self.pack_size:
+            self._create_packed_hit(pack_key)
+        return question_id
+
+    # 溜めている質問を、pack_size問に満たなくてもHITとして発行する
+    def flush(self) -> list[str]:
+        with self.lock:
+            return [
+                self._create_packed_hit(pack_key)
+                for pack_key in list(self.pending_packs.keys())
+            ]
+
+    def _create_packed_hit(self, pack_key: str) -> str:
+        pack = self.pending_packs.pop(pack_key)
+        soup = BeautifulSoup("", "html.parser")
+        for index, (_, question_config) in enumerate(pack):
+            section_soup = soup.new_tag("h3")
+            section_soup.string = f"Question {index + 1} / {len(pack)}"
+            soup.append(section_soup)
+            self._append_question(soup, question_config, f"response_{index}")
+            soup.append(soup.new_tag("hr"))
+        hit_id = self._create_hit(
+            pack[0][1], soup, str(Decimal(self.reward) * len(pack))
+        )
+        for index, (question_id, _) in enumerate(pack):
+            self.pending_question_ids.pop(question_id)
+            self.packed_question_ids[question_id] = (hit_id, index)
+        self.packed_remaining_counts[hit_id] = len(pack)
+        return hit_id
+
+    # 質問IDに対応するHIT IDを返す (HIT未作成なら溜まっている分を発行する)
+    # HAIOClientは質問を出した後にflushを呼ぶので、ここで発行するのはflushを呼ばずに待つ場合のみ
+    def _get_hit_id(self, id: str) -> str:
+        if id in self.pending_question_ids:
+            self._create_packed_hit(self.pending_question_ids[id])
+        if id in self.packed_question_ids:
+            return self.packed_question_ids[id][0]
+        return id
+
     # HIT IDを指定して、そのHITが終了しているかどうかを返す
     def is_finished(self, id: str) -> bool:
-        # idはHIT ID
-        if id not in self.asked:
-            raise Exception("never asked")
+        with self.lock:
+            # idはHIT ID (pack_size > 1 の場合は質問ID)
+            id = self._get_hit_id(id)
+            if id not in self.asked:
+                raise Exception("never asked")
 
-        res = self.mturk_client.get_hit(HITId=id)
-        state = res["HIT"]["HITStatus"]
-        return state == "Reviewable" or state == "Reviewing"
+            if (
+                id not in self.reviewable_hit_ids
+                and time.monotonic() - self.last_poll_time >= self.poll_interval
+            ):
+                self._poll_reviewable_hits()
+            return id in self.reviewable_hit_ids
+
+    # 回答待ちのHITのうち、Reviewableになったものを記録する
+    # 回答待ちのHITのHITTypeIdに絞って確認するので、アカウントの他のHITは読まない
+    def _poll_reviewable_hits(self) -> None:
+        with self.lock:
+            self.last_poll_time = time.monotonic()
+            waiting_hit_ids: dict[str, set[str]] = {}
+            for hit_id in self.asked - self.reviewable_hit_ids:
+                waiting_hit_ids.setdefault(self.hit_type_ids[hit_id], set()).add(hit_id)
+            for hit_type_id, hit_ids in waiting_hit_ids.items():
+                next_token: str | None = None
+                while hit_ids:
+                    kwargs: dict = {
+                        "HITTypeId": hit_type_id,
+                        "Status": "Reviewable",
+                        "MaxResults": 100,
+                    }
+                    if next_token is not None:
+                        kwargs["NextToken"] = next_token
+                    res = self.mturk_client.list_reviewable_hits(**kwargs)
+                    for hit in res["HITs"]:
+                        if hit["HITId"] in hit_ids:
+                            hit_ids.discard(hit["HITId"])
+                            self.reviewable_hit_ids.add(hit["HITId"])
+                    next_token = res.get("NextToken", None)
+                    if next_token is None:
+                        break
 
     # HIT IDを指定して、そのHITの結果を返す
     def get_answer(self, id: str) -> Answer:
-        # idはHIT ID
-        if id not in self.asked:
-            raise Exception("never asked")
+        with self.lock:
+            # idはHIT ID (pack_size > 1 の場合は質問ID)
+            if id in self.packed_question_ids:
+                return self._get_packed_answer(id)
+            if id not in self.asked:
+                raise Exception("never asked")
+
+            answers = self._get_hit_answers(id)
+            self._forget_hit(id)
+            if "response" not in answers:
+                raise Exception("The answer was not found.")
+            return answers["response"]
+
+    def _forget_hit(self, hit_id: str) -> None:
+        self.asked.discard(hit_id)
+        self.reviewable_hit_ids.discard(hit_id)
+        self.hit_type_ids.pop(hit_id, None)
+
+    def _get_packed_answer(self, id: str) -> Answer:
+        hit_id, index = self.packed_question_ids.pop(id)
+        if hit_id not in self.packed_answers:
+            answers = self._get_hit_answers(hit_id)
+            self.packed_answers[hit_id] = {
+                int(name[len("response_") :]): answer
+                for name, answer in answers.items()
+                if name.startswith("response_")
+            }
+        answer = self.packed_answers[hit_id].pop(index, None)
+        self.packed_remaining_counts[hit_id] -= 1
+        if self.packed_remaining_counts[hit_id] == 0:
+            self.packed_remaining_counts.pop(hit_id)
+            self.packed_answers.pop(hit_id)
+            self._forget_hit(hit_id)
+        if answer is None:
+            raise Exception("The answer was not found.")
+        return answer
 
-        res: dict = self.mturk_client.list_assignments_for_hit(HITId=id)
-        if id in self.asked:
-            self.asked.remove(id)
+    # HITの回答を、回答欄の名前 -> 回答 の形で返す
+    def _get_hit_answers(self, hit_id: str) -> dict[str, Answer]:
+        res: dict = self.mturk_client.list_assignments_for_hit(HITId=hit_id)
         answer = res["Assignments"][0]["Answer"]
         root = ET.fromstring(answer)
-        node = root.find(
-            ".//ns:FreeText",
-            {
-                "ns": "http://mechanicalturk.amazonaws.com/AWSMechanicalTurkDataSchemas/2005-10-01/QuestionFormAnswers.xsd"
-            },
-        )
-        if node is None:
-            raise Exception("The answer was not found.")
-        free_text: Answer = node.text or ""
-        return free_text
+        namespaces = {
+            "ns": "http://mechanicalturk.amazonaws.com/AWSMechanicalTurkDataSchemas/2005-10-01/QuestionFormAnswers.xsd"
+        }
+        answers: dict[str, Answer] = {}
+        for answer_node in root.findall(".//ns:Answer", namespaces):
+            identifier_node = answer_node.find("ns:QuestionIdentifier", namespaces)
+            free_text_node = answer_node.find("ns:FreeText", namespaces)
+            if identifier_node is None or free_text_node is None:
+                continue
+            answers[identifier_node.text or ""] = free_text_node.text or ""
+
+        # 回答を取り出したHITはReviewableの一覧に残らないよう、Reviewingに移す
+        # 承認・却下は従来通り利用者に任せる
+        try:
+            self.mturk_client.update_hit_review_status(HITId=hit_id, Revert=False)
+        except Exception as e:
+            print("Failed to update the review status of HIT:", hit_id, e)
+        return answers
+
+    # 全てのask_get_answerで1つのポーリングタスクを共有し、終了したHITを待つ処理だけを起こす
+    async def _wait_finished(self, id: str) -> None:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.waiters.setdefault(id, []).append(future)
+        if (
+            self.poller_task is None
+            or self.poller_task.done()
+            or self.poller_task.get_loop() is not loop
+        ):
+            self.poller_task = loop.create_task(self._run_poller())
+        try:
+            await future
+        finally:
+            if id in self.waiters and future in self.waiters[id]:
+                self.waiters[id].remove(future)
+                if not self.waiters[id]:
+                    self.waiters.pop(id)
+
+    async def _run_poller(self) -> None:
+        while self.waiters:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                # boto3は同期APIなので、イベントループを止めないよう別スレッドで呼ぶ
+                await asyncio.to_thread(self._poll_reviewable_hits)
+            except Exception as e:
+                for futures in self.waiters.values():
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(e)
+                self.waiters.clear()
+                return
+            for id in list(self.waiters.keys()):
+                if id in self.reviewable_hit_ids:
+                    for future in self.waiters.pop(id):
+                        if not future.done():
+                            future.set_result(None)
 
     # HITを作成し、その結果を返す
     async def ask_get_answer(self, question_config: QuestionConfig) -> Answer:
         id = self.ask(question_config=question_config)
-        while not self.is_finished(id=id):
-            await asyncio.sleep(check_frequency)
+        if self.pack_size > 1:
+            # 同時に呼ばれた他のask_get_answerの質問も同じHITに入るよう、一度譲る
+            await asyncio.sleep(0)
+        with self.lock:
+            hit_id = self._get_hit_id(id)
+        if hit_id not in self.reviewable_hit_ids:
+            await self._wait_finished(hit_id)
         return self.get_answer(id=id)
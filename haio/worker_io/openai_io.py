@@ -1,69 +1,104 @@
 from icecream import ic
 from typing import Union, Any
 from dotenv import load_dotenv
+import asyncio
+import httpx
 import json
 import textwrap
-from openai import OpenAI
+import time
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, OpenAI
 
-from haio.common import haio_hash
-from haio.types import QuestionConfig, Answer
+from haio.common import check_frequency, haio_hash, haio_uid
+from haio.types import QuestionConfig, QuestionTemplate, DataList, Answer
+from haio.worker_io.prompt_skeleton import Prompt_Skeleton
+from haio.worker_io.rate_limiter import Rate_Limiter, estimate_prompt_tokens
 from haio.worker_io.types import Worker_IO
 
 
 class OpenAI_IO(Worker_IO):
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        model: str = "gpt-4o-mini",
+        max_concurrency: int = 64,
+        rate_limiter: Rate_Limiter | None = None,
+        batch: bool = False,
+        batch_poll_interval: float = check_frequency,
+        batch_flush_interval: float = 1.0,
+        batch_max_size: int = 50000,
+    ) -> None:
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be positive.")
+        if batch_max_size < 1:
+            raise ValueError("batch_max_size must be positive.")
         load_dotenv()
+        self.model = model
+        self.max_concurrency = max_concurrency
+        # 指定されていれば、ask_get_answerはRPM/TPMの枠が空くまで待ってから聞く
+        self.rate_limiter = rate_limiter
         self.openai_client = OpenAI()
+        # ask_get_answer用の非同期クライアント(1つのコネクションプールを使い回す)と同時実行数の制限
+        # どちらもイベントループに紐づくので、ループが変わったら作り直す
+        self.async_loop: asyncio.AbstractEventLoop | None = None
+        self.async_openai_client: AsyncOpenAI | None = None
+        self.semaphore: asyncio.Semaphore | None = None
         self.asked: dict[str, Answer] = {}
+        # question_template_hash -> (プロンプトの骨組み, システムメッセージ, 回答形式)
+        self.compiled_templates: dict[str, tuple[Prompt_Skeleton, str, Any]] = {}
+        # batch=Trueの場合、askはリクエストを溜めるだけで、flushでBatch APIにまとめて投げる
+        # 回答はバッチの出力ファイルから取得する (MTurk_IOと同じく ask -> is_finished -> get_answer)
+        self.batch = batch
+        self.batch_poll_interval = batch_poll_interval
+        # ask_get_answerでは、最初のリクエストからbatch_flush_interval秒の間に来たリクエストを1つのバッチにまとめる
+        # batch_max_size件溜まったら待たずに送信する (Batch APIの1バッチの上限は50,000件)
+        self.batch_flush_interval = batch_flush_interval
+        self.batch_max_size = batch_max_size
+        self.batch_flush_timer: asyncio.Task[None] | None = None
+        self.batch_flush_tasks: set[asyncio.Task[None]] = set()
+        # custom_id -> Batch APIのリクエスト行 (未送信)
+        self.batch_queue: dict[str, dict[str, Any]] = {}
+        # 送信中 (バッチの作成待ち) のcustom_id
+        self.batch_submitting: set[str] = set()
+        # custom_id -> batch_id
+        self.batch_ids: dict[str, str] = {}
+        # batch_id -> 最後に状態を確認した時刻
+        self.batch_checked_times: dict[str, float] = {}
+        # custom_id -> 回答 (失敗した場合はException)
+        self.batch_results: dict[str, Answer | Exception] = {}
 
-    def ask(self, question_config: QuestionConfig) -> str:
-        question_config_hash = haio_hash(question_config)
-
-        # OpenAI_IOでは、回答を取得せずに同じ質問を複数回聞くことはできない
-        # 既に質問済みならエラーを返す
-        if question_config_hash in self.asked:
-            raise Exception("already asking")
-
-        # questionのテンプレートを構成
-        user_content: Union[str, list]
-        user_message = ""
-        imgs: list[str] = []
-        for question in question_config["question"]:
-            match question["tag"]:
-                case "h1":
-                    user_message += f"# {question['value']}\n"
-                case "h2":
-                    user_message += f"## {question['value']}\n"
-                case "h3":
-                    user_message += f"### {question['value']}\n"
-                case "h4":
-                    user_message += f"#### {question['value']}\n"
-                case "h5":
-                    user_message += f"##### {question['value']}\n"
-                case "h6":
-                    user_message += f"###### {question['value']}\n"
-                case "p":
-                    user_message += f"{question['value']}\n"
-                case "img":
-                    imgs.append(question["src"])
-                case _:
-                    raise Exception("Invalid tag.")
-
-        if imgs:
-            user_content = [{"type": "text", "text": user_message}]
-            for img in imgs:
-                user_content.append(
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": img,
-                            "detail": "low",
-                        },
-                    }
+    def _get_async_client(self) -> tuple[AsyncOpenAI, asyncio.Semaphore]:
+        loop = asyncio.get_running_loop()
+        if (
+            self.async_loop is not loop
+            or self.async_openai_client is None
+            or self.semaphore is None
+        ):
+            self.async_loop = loop
+            self.async_openai_client = AsyncOpenAI(
+                http_client=DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=self.max_concurrency,
+                        max_keepalive_connections=self.max_concurrency,
+                    )
                 )
-        else:
-            user_content = user_message
+            )
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self.async_openai_client, self.semaphore
+
+    async def aclose(self) -> None:
+        # 終了済みのループで作ったクライアントは閉じられないので、破棄するだけにする
+        if (
+            self.async_openai_client is not None
+            and self.async_loop is asyncio.get_running_loop()
+        ):
+            await self.async_openai_client.close()
+        self.async_loop = None
+        self.async_openai_client = None
+        self.semaphore = None
 
+    # question_templateごとに変わらない部分(プロンプトの骨組み、システムメッセージ、回答形式)を組み立てる
+    def _compile(
+        self, question_template: QuestionTemplate | QuestionConfig
+    ) -> tuple[Prompt_Skeleton, str, Any]:
         # システムメッセージの初期化
         system_message: str = textwrap.dedent(
             """\
@@ -90,55 +125,127 @@ class OpenAI_IO(Worker_IO):
         }
 
         # 回答形式に応じてシステムメッセージと回答形式を構築
-        if question_config["answer"]["type"] == "number":
+        if question_template["answer"]["type"] == "number":
             system_message += "{{answer: {}}}".format("number")
             response_format["json_schema"]["schema"]["properties"]["answer"][
                 "type"
             ] = "number"
-        elif question_config["answer"]["type"] == "text":
+        elif question_template["answer"]["type"] == "text":
             system_message += "{{answer: {}}}".format("string")
             response_format["json_schema"]["schema"]["properties"]["answer"][
                 "type"
             ] = "string"
-        elif question_config["answer"]["type"] == "select":
+        elif question_template["answer"]["type"] == "select":
             system_message += "{{answer: select from {}}}".format(
-                question_config["answer"]["options"]
+                question_template["answer"]["options"]
             )
             response_format["json_schema"]["schema"]["properties"]["answer"][
                 "type"
             ] = "string"
             response_format["json_schema"]["schema"]["properties"]["answer"]["enum"] = (
-                question_config["answer"]["options"]
+                question_template["answer"]["options"]
             )
         else:
             raise Exception("Invalid answer type.")
 
-        # タスクの構成と発行
-        completion = self.openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
+        return Prompt_Skeleton(question_template), system_message, response_format
+
+    def _get_compiled(
+        self,
+        question_template: QuestionTemplate,
+        question_template_hash: str | None = None,
+    ) -> tuple[Prompt_Skeleton, str, Any]:
+        if question_template_hash is None:
+            question_template_hash = haio_hash(question_template)
+        compiled = self.compiled_templates.get(question_template_hash, None)
+        if compiled is None:
+            compiled = self._compile(question_template)
+            self.compiled_templates[question_template_hash] = compiled
+        return compiled
+
+    # 骨組みにdata_listを埋めてリクエストを構成し、(リクエスト, 見積もりトークン数) を返す
+    def _render_request(
+        self, compiled: tuple[Prompt_Skeleton, str, Any], data_list: DataList
+    ) -> tuple[dict[str, Any], int]:
+        prompt_skeleton, system_message, response_format = compiled
+        user_message, imgs = prompt_skeleton.render(data_list)
+
+        user_content: Union[str, list]
+        if imgs:
+            user_content = [{"type": "text", "text": user_message}]
+            for img in imgs:
+                user_content.append(
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": img,
+                            "detail": "low",
+                        },
+                    }
+                )
+        else:
+            user_content = user_message
+
+        # タスクの構成
+        request = {
+            "model": self.model,
+            "messages": [
                 {"role": "system", "content": system_message},
                 {"role": "user", "content": user_content},
             ],
-            response_format=response_format,
+            "response_format": response_format,
+        }
+        estimated_tokens = estimate_prompt_tokens(
+            len(system_message) + len(user_message), len(imgs)
         )
-        print("OpenAI Question Config Hash:", question_config_hash)
+        return request, estimated_tokens
 
-        if completion.choices[0].message.content:
-            answer_objstr = completion.choices[0].message.content
-            self.asked[question_config_hash] = json.loads(answer_objstr)["answer"]
+    def _build_request(self, question_config: QuestionConfig) -> dict[str, Any]:
+        return self._render_request(self._compile(question_config), [])[0]
+
+    def _parse_completion(self, completion: Any) -> Answer:
+        return self._parse_content(completion.choices[0].message.content)
+
+    def _parse_content(self, content: str | None) -> Answer:
+        if content:
+            return json.loads(content)["answer"]
         else:
             raise Exception("The model returned empty response.")
 
+    def ask(self, question_config: QuestionConfig) -> str:
+        if self.batch:
+            return self._enqueue(question_config)
+
+        question_config_hash = haio_hash(question_config)
+
+        # OpenAI_IOでは、回答を取得せずに同じ質問を複数回聞くことはできない
+        # 既に質問済みならエラーを返す
+        if question_config_hash in self.asked:
+            raise Exception("already asking")
+
+        # タスクの発行
+        completion = self.openai_client.chat.completions.create(
+            **self._build_request(question_config)
+        )
+        print("OpenAI Question Config Hash:", question_config_hash)
+
+        self.asked[question_config_hash] = self._parse_completion(completion)
+
         return question_config_hash
 
     def is_finished(self, id: str) -> bool:
+        if self.batch:
+            return self._is_batch_finished(id)
+
         # idはquestion_config_hash
         if id not in self.asked:
             raise Exception("never asked")
         return self.asked[id] != ""  # 実質的には常にTrue
 
     def get_answer(self, id: str) -> Answer:
+        if self.batch:
+            return self._get_batch_answer(id)
+
         # idはquestion_config_hash
         if id not in self.asked:
             raise Exception("never asked")
@@ -147,6 +254,265 @@ class OpenAI_IO(Worker_IO):
         self.asked.pop(id)
         return tmp
 
+    # 非同期クライアントで聞くので、イベントループを止めずに複数の質問を同時に待てる
+    # askと異なり、同じ質問を同時に複数回聞いてもよい
     async def ask_get_answer(self, question_config: QuestionConfig) -> Answer:
-        id = self.ask(question_config=question_config)
-        return self.get_answer(id)
+        return await self._ask_get_answer_request(
+            *self._render_request(self._compile(question_config), [])
+        )
+
+    # question_templateごとの骨組みを使い回し、質問ごとにはdata_listを埋めるだけにする
+    async def ask_get_answer_from_template(
+        self,
+        question_template: QuestionTemplate,
+        data_list: DataList,
+        question_template_hash: str | None = None,
+    ) -> Answer:
+        if question_template_hash is None:
+            question_template_hash = haio_hash(question_template)
+        return await self._ask_get_answer_request(
+            *self._render_request(
+                self._get_compiled(question_template, question_template_hash),
+                data_list,
+            )
+        )
+
+    async def _ask_get_answer_request(
+        self, request: dict[str, Any], estimated_tokens: int
+    ) -> Answer:
+        if self.batch:
+            # 送信と状態の確認は非同期クライアントで行い、イベントループを止めない
+            id = self._enqueue_request(request)
+            self._schedule_flush()
+            while not await self._is_batch_finished_async(id):
+                await asyncio.sleep(self.batch_poll_interval)
+            return self._get_batch_answer(id)
+
+        async_openai_client, semaphore = self._get_async_client()
+        async with semaphore:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire(estimated_tokens)
+            completion = await async_openai_client.chat.completions.create(**request)
+        if self.rate_limiter is not None and completion.usage is not None:
+            self.rate_limiter.adjust(completion.usage.total_tokens - estimated_tokens)
+        return self._parse_completion(completion)
+
+    # batch mode
+
+    def _enqueue(self, question_config: QuestionConfig) -> str:
+        return self._enqueue_request(self._build_request(question_config))
+
+    def _enqueue_request(self, request: dict[str, Any]) -> str:
+        # バッチでは同じ質問を複数回聞けるよう、質問ごとに別のidを振る
+        custom_id = haio_uid()
+        self.batch_queue[custom_id] = {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": request,
+        }
+        return custom_id
+
+    # 溜めたリクエストをbatch_max_size件ずつJSONLファイルとしてアップロードし、バッチを作成する
+    def flush(self) -> list[str]:
+        batch_ids: list[str] = []
+        for batch_queue in self._take_batch_queues():
+            try:
+                batch_input_file = self.openai_client.files.create(
+                    file=("haio_batch.jsonl", self._get_batch_input(batch_queue)),
+                    purpose="batch",
+                )
+                batch = self.openai_client.batches.create(
+                    input_file_id=batch_input_file.id,
+                    endpoint="/v1/chat/completions",
+                    completion_window="24h",
+                )
+            except Exception as e:
+                # 送信に失敗した場合は、含まれるリクエストを失敗とする (get_answerで例外になる)
+                for custom_id in batch_queue:
+                    self.batch_results[custom_id] = e
+                continue
+            self._register_batch(list(batch_queue), batch.id)
+            batch_ids.append(batch.id)
+        return batch_ids
+
+    # flushの非同期版。送信中に追加されたリクエストは次のバッチに入る
+    async def aflush(self) -> list[str]:
+        batch_ids: list[str] = []
+        for batch_queue in self._take_batch_queues():
+            self.batch_submitting.update(batch_queue)
+            async_openai_client, _ = self._get_async_client()
+            try:
+                batch_input_file = await async_openai_client.files.create(
+                    file=("haio_batch.jsonl", self._get_batch_input(batch_queue)),
+                    purpose="batch",
+                )
+                batch = await async_openai_client.batches.create(
+                    input_file_id=batch_input_file.id,
+                    endpoint="/v1/chat/completions",
+                    completion_window="24h",
+                )
+            except Exception as e:
+                for custom_id in batch_queue:
+                    self.batch_results[custom_id] = e
+                continue
+            finally:
+                self.batch_submitting.difference_update(batch_queue)
+            self._register_batch(list(batch_queue), batch.id)
+            batch_ids.append(batch.id)
+        return batch_ids
+
+    # 溜めたリクエストを取り出し、batch_max_size件ずつに分ける
+    def _take_batch_queues(self) -> list[dict[str, dict[str, Any]]]:
+        requests = list(self.batch_queue.items())
+        self.batch_queue = {}
+        return [
+            dict(requests[i : i + self.batch_max_size])
+            for i in range(0, len(requests), self.batch_max_size)
+        ]
+
+    def _get_batch_input(self, batch_queue: dict[str, dict[str, Any]]) -> bytes:
+        return "".join(
+            json.dumps(request) + "\n" for request in batch_queue.values()
+        ).encode()
+
+    def _register_batch(self, custom_ids: list[str], batch_id: str) -> None:
+        print("OpenAI Batch ID:", batch_id)
+        for custom_id in custom_ids:
+            self.batch_ids[custom_id] = batch_id
+        self.batch_checked_times[batch_id] = time.monotonic()
+
+    # 溜まったリクエストが上限に達していればすぐに、そうでなければbatch_flush_interval秒後にaflushする
+    def _schedule_flush(self) -> None:
+        if len(self.batch_queue) >= self.batch_max_size:
+            self._create_flush_task(0.0)
+        elif self.batch_flush_timer is None or self.batch_flush_timer.done():
+            self.batch_flush_timer = self._create_flush_task(self.batch_flush_interval)
+
+    def _create_flush_task(self, delay: float) -> asyncio.Task[None]:
+        async def flush_after() -> None:
+            await asyncio.sleep(delay)
+            await self.aflush()
+
+        task = asyncio.create_task(flush_after())
+        # 実行中のタスクが破棄されないよう参照を持っておく
+        self.batch_flush_tasks.add(task)
+        task.add_done_callback(self.batch_flush_tasks.discard)
+        return task
+
+    # 状態を確認するバッチのidを返す。前回の確認からbatch_poll_interval経っていなければNone
+    def _get_batch_to_check(self, id: str) -> str | None:
+        if id not in self.batch_ids:
+            raise Exception("never asked")
+        # 同じバッチの質問が多数あっても、状態の確認はbatch_poll_intervalごとに1回にする
+        batch_id = self.batch_ids[id]
+        if (
+            time.monotonic() - self.batch_checked_times.get(batch_id, 0.0)
+            < self.batch_poll_interval
+        ):
+            return None
+        self.batch_checked_times[batch_id] = time.monotonic()
+        return batch_id
+
+    # 完了したバッチのみTrueを返す
+    def _check_batch_status(self, batch: Any) -> bool:
+        if batch.status in ("failed", "expired", "cancelled"):
+            raise Exception(f"The batch {batch.id} is {batch.status}.")
+        return batch.status == "completed"
+
+    def _is_batch_finished(self, id: str) -> bool:
+        if id in self.batch_results:
+            return True
+        # まだ送信していなければ、溜まっている分をまとめて送信する
+        if id in self.batch_queue:
+            self.flush()
+            return False
+        if id in self.batch_submitting:
+            return False
+        batch_id = self._get_batch_to_check(id)
+        if batch_id is None:
+            return False
+        batch = self.openai_client.batches.retrieve(batch_id)
+        if not self._check_batch_status(batch):
+            return False
+        self._load_batch_results(
+            batch,
+            [
+                self.openai_client.files.content(file_id).text
+                for file_id in (batch.output_file_id, batch.error_file_id)
+                if file_id is not None
+            ],
+        )
+        return id in self.batch_results
+
+    # _is_batch_finishedの非同期版
+    async def _is_batch_finished_async(self, id: str) -> bool:
+        if id in self.batch_results:
+            return True
+        if id in self.batch_queue:
+            self._schedule_flush()
+            return False
+        if id in self.batch_submitting:
+            return False
+        batch_id = self._get_batch_to_check(id)
+        if batch_id is None:
+            return False
+        async_openai_client, _ = self._get_async_client()
+        batch = await async_openai_client.batches.retrieve(batch_id)
+        if not self._check_batch_status(batch):
+            return False
+        # 同じバッチを待つ他の呼び出しが先に読み込んでいることがある
+        if batch.id in self.batch_checked_times:
+            self._load_batch_results(
+                batch,
+                [
+                    (await async_openai_client.files.content(file_id)).text
+                    for file_id in (batch.output_file_id, batch.error_file_id)
+                    if file_id is not None
+                ],
+            )
+        return id in self.batch_results
+
+    # バッチの出力ファイル(とエラーファイル)の内容から回答を取り出す
+    def _load_batch_results(self, batch: Any, outputs: list[str]) -> None:
+        for text in outputs:
+            for line in text.splitlines():
+                if not line.strip():
+                    continue
+                output = json.loads(line)
+                custom_id = output["custom_id"]
+                if custom_id not in self.batch_ids:
+                    continue
+                self.batch_ids.pop(custom_id)
+                response = output.get("response", None)
+                if output.get("error", None) is not None or response is None:
+                    self.batch_results[custom_id] = Exception(
+                        f"The request failed: {output.get('error', None)}"
+                    )
+                elif response["status_code"] != 200:
+                    self.batch_results[custom_id] = Exception(
+                        f"The request failed: {response['body']}"
+                    )
+                else:
+                    try:
+                        self.batch_results[custom_id] = self._parse_content(
+                            response["body"]["choices"][0]["message"]["content"]
+                        )
+                    except Exception as e:
+                        self.batch_results[custom_id] = e
+        self.batch_checked_times.pop(batch.id, None)
+        # 出力に含まれなかったリクエストは失敗として扱う
+        for custom_id, batch_id in list(self.batch_ids.items()):
+            if batch_id == batch.id:
+                self.batch_ids.pop(custom_id)
+                self.batch_results[custom_id] = Exception(
+                    "The request was not found in the batch output."
+                )
+
+    def _get_batch_answer(self, id: str) -> Answer:
+        if id not in self.batch_results:
+            raise Exception("never asked")
+        result = self.batch_results.pop(id)
+        if isinstance(result, Exception):
+            raise result
+        return result
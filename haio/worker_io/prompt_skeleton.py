@@ -0,0 +1,56 @@
+from haio.types import QuestionConfig, QuestionTemplate, DataList
+
+# タグごとのMarkdownの接頭辞
+_text_prefixes = {
+    "h1": "# ",
+    "h2": "## ",
+    "h3": "### ",
+    "h4": "#### ",
+    "h5": "##### ",
+    "h6": "###### ",
+    "p": "",
+}
+
+
+# question_templateのquestionを、固定部分とdata_listで埋める枠に分けて1度だけ解析したもの
+# renderではinsert_dataと同じく、int型のvalue/srcをdata_listの要素で置き換える
+# 枠の無いquestion_config(insert_data済み)もそのまま解析できる
+class Prompt_Skeleton:
+    def __init__(self, question_template: QuestionTemplate | QuestionConfig) -> None:
+        # user_messageの断片。strは固定部分(連続するものは結合済み)、(接頭辞, i)はdata_list[i]の枠
+        self.text_parts: list[str | tuple[str, int]] = []
+        # 画像URL。strは固定、intはdata_list[i]の枠
+        self.img_parts: list[str | int] = []
+        static_text = ""
+        for question in question_template["question"]:
+            if question["tag"] == "img":
+                self.img_parts.append(question["src"])
+            elif question["tag"] in _text_prefixes:
+                prefix = _text_prefixes[question["tag"]]
+                if type(question["value"]) == int:
+                    if static_text:
+                        self.text_parts.append(static_text)
+                        static_text = ""
+                    self.text_parts.append((prefix, question["value"]))
+                else:
+                    static_text += f"{prefix}{question['value']}\n"
+            else:
+                raise Exception("Invalid tag.")
+        if static_text:
+            self.text_parts.append(static_text)
+
+    # (user_message, 画像URLのリスト) を返す
+    def render(self, data_list: DataList) -> tuple[str, list[str]]:
+        user_message = "".join(
+            (
+                text_part
+                if isinstance(text_part, str)
+                else f"{text_part[0]}{data_list[text_part[1]]}\n"
+            )
+            for text_part in self.text_parts
+        )
+        img_urls = [
+            img_part if isinstance(img_part, str) else data_list[img_part]
+            for img_part in self.img_parts
+        ]
+        return user_message, img_urls
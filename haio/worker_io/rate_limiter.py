@@ -0,0 +1,140 @@
+import asyncio
+import json
+import time
+
+from haio.types import QuestionConfig
+
+
+# 1分あたりのリクエスト数(RPM)とトークン数(TPM)のトークンバケット
+# acquireを呼んだ順に待たせるので、429を受けてリトライするより上限近くで安定して流せる
+# 同じアカウントの枠を共有するWorker_IO同士では、get_rate_limiterで同じインスタンスを使う
+class Rate_Limiter:
+    def __init__(
+        self,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+    ) -> None:
+        if requests_per_minute is not None and requests_per_minute <= 0:
+            raise ValueError("requests_per_minute must be positive.")
+        if tokens_per_minute is not None and tokens_per_minute <= 0:
+            raise ValueError("tokens_per_minute must be positive.")
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        # 最初は満杯の状態から始める
+        self.request_level = requests_per_minute or 0.0
+        self.token_level = tokens_per_minute or 0.0
+        self.last_refill_time = time.monotonic()
+        # asyncio.Lockはイベントループに紐づくので、ループが変わったら作り直す
+        self.lock_loop: asyncio.AbstractEventLoop | None = None
+        self.lock: asyncio.Lock | None = None
+
+    def _get_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self.lock_loop is not loop or self.lock is None:
+            self.lock_loop = loop
+            self.lock = asyncio.Lock()
+        return self.lock
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self.last_refill_time
+        self.last_refill_time = now
+        if self.requests_per_minute is not None:
+            self.request_level = min(
+                self.requests_per_minute,
+                self.request_level + elapsed * self.requests_per_minute / 60,
+            )
+        if self.tokens_per_minute is not None:
+            self.token_level = min(
+                self.tokens_per_minute,
+                self.token_level + elapsed * self.tokens_per_minute / 60,
+            )
+
+    # 1リクエストとtokensトークン分が貯まるまでの秒数
+    def _get_wait_time(self, tokens: float) -> float:
+        wait_time = 0.0
+        if self.requests_per_minute is not None and self.request_level < 1:
+            wait_time = max(
+                wait_time, (1 - self.request_level) * 60 / self.requests_per_minute
+            )
+        if self.tokens_per_minute is not None and self.token_level < tokens:
+            wait_time = max(
+                wait_time, (tokens - self.token_level) * 60 / self.tokens_per_minute
+            )
+        return wait_time
+
+    async def acquire(self, tokens: float = 0) -> None:
+        # 1分の上限を超えるリクエストは、満杯になるまで待てば通す
+        if self.tokens_per_minute is not None:
+            tokens = min(tokens, self.tokens_per_minute)
+        # 先頭の呼び出しだけがバケットを待ち、後続はロックの順に並ぶ
+        async with self._get_lock():
+            while True:
+                self._refill()
+                wait_time = self._get_wait_time(tokens)
+                if wait_time <= 0:
+                    break
+                await asyncio.sleep(wait_time)
+            if self.requests_per_minute is not None:
+                self.request_level -= 1
+            if self.tokens_per_minute is not None:
+                self.token_level -= tokens
+
+    # 実際の消費トークン数が分かったら、見積もりとの差を反映する
+    # 見積もりより多く使った分はバケットが負になり、後続が待たされる
+    def adjust(self, tokens: float) -> None:
+        if self.tokens_per_minute is None:
+            return
+        self._refill()
+        self.token_level = min(self.tokens_per_minute, self.token_level - tokens)
+
+
+# key("openai:gpt-4o-mini", "bedrock"など)ごとに1つのRate_Limiterを共有する
+_rate_limiters: dict[str, Rate_Limiter] = {}
+
+
+def get_rate_limiter(
+    key: str,
+    requests_per_minute: float | None = None,
+    tokens_per_minute: float | None = None,
+) -> Rate_Limiter:
+    rate_limiter = _rate_limiters.get(key, None)
+    if rate_limiter is None:
+        rate_limiter = Rate_Limiter(
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+        )
+        _rate_limiters[key] = rate_limiter
+    elif (requests_per_minute, tokens_per_minute) != (None, None) and (
+        requests_per_minute,
+        tokens_per_minute,
+    ) != (rate_limiter.requests_per_minute, rate_limiter.tokens_per_minute):
+        raise Exception(f"The rate limiter {key} already exists with other limits.")
+    return rate_limiter
+
+
+# リクエスト前に消費トークン数を大まかに見積もる (文字数/4 + 画像1枚ごとの固定値 + 回答分)
+def estimate_tokens(
+    question_config: QuestionConfig,
+    img_tokens: int = 1000,
+    answer_tokens: int = 100,
+) -> int:
+    text_length = 0
+    img_count = 0
+    for question in question_config["question"]:
+        if question["tag"] == "img":
+            img_count += 1
+        else:
+            text_length += len(str(question.get("value", "")))
+    text_length += len(json.dumps(question_config["answer"]))
+    return estimate_prompt_tokens(text_length, img_count, img_tokens, answer_tokens)
+
+
+# 組み立て済みのプロンプトの文字数と画像の枚数から見積もる
+def estimate_prompt_tokens(
+    text_length: int,
+    img_count: int,
+    img_tokens: int = 1000,
+    answer_tokens: int = 100,
+) -> int:
+    return text_length // 4 + img_count * img_tokens + answer_tokens
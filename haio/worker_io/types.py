@@ -1,5 +1,6 @@
 from abc import abstractmethod, ABCMeta
-from haio.types import QuestionConfig, Answer
+from haio.common import insert_data
+from haio.types import QuestionConfig, QuestionTemplate, DataList, Answer
 
 
 class Worker_IO(metaclass=ABCMeta):
@@ -18,3 +19,22 @@ class Worker_IO(metaclass=ABCMeta):
     @abstractmethod
     async def ask_get_answer(self, question_config: QuestionConfig) -> Answer:
         pass
+
+    # askで溜めている質問を発行し、発行したもののID (HIT ID, バッチIDなど) を返す
+    # 質問を溜めないWorker_IOでは何もしない
+    def flush(self) -> list[str]:
+        return []
+
+    # question_templateとdata_listを受け取るask_get_answer
+    # LLMのWorker_IOはquestion_templateごとに組み立てたプロンプトの骨組みを使い回すため、これを上書きする
+    async def ask_get_answer_from_template(
+        self,
+        question_template: QuestionTemplate,
+        data_list: DataList,
+        question_template_hash: str | None = None,
+    ) -> Answer:
+        return await self.ask_get_answer(
+            question_config=insert_data(
+                question_template=question_template, data_list=data_list
+            )
+        )
@@ -0,0 +1,132 @@
+from haio import (
+    CacheRecord,
+    ClientType,
+    JSON_Cache_IO,
+    Memory_Cache_IO,
+    QuestionTemplate,
+    SQLite_Cache_IO,
+    haio_hash,
+    haio_uid,
+    migrate_cache,
+)
+import random
+import tempfile
+import time
+
+# JSONのキャッシュをSQLiteへ移行し、移行した回答数と内容が一致することを確認する
+# Memory_Cache_IOをSQLite_Cache_IOの前段に置いた場合、参照したdata_listだけを読み込むことも確認する
+
+template_number = 4
+data_list_number = 30
+clients: list[ClientType] = ["human", "openai", "gemini", "claude"]
+
+
+def make_question_template(i: int) -> QuestionTemplate:
+    return {
+        "title": f"Template {i}",
+        "description": f"Template {i}",
+        "question": [{"tag": "p", "value": 0}, {"tag": "p", "value": 1}],
+        "answer": {"type": "text"},
+    }
+
+
+# question_templateごとに、data_listごとに1～5件の回答を様々なclientで追加する
+def seed_cache(json_cache_io: JSON_Cache_IO) -> tuple[list[str], int]:
+    random.seed(0)
+    question_template_hashes: list[str] = []
+    answer_count = 0
+    for i in range(template_number):
+        question_template = make_question_template(i)
+        question_template_hash = haio_hash(question_template)
+        question_template_hashes.append(question_template_hash)
+        for j in range(data_list_number):
+            data_list = [f"data {j}", str(random.random())]
+            records: list[CacheRecord] = [
+                {
+                    "data_list_hash": haio_hash(data_list),
+                    "data_list": data_list,
+                    "cache_id": haio_uid(),
+                    "answer_cache": {
+                        "client": random.choice(clients),
+                        "answer": str(random.randrange(10)),
+                        "created_at": time.time(),
+                    },
+                }
+                for _ in range(random.randint(1, 5))
+            ]
+            json_cache_io.add_answers(
+                question_template_hash=question_template_hash,
+                question_template=question_template,
+                records=records,
+            )
+            answer_count += len(records)
+    return question_template_hashes, answer_count
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as cache_dir:
+        json_cache_io = JSON_Cache_IO(cache_dir)
+        question_template_hashes, answer_count = seed_cache(json_cache_io)
+        sqlite_cache_io = SQLite_Cache_IO(cache_dir)
+
+        migrated_count = migrate_cache(
+            source=json_cache_io, destination=sqlite_cache_io
+        )
+        print("migrated answers:", migrated_count)
+        assert migrated_count == answer_count
+
+        # 移行結果が一致するか確認
+        assert sorted(sqlite_cache_io.question_template_hashes()) == sorted(
+            question_template_hashes
+        )
+        for question_template_hash in question_template_hashes:
+            json_cache = json_cache_io.load(question_template_hash)
+            assert json_cache is not None
+            assert json_cache == sqlite_cache_io.load(question_template_hash)
+
+        # Memory_Cache_IO経由では、参照したdata_listだけをSQLiteから読み込む
+        memory_cache_io = Memory_Cache_IO(sqlite_cache_io)
+        assert memory_cache_io.lookup_by_data_list
+        question_template_hash = question_template_hashes[0]
+        json_cache = json_cache_io.load(question_template_hash)
+        assert json_cache is not None
+        data_list_hash, data_list_cache = next(iter(json_cache["data_lists"].items()))
+        assert (
+            memory_cache_io.get_data_list_cache(question_template_hash, data_list_hash)
+            == data_list_cache
+        )
+        assert list(memory_cache_io.resident[question_template_hash]) == [
+            data_list_hash
+        ]
+        assert memory_cache_io.get_data_list_cache(question_template_hash, "") is None
+
+        # 追加した回答は、SQLiteにある回答に続けて保持する
+        cache_id = haio_uid()
+        memory_cache_io.add_answers(
+            question_template_hash=question_template_hash,
+            question_template=json_cache["question_template"],
+            records=[
+                {
+                    "data_list_hash": data_list_hash,
+                    "data_list": data_list_cache["data_list"],
+                    "cache_id": cache_id,
+                    "answer_cache": {"client": "human", "answer": "new"},
+                }
+            ],
+        )
+        data_list_cache["answer_list"][cache_id] = {"client": "human", "answer": "new"}
+        assert (
+            memory_cache_io.get_data_list_cache(question_template_hash, data_list_hash)
+            == data_list_cache
+        )
+        memory_cache_io.close()
+
+        sqlite_cache_io = SQLite_Cache_IO(cache_dir)
+        assert (
+            sqlite_cache_io.get_data_list_cache(question_template_hash, data_list_hash)
+            == data_list_cache
+        )
+        sqlite_cache_io.close()
+    print("ok")
+
+    # HAIOClient(..., cache_io=SQLite_Cache_IO(cache_dir)) で利用できる
@@ -0,0 +1,90 @@
+from haio import (
+    Cache_IO,
+    JSON_Cache_IO,
+    JSONL_Cache_IO,
+    SQLite_Cache_IO,
+    haio_hash,
+    haio_uid,
+)
+import multiprocessing
+import sys
+import tempfile
+import time
+
+# 複数プロセスから同じhaio_cacheへ書き込み、回答が失われないことを確認する
+
+process_number = 8
+batch_number = 50
+batch_size = 5
+
+question_template = {
+    "title": "Stress test.",
+    "description": "Stress test.",
+    "question": [{"tag": "p", "value": 0}],
+    "answer": {"type": "text"},
+}
+question_template_hash = haio_hash(question_template)
+
+
+def make_cache_io(cache_io_type: str, cache_dir: str) -> Cache_IO:
+    if cache_io_type == "json":
+        return JSON_Cache_IO(cache_dir)
+    elif cache_io_type == "jsonl":
+        return JSONL_Cache_IO(cache_dir, compaction_threshold=100)
+    elif cache_io_type == "sqlite":
+        return SQLite_Cache_IO(cache_dir)
+    raise Exception("Invalid cache_io_type.")
+
+
+def writer(cache_io_type: str, cache_dir: str, writer_index: int) -> None:
+    cache_io = make_cache_io(cache_io_type, cache_dir)
+    for i in range(batch_number):
+        data_list = [f"{writer_index}-{i}"]
+        cache_io.add_answers(
+            question_template_hash=question_template_hash,
+            question_template=question_template,
+            records=[
+                {
+                    "data_list_hash": haio_hash(data_list),
+                    "data_list": data_list,
+                    "cache_id": haio_uid(),
+                    "answer_cache": {"client": "human", "answer": str(j)},
+                }
+                for j in range(batch_size)
+            ],
+        )
+    cache_io.close()
+
+
+def run(cache_io_type: str) -> None:
+    cache_dir = tempfile.mkdtemp()
+    start = time.perf_counter()
+    processes = [
+        multiprocessing.Process(target=writer, args=(cache_io_type, cache_dir, i))
+        for i in range(process_number)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    cache = make_cache_io(cache_io_type, cache_dir).load(question_template_hash)
+    answer_count = (
+        sum(
+            len(data_list_cache["answer_list"])
+            for data_list_cache in cache["data_lists"].values()
+        )
+        if cache is not None
+        else 0
+    )
+    expected_count = process_number * batch_number * batch_size
+    print(
+        f"{cache_io_type}: {answer_count}/{expected_count} answers, {elapsed:.2f}s",
+        "ok" if answer_count == expected_count else "LOST",
+    )
+
+
+if __name__ == "__main__":
+    for cache_io_type in sys.argv[1:] or ["json", "jsonl", "sqlite"]:
+        run(cache_io_type)
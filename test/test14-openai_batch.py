@@ -0,0 +1,170 @@
+from haio import OpenAI_IO, QuestionTemplate, insert_data
+from email.parser import BytesParser
+from email.policy import default
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import asyncio
+import json
+import os
+import threading
+
+# OpenAI_IOのバッチモードを、Batch APIのローカルな代用サーバーで確認する
+
+files: dict[str, bytes] = {}
+batches: dict[str, dict] = {}
+
+
+class Batch_API_Handler(BaseHTTPRequestHandler):
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+    def _send_json(self, obj: dict) -> None:
+        body = json.dumps(obj).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.path == "/v1/files":
+            message = BytesParser(policy=default).parsebytes(
+                b"Content-Type: "
+                + self.headers["Content-Type"].encode()
+                + b"\r\n\r\n"
+                + body
+            )
+            for part in message.iter_parts():
+                if part.get_param("name", header="content-disposition") == "file":
+                    file_id = f"file-{len(files)}"
+                    files[file_id] = part.get_payload(decode=True)
+            self._send_json(
+                {
+                    "id": file_id,
+                    "object": "file",
+                    "bytes": len(files[file_id]),
+                    "created_at": 0,
+                    "filename": "haio_batch.jsonl",
+                    "purpose": "batch",
+                    "status": "processed",
+                }
+            )
+        elif self.path == "/v1/batches":
+            request = json.loads(body)
+            batch_id = f"batch-{len(batches)}"
+            batches[batch_id] = {
+                "id": batch_id,
+                "object": "batch",
+                "endpoint": request["endpoint"],
+                "input_file_id": request["input_file_id"],
+                "completion_window": request["completion_window"],
+                "status": "validating",
+                "created_at": 0,
+                "output_file_id": None,
+                "error_file_id": None,
+            }
+            self._send_json(batches[batch_id])
+        else:
+            self.send_error(404)
+
+    def do_GET(self) -> None:
+        if self.path.startswith("/v1/batches/"):
+            batch = batches[self.path.split("/")[-1]]
+            # 1回目の確認では処理中、2回目で完了とする
+            if batch["status"] == "validating":
+                batch["status"] = "in_progress"
+            elif batch["status"] == "in_progress":
+                output_lines = []
+                for line in files[batch["input_file_id"]].decode().splitlines():
+                    request = json.loads(line)
+                    schema = request["body"]["response_format"]["json_schema"]
+                    answer = schema["schema"]["properties"]["answer"]["enum"][0]
+                    output_lines.append(
+                        json.dumps(
+                            {
+                                "id": "response",
+                                "custom_id": request["custom_id"],
+                                "response": {
+                                    "status_code": 200,
+                                    "body": {
+                                        "choices": [
+                                            {
+                                                "message": {
+                                                    "content": json.dumps(
+                                                        {"answer": answer}
+                                                    )
+                                                }
+                                            }
+                                        ]
+                                    },
+                                },
+                                "error": None,
+                            }
+                        )
+                    )
+                output_file_id = f"file-{len(files)}"
+                files[output_file_id] = "\n".join(output_lines).encode()
+                batch["status"] = "completed"
+                batch["output_file_id"] = output_file_id
+            self._send_json(batch)
+        elif self.path.startswith("/v1/files/") and self.path.endswith("/content"):
+            content = files[self.path.split("/")[-2]]
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        else:
+            self.send_error(404)
+
+
+async def main() -> None:
+    openai_io = OpenAI_IO(batch=True, batch_poll_interval=0.1)
+    question_template: QuestionTemplate = {
+        "title": "Favorite Number",
+        "description": "Please choose your favorite number.",
+        "question": [{"tag": "p", "value": 0}],
+        "answer": {"type": "select", "options": ["1", "2"]},
+    }
+
+    # ask -> flush -> is_finished -> get_answer
+    ids = [openai_io.ask(insert_data(question_template, [str(i)])) for i in range(10)]
+    batch_ids = openai_io.flush()
+    assert len(batch_ids) == 1
+    while not all(openai_io.is_finished(id) for id in ids):
+        await asyncio.sleep(0.1)
+    assert [openai_io.get_answer(id) for id in ids] == ["1"] * 10
+
+    # 同時に待つask_get_answerは1つのバッチにまとめられる
+    batch_count = len(batches)
+    answers = await asyncio.gather(
+        *[
+            openai_io.ask_get_answer(insert_data(question_template, [str(i)]))
+            for i in range(20)
+        ]
+    )
+    assert answers == ["1"] * 20
+    assert len(batches) == batch_count + 1
+
+    # batch_max_sizeを超える分は別のバッチになる
+    openai_io.batch_max_size = 8
+    batch_count = len(batches)
+    answers = await asyncio.gather(
+        *[
+            openai_io.ask_get_answer(insert_data(question_template, [str(i)]))
+            for i in range(20)
+        ]
+    )
+    assert answers == ["1"] * 20
+    assert len(batches) == batch_count + 3
+    await openai_io.aclose()
+    print("ok")
+
+
+if __name__ == "__main__":
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Batch_API_Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+    os.environ["OPENAI_API_KEY"] = "dummy"
+
+    asyncio.run(main())
+    server.shutdown()
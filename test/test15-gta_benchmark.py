@@ -0,0 +1,153 @@
+from haio import GTA_Sample_Cache, HAIOClient, MTurk_IO
+from scipy.stats import beta
+import numpy as np
+import random
+import tempfile
+import time
+
+# _gta_statistical_testの行列演算版と、以前のPythonの二重ループ版を比べる
+# また、GTAの1回の実行の中で検定を繰り返す場合に、GTA_Sample_Cacheでサンプルを使い回す効果を測る
+
+iteration = 1000
+repeat = 20
+step_number = 50
+
+
+# 以前の実装
+def loop_gta_statistical_test(
+    task_clusters: list[HAIOClient.TaskCluster],
+    iteration: int,
+    quality_requirement: float,
+) -> float:
+    beta_distributions_list: list[list[float]] = []
+    for task_cluster in task_clusters:
+        beta_distributions_list.append(
+            beta.rvs(
+                a=task_cluster["correct_count"] + 1,
+                b=task_cluster["incorrect_count"] + 1,
+                size=iteration,
+            )
+        )
+    success_count: int = 0
+    for j in range(iteration):
+        numerator: float = 0
+        denominator: int = 0
+        for i, task_cluster in enumerate(task_clusters):
+            numerator += beta_distributions_list[i][j] * len(
+                task_cluster["task_indexes"]
+            )
+            denominator += len(task_cluster["task_indexes"])
+        if numerator / denominator >= quality_requirement:
+            success_count += 1
+    return 1 - success_count / iteration
+
+
+def make_task_clusters(cluster_number: int) -> list[HAIOClient.TaskCluster]:
+    task_clusters: list[HAIOClient.TaskCluster] = []
+    for i in range(cluster_number):
+        correct_count = random.randint(0, 30)
+        task_clusters.append(
+            {
+                "task_indexes": set(range(random.randint(1, 50))),
+                "client": "openai",
+                "answer": str(i),
+                "correct_count": correct_count,
+                "incorrect_count": random.randint(0, 30 - correct_count),
+            }
+        )
+    return task_clusters
+
+
+# 人間の回答を1つ得るたびに1つのタスククラスタの回数が変わり、未承認の全タスククラスタを検定する
+# (_gta_methodと同じ呼び出し方)
+def run_gta_checks(
+    haio_client: HAIOClient,
+    task_clusters: list[HAIOClient.TaskCluster],
+    use_cache: bool,
+) -> list[float]:
+    approved_task_clusters = task_clusters[: len(task_clusters) // 2]
+    unapproved_task_clusters = task_clusters[len(task_clusters) // 2 :]
+    gta_sample_cache = GTA_Sample_Cache(iteration)
+    p_values: list[float] = []
+    for step in range(step_number):
+        task_cluster = task_clusters[step % len(task_clusters)]
+        task_cluster["correct_count"] += 1
+        for unapproved_task_cluster in unapproved_task_clusters:
+            if use_cache:
+                p_value = gta_sample_cache.test(
+                    approved_task_clusters=approved_task_clusters,
+                    task_cluster=unapproved_task_cluster,
+                    quality_requirement=0.8,
+                )
+            else:
+                p_value = haio_client._gta_statistical_test(
+                    approved_task_clusters + [unapproved_task_cluster],
+                    iteration,
+                    0.8,
+                )
+            p_values.append(p_value)
+    return p_values
+
+
+if __name__ == "__main__":
+    haio_client = HAIOClient(human_io=MTurk_IO(), filepath=tempfile.mkdtemp())
+
+    for cluster_number in [1, 5, 20, 50, 100]:
+        task_clusters = make_task_clusters(cluster_number)
+
+        # 同じ乱数列からは同じp値になる
+        np.random.seed(cluster_number)
+        loop_p_value = loop_gta_statistical_test(task_clusters, iteration, 0.8)
+        np.random.seed(cluster_number)
+        p_value = haio_client._gta_statistical_test(task_clusters, iteration, 0.8)
+        assert abs(p_value - loop_p_value) <= 1 / iteration
+
+        start_time = time.perf_counter()
+        for _ in range(repeat):
+            loop_gta_statistical_test(task_clusters, iteration, 0.8)
+        loop_time = (time.perf_counter() - start_time) / repeat
+
+        start_time = time.perf_counter()
+        for _ in range(repeat):
+            haio_client._gta_statistical_test(task_clusters, iteration, 0.8)
+        vectorized_time = (time.perf_counter() - start_time) / repeat
+
+        print(
+            f"clusters: {cluster_number:3d}, "
+            f"loop: {loop_time * 1000:8.2f} ms, "
+            f"vectorized: {vectorized_time * 1000:6.2f} ms, "
+            f"speedup: {loop_time / vectorized_time:6.1f}x"
+        )
+
+    for cluster_number in [5, 20, 50]:
+        task_clusters = make_task_clusters(cluster_number)
+        initial_counts = [
+            (task_cluster["correct_count"], task_cluster["incorrect_count"])
+            for task_cluster in task_clusters
+        ]
+
+        p_values_list: list[list[float]] = []
+        times: list[float] = []
+        for use_cache in [False, True]:
+            for task_cluster, (correct_count, incorrect_count) in zip(
+                task_clusters, initial_counts
+            ):
+                task_cluster["correct_count"] = correct_count
+                task_cluster["incorrect_count"] = incorrect_count
+            start_time = time.perf_counter()
+            p_values_list.append(run_gta_checks(haio_client, task_clusters, use_cache))
+            times.append(time.perf_counter() - start_time)
+
+        # 乱数によるずれを除けば、同じ検定になっている
+        mean_difference = np.mean(
+            np.abs(np.array(p_values_list[0]) - np.array(p_values_list[1]))
+        )
+        assert mean_difference < 0.02
+
+        print(
+            f"clusters: {cluster_number:3d}, "
+            f"checks: {len(p_values_list[0]):5d}, "
+            f"full: {times[0] * 1000:8.1f} ms, "
+            f"incremental: {times[1] * 1000:6.1f} ms, "
+            f"speedup: {times[0] / times[1]:6.1f}x"
+        )
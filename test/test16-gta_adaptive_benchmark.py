@@ -0,0 +1,121 @@
+from haio import GTA_Sample_Cache, HAIOClient
+import numpy as np
+import random
+import time
+
+# GTAの実行と同じ呼び出し方で、GTA_Sample_Cacheの検定を
+# iteration回に固定した場合と、chunk_size回ずつ増やして承認するかどうかが決まった時点で打ち切る場合とで比べる
+
+significance_level = 0.05
+quality_requirement = 0.8
+run_number = 20
+step_number = 100
+
+
+# 正解率の異なるタスククラスタの組を作る (p値が0付近のものから1付近のものまで混ざる)
+def make_task_clusters() -> tuple[list[HAIOClient.TaskCluster], list[float]]:
+    task_clusters: list[HAIOClient.TaskCluster] = []
+    accuracies: list[float] = []
+    for i in range(random.randint(2, 10)):
+        task_clusters.append(
+            {
+                "task_indexes": set(range(random.randint(1, 50))),
+                "client": "openai",
+                "answer": str(i),
+                "correct_count": 0,
+                "incorrect_count": 0,
+            }
+        )
+        accuracies.append(random.uniform(0.6, 1.0))
+    return task_clusters, accuracies
+
+
+# 人間の回答を1つ得るたびに1つのタスククラスタの回数を変え、未承認の全タスククラスタを検定する
+# 承認するかどうかは固定した場合の結果で決め、同じ呼び出しを打ち切る場合にも行う
+# (固定した場合の時間, 打ち切る場合の時間, 固定した場合のp値のリスト, 打ち切る場合のp値のリスト) を返す
+def run_gta(
+    iteration: int, chunk_size: int
+) -> tuple[float, float, list[float], list[float]]:
+    task_clusters, accuracies = make_task_clusters()
+    approved_task_clusters: list[HAIOClient.TaskCluster] = []
+    fixed_cache = GTA_Sample_Cache(iteration)
+    adaptive_cache = GTA_Sample_Cache(iteration, chunk_size=chunk_size)
+    fixed_time = 0.0
+    adaptive_time = 0.0
+    fixed_p_values: list[float] = []
+    adaptive_p_values: list[float] = []
+    for _ in range(step_number):
+        i = random.randrange(len(task_clusters))
+        if random.random() < accuracies[i]:
+            task_clusters[i]["correct_count"] += 1
+        else:
+            task_clusters[i]["incorrect_count"] += 1
+        for task_cluster in task_clusters:
+            if any(task_cluster is approved for approved in approved_task_clusters):
+                continue
+            start_time = time.perf_counter()
+            fixed_p_value = fixed_cache.test(
+                approved_task_clusters=approved_task_clusters,
+                task_cluster=task_cluster,
+                quality_requirement=quality_requirement,
+            )
+            fixed_time += time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            adaptive_p_value = adaptive_cache.test(
+                approved_task_clusters=approved_task_clusters,
+                task_cluster=task_cluster,
+                quality_requirement=quality_requirement,
+                significance_level=significance_level,
+            )
+            adaptive_time += time.perf_counter() - start_time
+
+            fixed_p_values.append(fixed_p_value)
+            adaptive_p_values.append(adaptive_p_value)
+            if fixed_p_value < significance_level:
+                approved_task_clusters.append(task_cluster)
+    return fixed_time, adaptive_time, fixed_p_values, adaptive_p_values
+
+
+if __name__ == "__main__":
+    for iteration, chunk_size in [(1000, 100), (1000, 200), (10000, 100)]:
+        random.seed(0)
+        np.random.seed(0)
+        fixed_time = 0.0
+        adaptive_time = 0.0
+        fixed_p_values: list[float] = []
+        adaptive_p_values: list[float] = []
+        for _ in range(run_number):
+            result = run_gta(iteration, chunk_size)
+            fixed_time += result[0]
+            adaptive_time += result[1]
+            fixed_p_values.extend(result[2])
+            adaptive_p_values.extend(result[3])
+
+        fixed_decisions = [p_value < significance_level for p_value in fixed_p_values]
+        adaptive_decisions = [
+            p_value < significance_level for p_value in adaptive_p_values
+        ]
+        disagreement_count = sum(
+            fixed_decision != adaptive_decision
+            for fixed_decision, adaptive_decision in zip(
+                fixed_decisions, adaptive_decisions
+            )
+        )
+        # 判定が分かれるのは、p値がsignificance_levelに近い場合のみ
+        assert all(
+            abs(fixed_p_value - significance_level) < 0.05
+            for fixed_p_value, fixed_decision, adaptive_decision in zip(
+                fixed_p_values, fixed_decisions, adaptive_decisions
+            )
+            if fixed_decision != adaptive_decision
+        )
+        print(
+            f"iteration: {iteration:5d}, chunk: {chunk_size:4d}, "
+            f"checks: {len(fixed_p_values)}, "
+            f"fixed: {fixed_time * 1000:7.1f} ms, "
+            f"adaptive: {adaptive_time * 1000:7.1f} ms, "
+            f"approved checks: {sum(fixed_decisions)} -> {sum(adaptive_decisions)}, "
+            f"different decisions: {disagreement_count}, "
+            f"speedup: {fixed_time / adaptive_time:4.1f}x"
+        )
@@ -0,0 +1,57 @@
+from haio import is_cta_approved
+from scipy.stats import binomtest
+import time
+
+# CTAの承認判定を、閾値表を引く場合と毎回binomtestを呼ぶ場合とで比べる
+
+max_n = 200
+settings = [(0.5, 0.05), (0.8, 0.05), (0.8, 0.01), (0.9, 0.1), (0.95, 0.05)]
+
+
+def binomtest_approved(
+    correct_count: int,
+    incorrect_count: int,
+    quality_requirement: float,
+    significance_level: float,
+) -> bool:
+    binomtest_result = binomtest(
+        k=correct_count,
+        n=correct_count + incorrect_count,
+        p=quality_requirement,
+        alternative="greater",
+    )
+    return binomtest_result.pvalue < significance_level
+
+
+if __name__ == "__main__":
+    for quality_requirement, significance_level in settings:
+        # 全ての(k, n)で判定が一致する
+        cases = [(k, n - k) for n in range(1, max_n + 1) for k in range(n + 1)]
+
+        start_time = time.perf_counter()
+        binomtest_decisions = [
+            binomtest_approved(
+                correct_count, incorrect_count, quality_requirement, significance_level
+            )
+            for correct_count, incorrect_count in cases
+        ]
+        binomtest_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        table_decisions = [
+            is_cta_approved(
+                correct_count, incorrect_count, quality_requirement, significance_level
+            )
+            for correct_count, incorrect_count in cases
+        ]
+        table_time = time.perf_counter() - start_time
+        assert table_decisions == binomtest_decisions
+
+        print(
+            f"quality_requirement: {quality_requirement:.2f}, "
+            f"significance_level: {significance_level:.2f}, "
+            f"checks: {len(cases)}, "
+            f"binomtest: {binomtest_time * 1000:7.1f} ms, "
+            f"table: {table_time * 1000:5.1f} ms, "
+            f"speedup: {binomtest_time / table_time:6.1f}x"
+        )
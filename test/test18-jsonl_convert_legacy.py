@@ -0,0 +1,86 @@
+from haio import (
+    CacheRecord,
+    HAIOClient,
+    JSON_Cache_IO,
+    JSONL_Cache_IO,
+    MTurk_IO,
+    QuestionTemplate,
+)
+import os
+import tempfile
+
+# 同じquestion_templateについて、旧形式(JSON_Cache_IO)のファイルと
+# JSONL_Cache_IOのスナップショット・ジャーナルが両方ある状態から、HAIOClient.convert_legacy_cacheで変換する
+
+question_template: QuestionTemplate = {
+    "title": "Favorite Number",
+    "description": "Please choose your favorite number.",
+    "question": [{"tag": "p", "value": 0}],
+    "answer": {"type": "select", "options": ["1", "2"]},
+}
+question_template_hash = "template"
+
+
+def make_records(cache_ids: list[str]) -> list[CacheRecord]:
+    return [
+        {
+            "data_list_hash": f"data_list_{i % 2}",
+            "data_list": [str(i % 2)],
+            "cache_id": cache_id,
+            "answer_cache": {"client": "human", "answer": "1"},
+        }
+        for i, cache_id in enumerate(cache_ids)
+    ]
+
+
+def get_cache_ids(cache_io: JSONL_Cache_IO) -> set[str]:
+    cache = cache_io.load(question_template_hash)
+    assert cache is not None
+    return {
+        cache_id
+        for data_list_cache in cache["data_lists"].values()
+        for cache_id in data_list_cache["answer_list"]
+    }
+
+
+if __name__ == "__main__":
+    filepath = tempfile.mkdtemp()
+    cache_dir = os.path.join(filepath, "haio_cache")
+    os.makedirs(cache_dir)
+
+    # スナップショット
+    jsonl_cache_io = JSONL_Cache_IO(cache_dir)
+    jsonl_cache_io.add_answers(
+        question_template_hash, question_template, make_records(["d", "e"])
+    )
+    jsonl_cache_io.compact(question_template_hash)
+    # 旧形式のファイル
+    JSON_Cache_IO(cache_dir).add_answers(
+        question_template_hash, question_template, make_records(["a", "b", "c"])
+    )
+    # ジャーナル
+    JSONL_Cache_IO(cache_dir).add_answers(
+        question_template_hash, question_template, make_records(["f"])
+    )
+    for extension in ["", ".json", ".jsonl"]:
+        assert os.path.isfile(
+            os.path.join(cache_dir, question_template_hash + extension)
+        )
+
+    # 変換前でも、両方のファイルの回答が読める
+    jsonl_cache_io = JSONL_Cache_IO(cache_dir)
+    assert get_cache_ids(jsonl_cache_io) == {"a", "b", "c", "d", "e", "f"}
+
+    haio_client = HAIOClient(
+        human_io=MTurk_IO(), filepath=filepath, cache_io=jsonl_cache_io
+    )
+    assert haio_client.convert_legacy_cache() == 1
+
+    # 旧形式のファイルとジャーナルはスナップショットに畳み込まれ、回答は失われない
+    assert not os.path.isfile(os.path.join(cache_dir, question_template_hash))
+    assert not os.path.isfile(
+        os.path.join(cache_dir, question_template_hash + ".jsonl")
+    )
+    assert get_cache_ids(JSONL_Cache_IO(cache_dir)) == {"a", "b", "c", "d", "e", "f"}
+    assert haio_client.convert_legacy_cache() == 0
+    print("ok")
@@ -0,0 +1,131 @@
+from haio import Answer, HAIOClient, QuestionConfig, QuestionTemplate, Worker_IO
+import haio.haio_client
+import asyncio
+import tempfile
+import time
+
+# 人間への質問を同時に出す場合(human_parallelism > 1)に、判定に使わなかった質問の数が報告され、
+# その回答も取り消されずにキャッシュへ追加され、同じセッションの後の質問で使えることを、偽のWorker_IOで確認する
+
+haio.haio_client.check_frequency = 0.01
+
+question_template: QuestionTemplate = {
+    "title": "Favorite Number",
+    "description": "Please choose your favorite number.",
+    "question": [{"tag": "p", "value": 0}],
+    "answer": {"type": "select", "options": ["1", "2"]},
+}
+
+
+# 質問からdelay秒後に回答が届く人間 (質問ごとにdelayの1～3倍に散らす)
+class Fake_Human_IO(Worker_IO):
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        self.asked: dict[str, float] = {}
+        self.ask_count = 0
+        self.answer_count = 0
+
+    def ask(self, question_config: QuestionConfig) -> str:
+        id = str(self.ask_count)
+        self.asked[id] = time.monotonic() + self.delay * (1 + self.ask_count % 3)
+        self.ask_count += 1
+        return id
+
+    def is_finished(self, id: str) -> bool:
+        return time.monotonic() >= self.asked[id]
+
+    def get_answer(self, id: str) -> Answer:
+        self.asked.pop(id)
+        self.answer_count += 1
+        return "1"
+
+    async def ask_get_answer(self, question_config: QuestionConfig) -> Answer:
+        id = self.ask(question_config)
+        while not self.is_finished(id):
+            await asyncio.sleep(0.01)
+        return self.get_answer(id)
+
+
+# 常に人間と同じ回答をするAI
+class Fake_AI_IO(Fake_Human_IO):
+    def __init__(self) -> None:
+        super().__init__(0.0)
+
+
+def count_human_cache(haio_client: HAIOClient) -> int:
+    return sum(
+        answer_cache["client"] == "human"
+        for question_template_hash in haio_client.cache_io.question_template_hashes()
+        for _, data_list_cache in haio_client.cache_io.iter_data_list_caches(
+            question_template_hash
+        )
+        for answer_cache in data_list_cache["answer_list"].values()
+    )
+
+
+# 使用済みになっている人間の回答の数
+def count_used_human_cache(haio_client: HAIOClient) -> int:
+    return sum(
+        answer_cache["client"] == "human"
+        for question_template_hash, used_cache in haio_client.used_cache.items()
+        for data_list_hash, data_list_cache in haio_client.cache_io.iter_data_list_caches(
+            question_template_hash
+        )
+        for cache_id, answer_cache in data_list_cache["answer_list"].items()
+        if cache_id in used_cache.get(data_list_hash, set())
+    )
+
+
+async def main() -> None:
+    for method in ["cta", "gta"]:
+        for human_parallelism in [1, 8]:
+            human_io = Fake_Human_IO(delay=0.02)
+            haio_client = HAIOClient(
+                human_io=human_io,
+                openai_io=Fake_AI_IO(),  # type: ignore
+                filepath=tempfile.mkdtemp(),
+            )
+            asked_questions = [
+                haio_client.ask(question_template, [str(i)]) for i in range(100)
+            ]
+            answer_info = await haio_client.wait(
+                asked_questions,
+                {
+                    "method": method,
+                    "quality_requirement": 0.8,
+                    "human_parallelism": human_parallelism,
+                },
+            )
+            assert isinstance(answer_info, dict)
+            assert answer_info["answer_list"] == ["1"] * 100
+            # 出した質問は、判定に使ったものと使わなかったもののどちらか
+            assert (
+                answer_info["add_human_assign"] + answer_info["unused_human_assign"]
+                == human_io.ask_count
+            )
+            if human_parallelism == 1:
+                assert answer_info["unused_human_assign"] == 0
+            else:
+                assert answer_info["unused_human_assign"] > 0
+
+            # 判定に使わなかった質問の回答も、待てば全てキャッシュに入る
+            await haio_client.aflush()
+            assert not haio_client.background_tasks
+            assert human_io.answer_count == human_io.ask_count
+            assert count_human_cache(haio_client) == human_io.ask_count
+            # 判定に使わなかった回答は使用済みから外れる
+            assert (
+                count_used_human_cache(haio_client) == answer_info["add_human_assign"]
+            )
+            await haio_client.aclose()
+
+            print(
+                f"method: {method}, human_parallelism: {human_parallelism}, "
+                f"add_human_assign: {answer_info['add_human_assign']}, "
+                f"unused_human_assign: {answer_info['unused_human_assign']}"
+            )
+    print("ok")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,130 @@
+from haio import (
+    Answer,
+    HAIOClient,
+    MTurk_IO,
+    QuestionConfig,
+    QuestionTemplate,
+    Worker_IO,
+)
+import haio.haio_client
+import asyncio
+import contextlib
+import io
+import math
+import re
+import tempfile
+import time
+
+# MTurk_IOのpack_sizeで、HAIOClient.waitの人間への質問がpack_size問ずつ1つのHITにまとまることを、
+# MTurkの代用クライアントで確認する
+
+haio.haio_client.check_frequency = 0.01
+
+question_template: QuestionTemplate = {
+    "title": "Favorite Number",
+    "description": "Please choose your favorite number.",
+    "question": [{"tag": "p", "value": 0}],
+    "answer": {"type": "select", "options": ["1", "2"]},
+}
+
+
+# create_hitからdelay秒後にHITがReviewableになり、全ての回答欄 (response_0, response_1, ...) に"1"と答えるMTurk
+class Stub_MTurk_Client:
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        self.hits: dict[str, tuple[float, int]] = {}
+        self.reviewing_hit_ids: set[str] = set()
+        self.create_hit_count = 0
+
+    def create_hit(self, **kwargs: str) -> dict:
+        self.create_hit_count += 1
+        hit_id = f"HIT{self.create_hit_count}"
+        response_count = len(re.findall(r'name="response', kwargs["Question"]))
+        self.hits[hit_id] = (time.monotonic() + self.delay, response_count)
+        return {"HIT": {"HITId": hit_id, "HITTypeId": "HITType"}}
+
+    def list_reviewable_hits(self, **kwargs: str | int) -> dict:
+        return {
+            "HITs": [
+                {"HITId": hit_id}
+                for hit_id, (finish_time, _) in self.hits.items()
+                if finish_time <= time.monotonic()
+                and hit_id not in self.reviewing_hit_ids
+            ]
+        }
+
+    def list_assignments_for_hit(self, HITId: str) -> dict:
+        _, response_count = self.hits[HITId]
+        answer = "".join(
+            f"<Answer><QuestionIdentifier>response_{index}</QuestionIdentifier>"
+            f"<FreeText>1</FreeText></Answer>"
+            for index in range(response_count)
+        )
+        return {
+            "Assignments": [
+                {
+                    "Answer": '<QuestionFormAnswers xmlns="http://mechanicalturk.amazonaws.com/AWSMechanicalTurkDataSchemas/2005-10-01/QuestionFormAnswers.xsd">'
+                    + answer
+                    + "</QuestionFormAnswers>"
+                }
+            ]
+        }
+
+    def update_hit_review_status(self, HITId: str, Revert: bool) -> None:
+        self.reviewing_hit_ids.add(HITId)
+
+
+# 常に人間と同じ回答をするAI
+class Fake_AI_IO(Worker_IO):
+    def ask(self, question_config: QuestionConfig) -> str:
+        return ""
+
+    def is_finished(self, id: str) -> bool:
+        return True
+
+    def get_answer(self, id: str) -> Answer:
+        return "1"
+
+    async def ask_get_answer(self, question_config: QuestionConfig) -> Answer:
+        return "1"
+
+
+async def main() -> None:
+    question_number = 23
+    pack_size = 5
+    for execution_config in [
+        {"method": "simple", "client": "human"},
+        {"method": "cta", "quality_requirement": 0.8, "human_parallelism": 10},
+    ]:
+        mturk_io = MTurk_IO(poll_interval=0.01, pack_size=pack_size)
+        stub_client = Stub_MTurk_Client(delay=0.05)
+        mturk_io.mturk_client = stub_client  # type: ignore
+        haio_client = HAIOClient(
+            human_io=mturk_io,
+            openai_io=Fake_AI_IO(),  # type: ignore
+            filepath=tempfile.mkdtemp(),
+        )
+        asked_questions = [
+            haio_client.ask(question_template, [str(i)]) for i in range(question_number)
+        ]
+        with contextlib.redirect_stdout(io.StringIO()):
+            answer_info = await haio_client.wait(asked_questions, execution_config)
+        assert isinstance(answer_info, dict)
+        assert answer_info["answer_list"] == ["1"] * question_number
+        human_assign = answer_info["add_human_assign"] + answer_info.get(
+            "unused_human_assign", 0
+        )
+        # 質問は1問ずつではなく、おおよそpack_size問ずつHITになる
+        # (cta/gtaでは同じHITの回答を受け取る時刻が少しずれると、補充する質問が分かれてHITになることがある)
+        assert stub_client.create_hit_count <= 2 * math.ceil(human_assign / pack_size)
+        await haio_client.aclose()
+        print(
+            f"method: {execution_config['method']}, "
+            f"human_assign: {human_assign}, "
+            f"create_hit: {stub_client.create_hit_count}"
+        )
+    print("ok")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
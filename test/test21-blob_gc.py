@@ -0,0 +1,120 @@
+from haio import (
+    Blob_Store,
+    Cache_IO,
+    JSON_Cache_IO,
+    JSONL_Cache_IO,
+    Memory_Cache_IO,
+    SQLite_Cache_IO,
+    haio_hash,
+    haio_uid,
+)
+import os
+import tempfile
+import time
+
+# Memory_Cache_IOのmax_bytesでquestion_templateを削除したとき、
+# そのquestion_templateだけが参照していたblobも削除され、他から参照されるblobは残ることを確認する
+# get_sizesとmax_bytesにblobのバイト数が含まれることも確認する
+
+blob_size = 100000
+
+
+def make_question_template(name: str) -> dict:
+    return {
+        "title": name,
+        "description": name,
+        "question": [{"tag": "img", "src": 0}],
+        "answer": {"type": "text"},
+    }
+
+
+def make_cache_io(cache_io_type: str, cache_dir: str) -> Cache_IO:
+    if cache_io_type == "json":
+        return JSON_Cache_IO(cache_dir)
+    elif cache_io_type == "jsonl":
+        return JSONL_Cache_IO(cache_dir)
+    elif cache_io_type == "sqlite":
+        return SQLite_Cache_IO(cache_dir)
+    raise Exception("Invalid cache_io_type.")
+
+
+def add_answer(cache_io: Cache_IO, name: str, data_list: list[str]) -> str:
+    question_template = make_question_template(name)
+    question_template_hash = haio_hash(question_template)
+    cache_io.add_answers(
+        question_template_hash=question_template_hash,
+        question_template=question_template,
+        records=[
+            {
+                "data_list_hash": haio_hash(data_list),
+                "data_list": data_list,
+                "cache_id": haio_uid(),
+                "answer_cache": {
+                    "client": "human",
+                    "answer": "a",
+                    "created_at": time.time(),
+                },
+            }
+        ],
+    )
+    return question_template_hash
+
+
+def count_blobs(blob_dir: str) -> int:
+    return sum(
+        len(os.listdir(os.path.join(blob_dir, shard)))
+        for shard in os.listdir(blob_dir)
+        if os.path.isdir(os.path.join(blob_dir, shard))
+    )
+
+
+def run(cache_io_type: str) -> None:
+    with tempfile.TemporaryDirectory() as cache_dir:
+        blob_dir = os.path.join(cache_dir, "blobs")
+        backend = make_cache_io(cache_io_type, cache_dir)
+        cache_io = Memory_Cache_IO(
+            backend,
+            max_templates=1,
+            flush_size=1,
+            max_bytes=int(blob_size * 2.5),
+            eviction_interval=0.0,
+            blob_store=Blob_Store(blob_dir),
+        )
+        old_blob = "old" * (blob_size // 3)
+        shared_blob = "shared" * (blob_size // 6)
+        new_blob = "new" * (blob_size // 3)
+
+        # oldだけが参照するblobと、oldとnewが参照するblob
+        old_hash = add_answer(cache_io, "old", [old_blob])
+        add_answer(cache_io, "old", [shared_blob])
+        assert count_blobs(blob_dir) == 2
+
+        # blobのバイト数もquestion_templateのサイズに含める
+        sizes = cache_io.get_sizes()
+        assert sizes[old_hash][0] == backend.get_sizes()[old_hash][0] + len(
+            old_blob
+        ) + len(shared_blob)
+
+        # newを追加するとblobの合計がmax_bytesを超え、メモリ上にないoldが削除される
+        new_hash = add_answer(cache_io, "new", [shared_blob])
+        assert backend.exists(old_hash)
+        add_answer(cache_io, "new", [new_blob])
+        cache_io.close()
+
+        backend = make_cache_io(cache_io_type, cache_dir)
+        assert not backend.exists(old_hash)
+        assert backend.exists(new_hash)
+        # oldだけが参照していたblobは削除され、newも参照するblobは残る
+        assert count_blobs(blob_dir) == 2
+        blob_store = Blob_Store(blob_dir)
+        data_lists = list(backend.iter_data_lists(new_hash))
+        assert sorted(
+            blob_store.get_data_list(data_list)[0] for data_list in data_lists
+        ) == sorted([new_blob, shared_blob])
+        backend.close()
+    print(cache_io_type, "ok")
+
+
+if __name__ == "__main__":
+    for cache_io_type in ["json", "jsonl", "sqlite"]:
+        run(cache_io_type)